@@ -10,8 +10,104 @@ class Settings(BaseModel):
     secret_key: str = os.getenv("SECRET_KEY", "CHANGE_ME_IN_PROD")
     algorithm: str = os.getenv("JWT_ALGORITHM", "HS256")
     access_token_expire_minutes: int = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+    bcrypt_rounds: int = int(os.getenv("BCRYPT_ROUNDS", "12"))
+    password_hash_workers: int = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+    password_hash_max_pending: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+    auth_cache_size: int = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+    auth_cache_ttl_seconds: float = float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
 
     # Database
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    # Unset: ping on checkout for server databases, skip it for SQLite files
+    db_pool_pre_ping: bool | None = (
+        os.getenv("DB_POOL_PRE_PING").lower() in ("1", "true", "yes") if os.getenv("DB_POOL_PRE_PING") else None
+    )
+
+    # SQLite connect-time pragmas
+    sqlite_journal_mode: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    sqlite_synchronous: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    sqlite_cache_size_kb: int = int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536"))
+    sqlite_busy_timeout_ms: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+    # Expression engine
+    expression_cache_size: int = int(os.getenv("EXPRESSION_CACHE_SIZE", "1024"))
+    # Budgets checked before an expression is evaluated (magnitude: per operation)
+    expression_max_length: int = int(os.getenv("EXPRESSION_MAX_LENGTH", "2000"))
+    expression_max_nodes: int = int(os.getenv("EXPRESSION_MAX_NODES", "1000"))
+    expression_max_depth: int = int(os.getenv("EXPRESSION_MAX_DEPTH", "100"))
+    expression_max_magnitude: float = float(os.getenv("EXPRESSION_MAX_MAGNITUDE", "1e300"))
+
+    # Parameter sweeps
+    sweep_max_rows: int = int(os.getenv("SWEEP_MAX_ROWS", "10000000"))
+    sweep_chunk_rows: int = int(os.getenv("SWEEP_CHUNK_ROWS", "65536"))
+
+    # /api/stats/timeseries: most buckets one request may span
+    timeseries_max_buckets: int = int(os.getenv("TIMESERIES_MAX_BUCKETS", "2000"))
+
+    # Retention: calculations older than retention_days move to the archive
+    # table, in batches with a pause between them. The background job only
+    # runs with retention_enabled; `python -m app.db.archive_history` runs it once.
+    retention_enabled: bool = os.getenv("RETENTION_ENABLED", "false").lower() in ("1", "true", "yes")
+    retention_days: float = float(os.getenv("RETENTION_DAYS", "365"))
+    retention_interval_seconds: float = float(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+    retention_batch_rows: int = int(os.getenv("RETENTION_BATCH_ROWS", "1000"))
+    retention_batch_pause_ms: float = float(os.getenv("RETENTION_BATCH_PAUSE_MS", "50"))
+
+    # History export
+    export_chunk_rows: int = int(os.getenv("EXPORT_CHUNK_ROWS", "5000"))
+
+    # History import: rows evaluated and committed per chunk, rejected rows
+    # listed individually in the report (the rest are only counted)
+    import_chunk_rows: int = int(os.getenv("IMPORT_CHUNK_ROWS", "5000"))
+    import_max_errors: int = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))
+
+    # Write-behind (group commit) for /api/calculate
+    write_behind_enabled: bool = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() in ("1", "true", "yes")
+    write_behind_batch_size: int = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "500"))
+    write_behind_flush_ms: float = float(os.getenv("WRITE_BEHIND_FLUSH_MS", "50"))
+    write_behind_max_queue: int = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000"))
+
+    # Batch calculations
+    batch_max_items: int = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+
+    # Admission control: a per-user token bucket on the calculation and export
+    # routes, and a per-worker cap on concurrent sweeps and exports.
+    # Backend: "memory" (per process), "database" (shared by workers) or
+    # "package.module:Class" for a custom shared backend.
+    admission_enabled: bool = os.getenv("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+    admission_backend: str = os.getenv("ADMISSION_BACKEND", "memory")
+    admission_rate: float = float(os.getenv("ADMISSION_RATE", "20"))
+    admission_burst: float = float(os.getenv("ADMISSION_BURST", "40"))
+    admission_max_keys: int = int(os.getenv("ADMISSION_MAX_KEYS", "10000"))
+    admission_heavy_concurrency: int = int(os.getenv("ADMISSION_HEAVY_CONCURRENCY", "4"))
+
+    # Per-route request and query metrics on /metrics
+    metrics_enabled: bool = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+    # SQL tracing: slow-query log and repeated-statement (N+1) warnings
+    sql_trace_enabled: bool = os.getenv("SQL_TRACE_ENABLED", "true").lower() in ("1", "true", "yes")
+    sql_slow_ms: float = float(os.getenv("SQL_SLOW_MS", "100"))
+    sql_repeat_threshold: int = int(os.getenv("SQL_REPEAT_THRESHOLD", "5"))
+
+    # Cold start: `python -m app.core.startup_report` fails above this import time
+    startup_import_budget_ms: float = float(os.getenv("STARTUP_IMPORT_BUDGET_MS", "1500"))
+
+    # Server-rendered pages
+    template_cache_size: int = int(os.getenv("TEMPLATE_CACHE_SIZE", "2048"))
+    templates_auto_reload: bool = os.getenv("TEMPLATES_AUTO_RELOAD", "false").lower() in ("1", "true", "yes")
+
+    # Undo/redo history: "memory" (per process) or "database" (shared by workers)
+    undo_backend: str = os.getenv("UNDO_BACKEND", "memory")
+    undo_depth: int = int(os.getenv("UNDO_DEPTH", "50"))
+    undo_max_sessions: int = int(os.getenv("UNDO_MAX_SESSIONS", "10000"))
+    # Database store: stacks of sessions idle this long are deleted
+    undo_session_ttl_seconds: float = float(os.getenv("UNDO_SESSION_TTL_SECONDS", str(7 * 24 * 3600)))
+    # Larger /api/undo/push bodies are rejected with 413
+    undo_max_payload_bytes: int = int(os.getenv("UNDO_MAX_PAYLOAD_BYTES", "1024"))
 
 settings = Settings()
@@ -0,0 +1,239 @@
+"""
+Request and database metrics, exported in Prometheus text format.
+
+Hot-path updates never take a lock: every thread writes into its own shard
+(counters and preallocated histogram bucket lists), and a scrape merges the
+shards. When a thread ends (anyio retires idle worker threads) its shard is
+folded into a retired total and dropped, so the shard list stays as long as
+the number of live threads. Request metrics are written from the event loop thread; query
+metrics from whichever thread runs the cursor, and they are also attributed
+to the current request through a context variable that follows the request
+into the threadpool and into AsyncSession.run_sync.
+"""
+import threading
+import time
+import weakref
+from bisect import bisect_left
+
+from app.core.query_hooks import RequestQueries, add_statement_observer, track_request, untrack_request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERIES_PER_REQUEST_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+
+
+class _RouteStats:
+    __slots__ = ("requests", "status", "latency", "latency_sum", "db_queries", "db_queries_sum", "db_seconds")
+
+    def __init__(self):
+        self.requests = 0
+        self.status = [0] * len(STATUS_CLASSES)
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.db_queries = [0] * (len(QUERIES_PER_REQUEST_BUCKETS) + 1)
+        self.db_queries_sum = 0
+        self.db_seconds = 0.0
+
+
+class _Shard:
+    __slots__ = ("routes", "in_flight", "queries", "query_latency", "query_seconds")
+
+    def __init__(self):
+        self.routes: dict[tuple[str, str], _RouteStats] = {}
+        self.in_flight = 0
+        self.queries = 0
+        self.query_latency = [0] * (len(QUERY_BUCKETS) + 1)
+        self.query_seconds = 0.0
+
+
+class _ShardOwner:
+    """Referenced only by the thread-local, so it is collected when its thread ends."""
+
+    __slots__ = ("__weakref__",)
+
+
+_local = threading.local()
+_shards: list[_Shard] = []
+_retired = _Shard()
+_shards_lock = threading.Lock()
+
+
+def _shard() -> _Shard:
+    shard = getattr(_local, "shard", None)
+    if shard is None:
+        shard = _local.shard = _Shard()
+        _local.owner = _ShardOwner()
+        weakref.finalize(_local.owner, _retire, shard).atexit = False
+        with _shards_lock:
+            _shards.append(shard)
+    return shard
+
+
+def _retire(shard: _Shard) -> None:
+    with _shards_lock:
+        _shards.remove(shard)
+        _add(_retired, shard)
+
+
+def _route_stats(method: str, route: str) -> _RouteStats:
+    routes = _shard().routes
+    stats = routes.get((method, route))
+    if stats is None:
+        stats = routes[(method, route)] = _RouteStats()
+    return stats
+
+
+def _observe_statement(statement: str, elapsed: float, request: RequestQueries | None) -> None:
+    shard = _shard()
+    shard.queries += 1
+    shard.query_seconds += elapsed
+    shard.query_latency[bisect_left(QUERY_BUCKETS, elapsed)] += 1
+
+
+add_statement_observer(_observe_statement)
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/stream overhead). Latency
+    runs until the last body chunk is sent, so streamed responses count in
+    full. Requests are labelled with the matched route template; anything
+    that matched no route shares the "unmatched" label.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        request_db, token = track_request(scope)
+        status = 500
+        # Incremented and decremented on the event loop thread, so one shard
+        shard = _shard()
+        shard.in_flight += 1
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            shard.in_flight -= 1
+            untrack_request(token)
+            route = scope.get("route")
+            stats = _route_stats(scope["method"], getattr(route, "path", None) or "unmatched")
+            elapsed = time.perf_counter() - started
+            stats.requests += 1
+            stats.status[min(max(status // 100, 1), 5) - 1] += 1
+            stats.latency[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            stats.latency_sum += elapsed
+            stats.db_queries[bisect_left(QUERIES_PER_REQUEST_BUCKETS, request_db.count)] += 1
+            stats.db_queries_sum += request_db.count
+            stats.db_seconds += request_db.seconds
+
+
+def _add(total: _Shard, shard: _Shard) -> None:
+    total.in_flight += shard.in_flight
+    total.queries += shard.queries
+    total.query_seconds += shard.query_seconds
+    total.query_latency = [a + b for a, b in zip(total.query_latency, shard.query_latency)]
+    for key, stats in list(shard.routes.items()):
+        merged = total.routes.get(key)
+        if merged is None:
+            merged = total.routes[key] = _RouteStats()
+        merged.requests += stats.requests
+        merged.status = [a + b for a, b in zip(merged.status, stats.status)]
+        merged.latency = [a + b for a, b in zip(merged.latency, stats.latency)]
+        merged.latency_sum += stats.latency_sum
+        merged.db_queries = [a + b for a, b in zip(merged.db_queries, stats.db_queries)]
+        merged.db_queries_sum += stats.db_queries_sum
+        merged.db_seconds += stats.db_seconds
+
+
+def _merge() -> tuple[dict[tuple[str, str], _RouteStats], _Shard]:
+    total = _Shard()
+    # Held throughout so a shard cannot be retired (and counted twice) mid-merge
+    with _shards_lock:
+        _add(total, _retired)
+        for shard in _shards:
+            _add(total, shard)
+    return total.routes, total
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _histogram(lines: list[str], name: str, bounds, counts: list[int], total: float, **labels) -> None:
+    cumulative = 0
+    for bound, count in zip(bounds, counts):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    cumulative += counts[-1]
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {cumulative}")
+    lines.append(f"{name}_sum{_labels(**labels)} {total}")
+    lines.append(f"{name}_count{_labels(**labels)} {cumulative}")
+
+
+def render_prometheus() -> str:
+    routes, totals = _merge()
+    lines = [
+        "# HELP http_requests_total Requests by route template and status class.",
+        "# TYPE http_requests_total counter",
+    ]
+    served = sorted(routes.items(), key=lambda item: item[0])
+    for (method, route), stats in served:
+        for status_class, count in zip(STATUS_CLASSES, stats.status):
+            if count:
+                lines.append(f"http_requests_total{_labels(method=method, route=route, status=status_class)} {count}")
+
+    lines += [
+        "# HELP http_request_duration_seconds Time until the last response byte was sent.",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, route), stats in served:
+        _histogram(lines, "http_request_duration_seconds", LATENCY_BUCKETS, stats.latency, stats.latency_sum,
+                   method=method, route=route)
+
+    lines += [
+        "# HELP http_request_db_queries Database queries issued while serving one request.",
+        "# TYPE http_request_db_queries histogram",
+    ]
+    for (method, route), stats in served:
+        _histogram(lines, "http_request_db_queries", QUERIES_PER_REQUEST_BUCKETS, stats.db_queries,
+                   stats.db_queries_sum, method=method, route=route)
+
+    lines += [
+        "# HELP http_request_db_seconds_total Time spent in database queries, by route.",
+        "# TYPE http_request_db_seconds_total counter",
+    ]
+    for (method, route), stats in served:
+        lines.append(f"http_request_db_seconds_total{_labels(method=method, route=route)} {stats.db_seconds}")
+
+    lines += [
+        "# HELP http_requests_in_flight Requests currently being served.",
+        "# TYPE http_requests_in_flight gauge",
+        f"http_requests_in_flight {totals.in_flight}",
+    ]
+
+    lines += [
+        "# HELP db_query_duration_seconds Duration of every database query in this process.",
+        "# TYPE db_query_duration_seconds histogram",
+    ]
+    _histogram(lines, "db_query_duration_seconds", QUERY_BUCKETS, totals.query_latency, totals.query_seconds)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,98 @@
+"""
+The one set of SQLAlchemy cursor hooks the app installs.
+
+Each statement is timed once, credited to the current request's
+RequestQueries (a context variable that follows the request into the
+threadpool and into AsyncSession.run_sync), then handed to every statement
+observer: process-wide query metrics, the slow-query log. Metrics and SQL
+tracing share the per-request object, so with both middlewares installed a
+request is tracked once, by whichever of them runs first.
+"""
+import time
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from typing import Callable
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@dataclass(slots=True)
+class QueryRecord:
+    statement: str
+    duration: float
+    # cursor.rowcount: rows written; None where the driver does not know (most SELECTs)
+    rowcount: int | None
+
+
+class RequestQueries:
+    """
+    Statements sent while serving one request. They are always counted and
+    timed; `records` keeps each one as well once somebody asks for it.
+    Shared by reference with threadpool copies of the context.
+    """
+
+    __slots__ = ("scope", "count", "seconds", "records")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.count = 0
+        self.seconds = 0.0
+        self.records: list[QueryRecord] | None = None
+
+
+StatementObserver = Callable[[str, float, "RequestQueries | None"], None]
+
+_current_request: ContextVar[RequestQueries | None] = ContextVar("request_queries", default=None)
+_observers: list[StatementObserver] = []
+
+
+def track_request(scope: dict) -> tuple[RequestQueries, Token | None]:
+    """
+    The RequestQueries for this request, creating and installing it unless an
+    outer middleware already did. Pass the token to untrack_request when the
+    request ends.
+    """
+    current = _current_request.get()
+    if current is not None and current.scope is scope:
+        return current, None
+    request = RequestQueries(scope)
+    return request, _current_request.set(request)
+
+
+def untrack_request(token: Token | None) -> None:
+    if token is not None:
+        _current_request.reset(token)
+
+
+def add_statement_observer(observer: StatementObserver) -> None:
+    """Call `observer(statement, seconds, request or None)` after every statement."""
+    _observers.append(observer)
+
+
+# Registered on the Engine class so the sync engine, the async engine's sync
+# core and any engine made later are all covered.
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+
+    request = _current_request.get()
+    if request is not None:
+        request.count += 1
+        request.seconds += elapsed
+        if request.records is not None:
+            rowcount = getattr(cursor, "rowcount", -1)
+            request.records.append(QueryRecord(statement, elapsed, rowcount if rowcount >= 0 else None))
+
+    for observer in _observers:
+        observer(statement, elapsed, request)
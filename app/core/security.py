@@ -1,18 +1,167 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import BrokenExecutor, Future
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Dict, Any
 
-from jose import jwt
-from passlib.context import CryptContext
-
 from app.core.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# passlib, jose and the process pool machinery are imported on first use:
+# most requests are served from the token cache and never touch them, and
+# workers start faster without them.
+
+
+@functools.cache
+def get_pwd_context():
+    from passlib.context import CryptContext
+
+    # Pinning min/max rounds to the configured cost makes hashes made with any
+    # other cost "need update", so they are transparently rehashed at login.
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=settings.bcrypt_rounds,
+        bcrypt__min_rounds=settings.bcrypt_rounds,
+        bcrypt__max_rounds=settings.bcrypt_rounds,
+    )
+
+
+class HashingOverloaded(Exception):
+    """Too many password hash/verify jobs are already queued."""
+
+
+# bcrypt runs in a dedicated process pool so it neither holds the GIL nor
+# starves the threadpool that serves every other sync route.
+_pool = None
+_pool_lock = threading.Lock()
+_pending = 0
+
+
+def _hash(password: str) -> str:
+    return get_pwd_context().hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return get_pwd_context().verify_and_update(plain_password, hashed_password)
+
+
+def _release(_future: Future) -> None:
+    global _pending
+    with _pool_lock:
+        _pending -= 1
+
+
+def _discard_pool(pool) -> None:
+    """Drop a broken pool (a worker died) so the next job starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _finished(pool, future: Future) -> None:
+    _release(future)
+    if not future.cancelled() and isinstance(future.exception(), BrokenExecutor):
+        _discard_pool(pool)
+
+
+def _submit(fn, *args) -> Future:
+    global _pool, _pending
+    if settings.password_hash_workers <= 0:
+        future: Future = Future()
+        future.set_result(fn(*args))
+        return future
+
+    with _pool_lock:
+        if _pending >= settings.password_hash_max_pending:
+            raise HashingOverloaded("Password hashing is busy, please retry shortly")
+        _pending += 1
+
+    # A pool can be found broken at submit time; the second try gets a new one
+    for attempt in range(2):
+        with _pool_lock:
+            if _pool is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.password_hash_workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            pool = _pool
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenExecutor:
+            _discard_pool(pool)
+            if attempt == 0:
+                continue
+            _release(None)
+            raise
+        except BaseException:
+            _release(None)
+            raise
+        future.add_done_callback(functools.partial(_finished, pool))
+        return future
+
+
+def _run(fn, *args):
+    """Run a job in the pool, once more on a fresh pool if a worker died under it."""
+    try:
+        return _submit(fn, *args).result()
+    except BrokenExecutor:
+        return _submit(fn, *args).result()
+
+
+async def _run_async(fn, *args):
+    try:
+        return await asyncio.wrap_future(_submit(fn, *args))
+    except BrokenExecutor:
+        return await asyncio.wrap_future(_submit(fn, *args))
+
+
+def shutdown_password_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+
+def password_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            "workers": settings.password_hash_workers,
+            "pending": _pending,
+            "max_pending": settings.password_hash_max_pending,
+            "bcrypt_rounds": settings.bcrypt_rounds,
+        }
+
 
 def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+    return _run(_hash, password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return _run(_verify, plain_password, hashed_password)
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    """Like verify_password, plus a replacement hash when the stored cost is outdated."""
+    return _run(_verify_and_update, plain_password, hashed_password)
+
+async def hash_password_async(password: str) -> str:
+    """Awaitable variant: the event loop stays free while the pool hashes."""
+    return await _run_async(_hash, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_async(_verify, plain_password, hashed_password)
+
+async def verify_and_update_password_async(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await _run_async(_verify_and_update, plain_password, hashed_password)
 
 def create_access_token(subject: str, expires_delta: Optional[timedelta] = None, extra: Optional[Dict[str, Any]] = None) -> str:
     if expires_delta is None:
@@ -21,7 +170,9 @@ def create_access_token(subject: str, expires_delta: Optional[timedelta] = None,
     to_encode: Dict[str, Any] = {"sub": subject, "exp": expire}
     if extra:
         to_encode.update(extra)
+    from jose import jwt
     return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
 
 def decode_token(token: str) -> Dict[str, Any]:
+    from jose import jwt
     return jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
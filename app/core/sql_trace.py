@@ -0,0 +1,163 @@
+"""
+SQL tracing: every statement a request sends, with its duration and row
+count, plus a slow-query log and detection of statements a request repeats
+(the N+1 pattern).
+
+Statements are timed by the shared cursor hook in app.core.query_hooks,
+which keeps them on the request's RequestQueries once SqlTraceMiddleware
+asks it to. Traces are analysed when the request finishes; tests can capture them with `capture_traces()` or
+`query_budget()`.
+"""
+import logging
+import re
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from app.core.config import settings
+from app.core.query_hooks import QueryRecord, RequestQueries, add_statement_observer, track_request, untrack_request
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LISTS = re.compile(r"\?(?:\s*,\s*\?)+")
+_VALUE_ROWS = re.compile(r"(\(\?\.\.\.\))(?:\s*,\s*\(\?\.\.\.\))+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Whitespace collapsed, literals replaced by ?, expanded IN/VALUES lists folded."""
+    text = _WHITESPACE.sub(" ", statement).strip()
+    text = _LITERALS.sub("?", text)
+    text = _PLACEHOLDER_LISTS.sub("?...", text)
+    return _VALUE_ROWS.sub(r"\1...", text)
+
+
+def _route(scope: dict) -> str:
+    """Route template once routing has happened, the raw path before that."""
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "")
+
+
+class RequestTrace:
+    __slots__ = ("method", "path", "scope", "queries")
+
+    def __init__(self, scope: dict, queries: list[QueryRecord] | None = None):
+        self.method = scope.get("method", "")
+        self.path = scope.get("path", "")
+        self.scope = scope
+        self.queries: list[QueryRecord] = [] if queries is None else queries
+
+    @property
+    def route(self) -> str:
+        """Route template once routing has happened, the raw path before that."""
+        return _route(self.scope)
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(q.duration for q in self.queries)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        """Normalized statements run at least `threshold` times, most frequent first."""
+        counts = Counter(normalize_statement(q.statement) for q in self.queries)
+        return [(statement, n) for statement, n in counts.most_common() if n >= threshold]
+
+    def describe(self) -> str:
+        lines = [f"{self.method} {self.route}: {len(self.queries)} queries, {1000 * self.total_seconds:.1f} ms"]
+        lines += [f"  {1000 * q.duration:7.2f} ms  {normalize_statement(q.statement)}" for q in self.queries]
+        return "\n".join(lines)
+
+
+_listeners: list = []
+_listeners_lock = threading.Lock()
+_slow_queries: deque = deque(maxlen=50)
+_repeated_queries: deque = deque(maxlen=50)
+
+
+def _observe_statement(statement: str, elapsed: float, request: RequestQueries | None) -> None:
+    if 1000 * elapsed >= settings.sql_slow_ms:
+        route = f"{request.scope.get('method', '')} {_route(request.scope)}" if request is not None else "(no request)"
+        normalized = normalize_statement(statement)
+        _slow_queries.append({"route": route, "ms": 1000 * elapsed, "statement": normalized})
+        logger.warning("slow query (%.1f ms) from %s: %s", 1000 * elapsed, route, normalized)
+
+
+add_statement_observer(_observe_statement)
+
+
+class SqlTraceMiddleware:
+    """Gives each HTTP request a RequestTrace and analyses it when the request ends."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request, token = track_request(scope)
+        if request.records is None:
+            request.records = []
+        trace = RequestTrace(scope, request.records)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            untrack_request(token)
+            _finish(trace)
+
+
+def _finish(trace: RequestTrace) -> None:
+    for statement, count in trace.repeated(settings.sql_repeat_threshold):
+        _repeated_queries.append({"route": f"{trace.method} {trace.route}", "count": count, "statement": statement})
+        logger.warning("possible N+1: %s %s ran %dx: %s", trace.method, trace.route, count, statement)
+    with _listeners_lock:
+        listeners = list(_listeners)
+    for listener in listeners:
+        listener(trace)
+
+
+def sql_trace_stats() -> dict:
+    return {
+        "slow_ms": settings.sql_slow_ms,
+        "repeat_threshold": settings.sql_repeat_threshold,
+        "recent_slow": list(_slow_queries),
+        "recent_repeated": list(_repeated_queries),
+    }
+
+
+@contextmanager
+def capture_traces():
+    """Collects the RequestTrace of every request that finishes inside the block."""
+    traces: list[RequestTrace] = []
+    with _listeners_lock:
+        _listeners.append(traces.append)
+    try:
+        yield traces
+    finally:
+        with _listeners_lock:
+            _listeners.remove(traces.append)
+
+
+@contextmanager
+def query_budget(max_queries: int, route: str | None = None, method: str | None = None):
+    """
+    Test helper: fails if any matching request inside the block sends more
+    than `max_queries` statements, listing what it sent.
+
+        with query_budget(2, route="/api/stats"):
+            client.get("/api/stats")
+    """
+    with capture_traces() as traces:
+        yield traces
+    matching = [
+        t for t in traces
+        if (route is None or t.route == route) and (method is None or t.method == method)
+    ]
+    if not matching:
+        raise AssertionError(f"no request matched the query budget for {method or '*'} {route or '*'}")
+    over = [t for t in matching if len(t.queries) > max_queries]
+    if over:
+        raise AssertionError(
+            f"query budget of {max_queries} exceeded:\n" + "\n".join(t.describe() for t in over)
+        )
@@ -0,0 +1,109 @@
+"""
+Cold-start report: how long importing the app and the startup schema check
+take in a fresh interpreter, where the import time goes, and whether any of
+the deferred heavy modules crept back into the import graph.
+
+    python -m app.core.startup_report [--budget-ms 1500] [--top 15] [--json]
+
+Exits 1 when the import time is over budget or a deferred module is imported
+eagerly, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from app.core.config import settings
+
+# Heavy modules that must only load on first use (see security, expression_engine, api)
+DEFERRED_MODULES = ("numpy", "pyarrow", "passlib", "jose", "multiprocessing")
+
+_PROBE = """
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from app.db.init_db import init_db
+applied = init_db()
+done = time.perf_counter()
+print(json.dumps({"import_s": imported - started, "init_db_s": done - imported, "schema_applied": applied}))
+"""
+
+
+def parse_importtime(stderr: str) -> list[dict]:
+    """Rows of `-X importtime` output as {module, self_us, cumulative_us, depth}."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append({
+            "module": name.strip(),
+            "self_us": int(self_us),
+            "cumulative_us": int(cumulative_us),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+        })
+    return rows
+
+
+def measure() -> dict:
+    # A coverage hook inherited from pytest-cov would start coverage (and
+    # multiprocessing) in the probe and be reported as an eager import
+    env = {
+        name: value for name, value in os.environ.items()
+        if not name.startswith(("COV_CORE_", "COVERAGE_"))
+    }
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE],
+        capture_output=True, text=True, env=env, check=True,
+    )
+    timings = json.loads(proc.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(proc.stderr)
+    loaded = {row["module"].split(".")[0] for row in modules}
+    app_main = next((row for row in modules if row["module"] == "app.main"), None)
+    return {
+        "import_ms": app_main["cumulative_us"] / 1000 if app_main else 1000 * timings["import_s"],
+        "wall_import_ms": 1000 * timings["import_s"],
+        "init_db_ms": 1000 * timings["init_db_s"],
+        "schema_applied": timings["schema_applied"],
+        "eager_deferred_modules": sorted(loaded.intersection(DEFERRED_MODULES)),
+        "modules": modules,
+    }
+
+
+def check(report: dict, budget_ms: float) -> list[str]:
+    problems = []
+    if report["import_ms"] > budget_ms:
+        problems.append(f"import time {report['import_ms']:.0f} ms is over the {budget_ms:.0f} ms budget")
+    for name in report["eager_deferred_modules"]:
+        problems.append(f"{name} is imported at startup but should load on first use")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Report cold-start import and schema-check time.")
+    parser.add_argument("--budget-ms", type=float, default=settings.startup_import_budget_ms)
+    parser.add_argument("--top", type=int, default=15, help="slowest modules to list (by self time)")
+    parser.add_argument("--json", action="store_true", help="print the full report as JSON")
+    args = parser.parse_args(argv)
+
+    report = measure()
+    problems = check(report, args.budget_ms)
+
+    if args.json:
+        print(json.dumps({**report, "budget_ms": args.budget_ms, "problems": problems}, indent=2))
+    else:
+        print(f"import app.main: {report['import_ms']:.1f} ms (budget {args.budget_ms:.0f} ms)")
+        print(f"init_db: {report['init_db_ms']:.1f} ms (schema {'applied' if report['schema_applied'] else 'current'})")
+        print("slowest modules by self time:")
+        for row in sorted(report["modules"], key=lambda row: row["self_us"], reverse=True)[: args.top]:
+            print(f"  {row['self_us'] / 1000:8.1f} ms  {row['cumulative_us'] / 1000:8.1f} ms cum  {row['module']}")
+        for problem in problems:
+            print(f"FAIL: {problem}")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.templating import Jinja2Templates
+
+from app.core.config import settings
+
+
+class FragmentCache:
+    """Thread-safe bounded LRU of rendered HTML, keyed by tuples."""
+
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> str | None:
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def put(self, key: tuple, html: str) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = html
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+class TemplateRenderer:
+    """
+    Jinja2 templates compiled once and rendered to strings, with per-template
+    render timings and a fragment cache for pages and page parts whose inputs
+    are captured by a cache key (static pages, or user data at a version).
+
+    With auto_reload off, templates are not re-checked on disk per render;
+    precompile() loads every template at startup so the first request does
+    not pay for compilation either.
+    """
+
+    def __init__(self, directory: str, fragment_cache_size: int = 2048, auto_reload: bool = False):
+        self.templates = Jinja2Templates(directory=directory)
+        self.env = self.templates.env
+        self.env.auto_reload = auto_reload
+        self.fragments = FragmentCache(fragment_cache_size)
+        self.precompiled = 0
+        self._lock = threading.Lock()
+        self._timings: dict[str, list[float]] = {}
+
+    def precompile(self) -> int:
+        names = self.env.list_templates(extensions=["html"])
+        for name in names:
+            self.env.get_template(name)
+        self.precompiled = len(names)
+        return self.precompiled
+
+    def render(self, name: str, context: dict) -> str:
+        started = time.perf_counter()
+        html = self.env.get_template(name).render(context)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            timing = self._timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+        return html
+
+    def render_cached(self, key: tuple, name: str, context: dict) -> str:
+        """For fragments whose context is already at hand (or cheap to build)."""
+        html = self.fragments.get(key)
+        if html is None:
+            html = self.render(name, context)
+            self.fragments.put(key, html)
+        return html
+
+    def stats(self) -> dict:
+        with self._lock:
+            renders = {
+                name: {
+                    "renders": count,
+                    "avg_ms": 1000 * total / count,
+                    "max_ms": 1000 * worst,
+                }
+                for name, (count, total, worst) in sorted(self._timings.items())
+            }
+        return {"precompiled": self.precompiled, "fragments": self.fragments.stats(), "renders": renders}
+
+
+renderer = TemplateRenderer(
+    "templates",
+    fragment_cache_size=settings.template_cache_size,
+    auto_reload=settings.templates_auto_reload,
+)
@@ -0,0 +1,111 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from app.core.config import settings
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """The few user fields request handlers need, safe to share across requests."""
+
+    id: int
+    username: str
+    email: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user) -> "UserSnapshot":
+        return cls(id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified access tokens -> UserSnapshot.
+
+    Entries live for at most `ttl_seconds` and never past the token's own
+    `exp`. The cache is per process: invalidate_user only reaches this
+    worker, so other workers may serve a stale snapshot for up to the TTL.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl_seconds: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple[UserSnapshot, float]]" = OrderedDict()
+        self._by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _drop(self, token: str) -> None:
+        snapshot, _ = self._entries.pop(token)
+        tokens = self._by_user.get(snapshot.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[snapshot.id]
+
+    def get(self, token: str) -> UserSnapshot | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            snapshot, expires_at = entry
+            if expires_at <= now:
+                self._drop(token)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return snapshot
+
+    def put(self, token: str, snapshot: UserSnapshot, token_exp: float | None = None) -> None:
+        if self.maxsize <= 0 or self.ttl_seconds <= 0:
+            return
+        expires_at = time.time() + self.ttl_seconds
+        if token_exp is not None:
+            expires_at = min(expires_at, float(token_exp))
+
+        with self._lock:
+            if token in self._entries:
+                self._drop(token)
+            self._entries[token] = (snapshot, expires_at)
+            self._by_user.setdefault(snapshot.id, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for token in list(self._by_user.get(user_id, ())):
+                self._drop(token)
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+token_cache = TokenCache(maxsize=settings.auth_cache_size, ttl_seconds=settings.auth_cache_ttl_seconds)
@@ -0,0 +1,39 @@
+import argparse
+from datetime import datetime, timedelta, timezone
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.init_db import init_db
+from app.services.retention import archive_older_than, count_archivable
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Move old calculations into the archive table.")
+    parser.add_argument("--older-than-days", type=float, default=settings.retention_days,
+                        help="archive rows older than this (default RETENTION_DAYS)")
+    parser.add_argument("--batch-rows", type=int, default=settings.retention_batch_rows, help="rows moved per transaction")
+    parser.add_argument("--pause-ms", type=float, default=settings.retention_batch_pause_ms, help="pause between batches")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows that would move")
+    args = parser.parse_args(argv)
+
+    init_db()
+    cutoff = datetime.now(timezone.utc) - timedelta(days=args.older_than_days)
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            print(f"{count_archivable(db, cutoff)} calculation(s) older than {cutoff.isoformat()}.")
+            return 0
+        moved = archive_older_than(
+            db,
+            cutoff,
+            batch_rows=args.batch_rows,
+            pause=args.pause_ms / 1000,
+            progress=lambda done: print(f"{done} rows archived", flush=True),
+        )
+    finally:
+        db.close()
+
+    print(f"{moved} calculation(s) archived.")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,55 @@
+import argparse
+import sys
+
+from sqlalchemy import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.db.init_db import init_db
+from app.models.user import User
+from app.services.import_service import ImportFormatError, iter_import, open_import
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Import calculation history from a CSV file.")
+    parser.add_argument("path", help="CSV in the export layout (operation,a,b,expression[,result][,created_at])")
+    owner = parser.add_mutually_exclusive_group(required=True)
+    owner.add_argument("--user-id", type=int, help="owner of the imported rows")
+    owner.add_argument("--username", help="owner of the imported rows")
+    parser.add_argument("--chunk-rows", type=int, default=settings.import_chunk_rows, help="rows per transaction")
+    parser.add_argument("--max-errors", type=int, default=settings.import_max_errors,
+                        help="rejected rows to list individually")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        if args.username is not None:
+            user_id = db.execute(select(User.id).where(User.username == args.username)).scalar()
+        else:
+            user_id = db.execute(select(User.id).where(User.id == args.user_id)).scalar()
+        if user_id is None:
+            print("No such user.", file=sys.stderr)
+            return 2
+
+        with open(args.path, encoding="utf-8-sig", newline="") as f:
+            try:
+                reader, index = open_import(f)
+            except ImportFormatError as e:
+                print(f"{args.path}: {e}", file=sys.stderr)
+                return 2
+            for event in iter_import(db, user_id, reader, index, chunk_rows=args.chunk_rows, max_errors=args.max_errors):
+                if event["event"] == "error":
+                    print(f"line {event['line']}: {event['error']}", file=sys.stderr)
+                elif event["event"] == "progress":
+                    print(f"{event['rows']} rows read, {event['imported']} imported", flush=True)
+                elif event["event"] == "failed":
+                    print(event["error"], file=sys.stderr)
+                    return 1
+    finally:
+        db.close()
+
+    print(f"{event['imported']} calculation(s) imported, {event['failed']} rejected.")
+    return 1 if event["failed"] else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,11 +1,81 @@
+import argparse
+import functools
+import hashlib
+
+from sqlalchemy import delete, exc, insert, inspect, select
+from sqlalchemy.schema import CreateColumn, CreateIndex, CreateTable
+
 from app.db.session import engine
 from app.db.base import Base
 from app.models.user import User 
 from app.models.calculation import Calculation
+from app.models.calculation_archive import ArchivedCalculation
+from app.models.user_stats import UserStats
+from app.models.undo_entry import UndoEntry
+from app.models.rate_limit_bucket import RateLimitBucket
+from app.models.calc_rollup import CalcRollup
+from app.models.schema_version import SchemaVersion
+
+@functools.cache
+def schema_fingerprint() -> str:
+    """Hash of the DDL the models compile to on this engine's dialect."""
+    digest = hashlib.sha256()
+    for table in Base.metadata.sorted_tables:
+        digest.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            digest.update(str(CreateIndex(index).compile(dialect=engine.dialect)).encode())
+    return digest.hexdigest()
+
+def stored_fingerprint() -> str | None:
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                select(SchemaVersion.fingerprint).where(SchemaVersion.id == 1)
+            ).scalar_one_or_none()
+    except exc.DBAPIError:
+        # No schema_version table yet
+        return None
 
-def init_db() -> None:
+def _add_missing_columns() -> None:
+    """create_all does not alter existing tables, so add columns introduced later."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+
+def init_db(force: bool = False) -> bool:
+    """
+    Bring the schema up to date. When the stored fingerprint matches the
+    models this is a single-row read and no reflection runs. Returns whether
+    the schema was (re)applied.
+    """
+    fingerprint = schema_fingerprint()
+    if not force and stored_fingerprint() == fingerprint:
+        return False
+
+    _add_missing_columns()
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add indexes introduced later
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    with engine.begin() as conn:
+        conn.execute(delete(SchemaVersion))
+        conn.execute(insert(SchemaVersion).values(id=1, fingerprint=fingerprint))
+    return True
 
 if __name__ == "__main__":
-    init_db()
-    print("DB initialized.")
+    parser = argparse.ArgumentParser(description="Create or update the database schema.")
+    parser.add_argument("--force", action="store_true", help="apply even if the stored fingerprint is current")
+    args = parser.parse_args()
+    if init_db(force=args.force):
+        print("DB initialized.")
+    else:
+        print("DB schema is current.")
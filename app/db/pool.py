@@ -0,0 +1,78 @@
+import threading
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class CheckoutStats:
+    """Connection checkout counters: how often and how long callers wait on the pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            if seconds > self.wait_seconds_max:
+                self.wait_seconds_max = seconds
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+
+class _CheckoutStatsMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkout_stats = CheckoutStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkout_stats = self.checkout_stats
+        return pool
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except exc.TimeoutError:
+            self.checkout_stats.record_timeout()
+            raise
+        self.checkout_stats.record(time.perf_counter() - started)
+        return connection
+
+
+class InstrumentedQueuePool(_CheckoutStatsMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_CheckoutStatsMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_stats(pool) -> dict:
+    """Live occupancy plus checkout wait statistics for an engine's pool."""
+    out = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        out.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+        })
+    stats = getattr(pool, "checkout_stats", None)
+    if stats is not None:
+        with stats._lock:
+            out.update({
+                "checkouts": stats.checkouts,
+                "timeouts": stats.timeouts,
+                "avg_wait_ms": (1000 * stats.wait_seconds_total / stats.checkouts) if stats.checkouts else 0.0,
+                "max_wait_ms": 1000 * stats.wait_seconds_max,
+            })
+    return out
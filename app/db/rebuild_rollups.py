@@ -0,0 +1,29 @@
+import argparse
+
+from app.db.session import SessionLocal
+from app.db.init_db import init_db
+from app.services.rollups import rebuild_rollups
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Rebuild the hourly/daily rollups from calculation history.")
+    parser.add_argument("--user-id", type=int, default=None, help="limit to one user")
+    parser.add_argument("--chunk-rows", type=int, default=50_000, help="history rows read and committed per chunk")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        rows = rebuild_rollups(
+            db,
+            user_id=args.user_id,
+            chunk_rows=args.chunk_rows,
+            progress=lambda done: print(f"{done} rows folded in", flush=True),
+        )
+    finally:
+        db.close()
+
+    print(f"Rollups rebuilt from {rows} calculation(s).")
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,27 @@
+import argparse
+
+from app.db.session import SessionLocal
+from app.db.init_db import init_db
+from app.services.calc_service import rebuild_all_stats
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Recompute per-user stats from calculation history.")
+    parser.add_argument("--check", action="store_true", help="only report users whose stats drifted")
+    parser.add_argument("--user-id", type=int, default=None, help="limit to one user")
+    args = parser.parse_args(argv)
+
+    init_db()
+    db = SessionLocal()
+    try:
+        drift = rebuild_all_stats(db, check_only=args.check, user_id=args.user_id)
+    finally:
+        db.close()
+
+    for row in drift:
+        print(f"user {row['user_id']}: stored count {row['stored_count']}, expected {row['expected_count']}")
+    action = "drifted" if args.check else "rebuilt"
+    print(f"{len(drift)} user(s) {action}.")
+    return 1 if (args.check and drift) else 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,14 +1,161 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator
+
+from fastapi import Request
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
+from starlette.concurrency import run_in_threadpool
 
 from app.core.config import settings
+from app.db.pool import InstrumentedAsyncQueuePool, InstrumentedQueuePool, pool_stats
+
+# Driver used for each backend in sync and async mode; DATABASE_URL may name
+# either one and the other engine is derived from it.
+_SYNC_DRIVERS = {"sqlite": "sqlite", "postgresql": "postgresql+psycopg2"}
+_ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg"}
+
+
+def is_async_url(url: str) -> bool:
+    """True when DATABASE_URL names an async driver (aiosqlite, asyncpg)."""
+    u = make_url(url)
+    return u.drivername == _ASYNC_DRIVERS.get(u.get_backend_name())
+
+
+def _sync_url(url: str) -> str:
+    if not is_async_url(url):
+        return url
+    u = make_url(url)
+    return u.set(drivername=_SYNC_DRIVERS[u.get_backend_name()]).render_as_string(hide_password=False)
+
+
+def _async_url(url: str) -> str:
+    u = make_url(url)
+    driver = _ASYNC_DRIVERS.get(u.get_backend_name())
+    if driver is None or is_async_url(url):
+        return url
+    return u.set(drivername=driver).render_as_string(hide_password=False)
+
+
+sync_database_url = _sync_url(settings.database_url)
+async_database_url = _async_url(settings.database_url)
 
-engine = create_engine(settings.database_url, future=True, pool_pre_ping=True)
+
+def engine_options(url: str, is_async: bool = False) -> dict:
+    """Pool settings from DB_POOL_* for either engine flavour."""
+    u = make_url(url)
+    is_sqlite = u.get_backend_name() == "sqlite"
+    pre_ping = settings.db_pool_pre_ping
+    if pre_ping is None:
+        pre_ping = not is_sqlite
+
+    options = {"pool_pre_ping": pre_ping}
+    if is_sqlite and u.database in (None, "", ":memory:"):
+        # In-memory databases keep the dialect's single-connection pool
+        return options
+    options.update(
+        poolclass=InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout,
+        pool_recycle=settings.db_pool_recycle,
+    )
+    return options
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={settings.sqlite_journal_mode}")
+    cursor.execute(f"PRAGMA synchronous={settings.sqlite_synchronous}")
+    cursor.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+    cursor.execute(f"PRAGMA cache_size={-int(settings.sqlite_cache_size_kb)}")
+    cursor.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+    cursor.close()
+
+
+def configure_engine(sync_engine) -> None:
+    """Connect-time setup shared by the sync engine and the async engine's sync core."""
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+
+
+engine = create_engine(sync_database_url, future=True, **engine_options(sync_database_url))
+configure_engine(engine)
 SessionLocal = sessionmaker(bind=engine, autocommit=False, autoflush=False, future=True)
 
+_async_engine = None
+_async_sessionmaker = None
+
+
+def get_async_sessionmaker():
+    """The async engine is only built (and its driver imported) on first use."""
+    global _async_engine, _async_sessionmaker
+    if _async_sessionmaker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+        _async_engine = create_async_engine(async_database_url, **engine_options(async_database_url, is_async=True))
+        configure_engine(_async_engine.sync_engine)
+        _async_sessionmaker = async_sessionmaker(bind=_async_engine, autoflush=False, expire_on_commit=True)
+    return _async_sessionmaker
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _async_sessionmaker
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    _async_engine = _async_sessionmaker = None
+
+
+def db_pool_stats() -> dict:
+    return {
+        "sync": pool_stats(engine.pool),
+        "async": pool_stats(_async_engine.pool) if _async_engine is not None else None,
+    }
+
+
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
+
+
+class SessionRunner:
+    """
+    Request-scoped database handle shared by sync and async mode.
+
+    Service functions stay plain sync code taking a Session; `run` calls them
+    in the threadpool (sync mode) or through AsyncSession.run_sync (async
+    mode), where the driver awaits I/O on the event loop without holding a
+    thread.
+    """
+
+    def __init__(self, session, is_async: bool):
+        self.session = session
+        self.is_async = is_async
+
+    async def run(self, fn, *args, **kwargs):
+        if self.is_async:
+            return await self.session.run_sync(fn, *args, **kwargs)
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+async def get_runner(request: Request) -> AsyncIterator[SessionRunner]:
+    if getattr(request.app.state, "async_db", False):
+        async with get_async_sessionmaker()() as session:
+            yield SessionRunner(session, is_async=True)
+        return
+
+    session = SessionLocal()
+    try:
+        yield SessionRunner(session, is_async=False)
+    finally:
+        await run_in_threadpool(session.close)
+
+
+async def astream_partitions(stmt) -> AsyncIterator[list]:
+    """Async-mode counterpart of iterating `Session.execute(stmt).partitions()`."""
+    async with get_async_sessionmaker()() as session:
+        result = await session.stream(stmt)
+        async for partition in result.partitions():
+            yield partition
@@ -1,15 +1,36 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.sessions import SessionMiddleware
 
 from app.core.config import settings
+from app.core.metrics import MetricsMiddleware, render_prometheus
+from app.core.sql_trace import SqlTraceMiddleware
+from app.core.security import HashingOverloaded, shutdown_password_pool
+from app.core.templating import renderer
 from app.db.init_db import init_db
+from app.db.session import SessionLocal, dispose_async_engine, is_async_url
 from app.routes import auth, pages, api
+from app.services.admission import AdmissionRejected, create_admission_controller
+from app.services.retention import create_retention_job
+from app.services.undo_store import create_undo_store
+from app.services.write_behind import create_write_behind_queue
 
-def create_app() -> FastAPI:
+def create_app(async_db: bool | None = None) -> FastAPI:
+    """`async_db` defaults to whether DATABASE_URL names an async driver."""
     app = FastAPI(title=settings.app_name)
+    app.state.async_db = is_async_url(settings.database_url) if async_db is None else async_db
+    app.state.write_behind = None
+    app.state.retention = None
+    app.state.undo_store = create_undo_store(SessionLocal)
+    app.state.admission = create_admission_controller(SessionLocal)
 
     app.add_middleware(SessionMiddleware, secret_key=settings.secret_key)
+    if settings.sql_trace_enabled:
+        app.add_middleware(SqlTraceMiddleware)
+    if settings.metrics_enabled:
+        # Outermost, so the session cookie handling is part of the measured time
+        app.add_middleware(MetricsMiddleware)
 
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
@@ -17,14 +38,36 @@ def create_app() -> FastAPI:
     app.include_router(auth.router)
     app.include_router(api.router)
 
-    @app.middleware("http")
-    async def flash_middleware(request: Request, call_next):
-        response = await call_next(request)
-        return response
+    @app.get("/metrics", include_in_schema=False)
+    def metrics():
+        return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.exception_handler(HashingOverloaded)
+    async def hashing_overloaded_handler(request: Request, exc: HashingOverloaded):
+        return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": "1"})
+
+    @app.exception_handler(AdmissionRejected)
+    async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+        return JSONResponse(status_code=exc.status_code, content={"detail": exc.detail}, headers=exc.headers)
 
     @app.on_event("startup")
     def _startup():
         init_db()
+        renderer.precompile()
+        if settings.write_behind_enabled:
+            app.state.write_behind = create_write_behind_queue(SessionLocal).start()
+        if settings.retention_enabled:
+            app.state.retention = create_retention_job(SessionLocal).start()
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        if app.state.write_behind is not None:
+            # Flush everything still queued before the process goes away
+            app.state.write_behind.stop()
+        if app.state.retention is not None:
+            app.state.retention.stop()
+        shutdown_password_pool()
+        await dispose_async_engine()
 
     return app
 
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+class CalcRollup(Base):
+    """
+    Per user x op x hour/day aggregates of calculation history, maintained
+    alongside every calculation write. The primary key serves range reads.
+    """
+
+    __tablename__ = "calc_rollups"
+
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    grain: Mapped[str] = mapped_column(String(4), primary_key=True)  # "hour" | "day"
+    # Start of the bucket, naive UTC
+    bucket_start: Mapped[datetime] = mapped_column(DateTime, primary_key=True)
+    # Calculation.op, or "expression" for expression rows
+    op: Mapped[str] = mapped_column(String(20), primary_key=True)
+
+    calc_count: Mapped[int] = mapped_column(Integer, nullable=False)
+    result_sum: Mapped[float] = mapped_column(Float, nullable=False)
+    result_min: Mapped[float] = mapped_column(Float, nullable=False)
+    result_max: Mapped[float] = mapped_column(Float, nullable=False)
+
+    # Result distribution: counts per band of rollups.RESULT_BANDS
+    band_0: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_1: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_2: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_3: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_4: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_5: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_6: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    band_7: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
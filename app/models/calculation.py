@@ -1,13 +1,24 @@
-from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, func
+from datetime import datetime, timezone
+
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Index, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from app.db.base import Base
 
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Calculation(Base):
     __tablename__ = "calculations"
+    __table_args__ = (
+        # Serves per-user history in (created_at, id) order for keyset pagination
+        Index("ix_calculations_user_created_id", "user_id", "created_at", "id"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_id: Mapped[int] = mapped_column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
     )
 
     op: Mapped[str | None] = mapped_column(String(20), nullable=True)
@@ -18,8 +29,10 @@ class Calculation(Base):
     expression: Mapped[str | None] = mapped_column(String(255), nullable=True)
 
     result: Mapped[float] = mapped_column(Float, nullable=False)
+    # Set client-side too so timestamps carry sub-second precision and sort
+    # consistently with keyset cursors.
     created_at: Mapped["DateTime"] = mapped_column(
-        DateTime(timezone=True), server_default=func.now()
+        DateTime(timezone=True), server_default=func.now(), default=_utcnow
     )
 
     user = relationship("User", back_populates="calculations")
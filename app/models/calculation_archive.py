@@ -0,0 +1,28 @@
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+class ArchivedCalculation(Base):
+    """
+    Calculations moved out of `calculations` by the retention job, ids and
+    timestamps unchanged. Read-only: history and export fall back to it
+    only for ranges at or before the user's UserStats.archived_through.
+    """
+
+    __tablename__ = "calculations_archive"
+    __table_args__ = (
+        Index("ix_calculations_archive_user_created_id", "user_id", "created_at", "id"),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+
+    op: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    a: Mapped[float | None] = mapped_column(Float, nullable=True)
+    b: Mapped[float | None] = mapped_column(Float, nullable=True)
+    expression: Mapped[str | None] = mapped_column(String(255), nullable=True)
+
+    result: Mapped[float] = mapped_column(Float, nullable=False)
+    created_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), nullable=False)
@@ -0,0 +1,13 @@
+from sqlalchemy import Float, String
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+class RateLimitBucket(Base):
+    """Token bucket state for one user (ADMISSION_BACKEND=database)."""
+
+    __tablename__ = "rate_limit_buckets"
+
+    key: Mapped[str] = mapped_column(String(64), primary_key=True)
+    tokens: Mapped[float] = mapped_column(Float, nullable=False)
+    # Wall-clock seconds, since workers do not share a monotonic clock
+    updated_at: Mapped[float] = mapped_column(Float, nullable=False)
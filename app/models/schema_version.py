@@ -0,0 +1,19 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Integer, String, DateTime
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class SchemaVersion(Base):
+    """Single row recording the fingerprint of the schema init_db last applied."""
+
+    __tablename__ = "schema_version"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    fingerprint: Mapped[str] = mapped_column(String(64), nullable=False)
+    applied_at: Mapped["DateTime"] = mapped_column(DateTime(timezone=True), default=_utcnow)
@@ -0,0 +1,23 @@
+from sqlalchemy import Float, Integer, String, JSON, Index
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+class UndoEntry(Base):
+    """One undo or redo payload for a browser session (UNDO_BACKEND=database)."""
+
+    __tablename__ = "undo_entries"
+    __table_args__ = (
+        # Top-of-stack lookups and depth trimming both walk this index; it is
+        # unique so concurrent pushes cannot share a seq (the loser retries)
+        Index("uq_undo_entries_owner_stack_seq", "owner", "stack", "seq", unique=True),
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    owner: Mapped[str] = mapped_column(String(64), nullable=False)
+    stack: Mapped[str] = mapped_column(String(4), nullable=False)  # "undo" | "redo"
+    seq: Mapped[int] = mapped_column(Integer, nullable=False)
+    payload: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # Wall-clock seconds the entry was written (a move rewrites it), so an
+    # owner's newest entry is when the session last used undo; 0 for rows
+    # written before the column existed
+    written_at: Mapped[float] = mapped_column(Float, nullable=False, server_default="0")
@@ -0,0 +1,25 @@
+from sqlalchemy import Integer, String, Float, DateTime, ForeignKey, text
+from sqlalchemy.orm import Mapped, mapped_column
+from app.db.base import Base
+
+class UserStats(Base):
+    """Running per-user aggregates, maintained alongside every calculation write."""
+
+    __tablename__ = "user_stats"
+
+    user_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    calc_count: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    result_sum: Mapped[float] = mapped_column(Float, default=0.0, nullable=False)
+
+    last_calc_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    last_op: Mapped[str | None] = mapped_column(String(20), nullable=True)
+    last_created_at: Mapped["DateTime | None"] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # Newest created_at moved to calculations_archive (None: nothing archived);
+    # reads skip the archive for anything newer
+    archived_through: Mapped["DateTime | None"] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # Bumped on every change to the user's history; the source of ETags
+    version: Mapped[int] = mapped_column(Integer, default=1, server_default=text("1"), nullable=False)
@@ -1,147 +1,500 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy.orm import Session
-import csv
-from io import StringIO
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request, Response
+import asyncio
+import io
+import json
+import logging
+import tempfile
+import uuid
+from datetime import datetime
+from typing import Literal
+
+from fastapi.exceptions import RequestValidationError
 from fastapi.responses import StreamingResponse
-from app.db.session import get_db
-from app.routes.deps import get_current_user
-from app.schemas.calculation import CalcIn, CalcOut, StatsOut, ExpressionIn
+from pydantic import ValidationError
+from starlette.concurrency import run_in_threadpool
+from app.db.session import SessionLocal, SessionRunner, astream_partitions, db_pool_stats, get_runner
+from app.routes.deps import REVALIDATE, etag_matches, get_current_user, make_etag, not_modified
+from app.schemas.calculation import CalcIn, CalcOut, StatsOut, TimeseriesOut, ExpressionIn, BatchCalcIn, BatchCalcOut, SweepIn, UndoEntryIn
 from app.services.calc_service import (
+    build_calculation_row,
     create_calculation,
-    list_calculations,
-    get_stats,
-    get_all_calculations,
+    create_calculations_batch,
+    list_calculations_page,
+    get_history_state,
+    get_history_version,
+    get_versioned_stats,
+    get_calculation,
+    update_calculation,
+    delete_calculation,
 )
 from app.services.calculator import evaluate_expression
+from app.services.expression_engine import expression_cache
+from app.core.config import settings
+from app.core.token_cache import token_cache
+from app.core.templating import renderer
+from app.core.sql_trace import sql_trace_stats
+from app.core.security import password_pool_stats
+from app.services.export_service import (
+    COLUMNAR_COLUMNS,
+    COLUMNAR_MEDIA_TYPES,
+    CSV_COLUMNS,
+    ColumnarEncoder,
+    CsvEncoder,
+    GzipEncoder,
+    aencode_stream,
+    columnar_available,
+    encode_stream,
+    history_statements,
+    iter_row_chunks,
+)
+from app.services.import_service import ImportFormatError, iter_import, open_import
+from app.services.write_behind import WriteBehindFull
+from app.services.admission import COSTS, SlotStreamingResponse
+from app.services.rollups import align_range, get_timeseries
 
 router = APIRouter(prefix="/api", tags=["api"])
+logger = logging.getLogger(__name__)
+
+# Uploads up to this size are spooled in memory, larger ones to a temp file
+IMPORT_SPOOL_BYTES = 1 << 20
+
+
+def admit(route: str):
+    """Route dependency: charge the user's token bucket for `route` (see COSTS)."""
+    assert route in COSTS
+
+    async def check(request: Request, user=Depends(get_current_user)):
+        controller = request.app.state.admission
+        if controller is not None:
+            await controller.check_rate(user.id, route)
+
+    return Depends(check)
 
 
-@router.post("/calculate", response_model=CalcOut)
-def api_calculate(
+def _heavy_slot(request: Request, name: str):
+    """Take a heavy-request slot (503 when none is free); None with admission control off."""
+    controller = request.app.state.admission
+    return controller.heavy_slot(name) if controller is not None else None
+
+
+def _heavy_response(request: Request, name: str, body, **kwargs) -> StreamingResponse:
+    """Stream `body` holding a heavy-request slot until the response ends."""
+    return SlotStreamingResponse(_heavy_slot(request, name), body, **kwargs)
+
+
+@router.post("/calculate", response_model=CalcOut, dependencies=[admit("calculate")])
+async def api_calculate(
+    request: Request,
+    response: Response,
     payload: CalcIn,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
+    wait: bool = Query(False, description="With write-behind on, wait until the row is committed"),
 ):
     try:
-        return create_calculation(
-            db=db,
-            user_id=user.id,
-            op=payload.op,
-            a=payload.a,
-            b=payload.b,
-        )
+        queue = request.app.state.write_behind
+        if queue is None:
+            return await db.run(
+                create_calculation,
+                user_id=user.id,
+                op=payload.op,
+                a=payload.a,
+                b=payload.b,
+            )
+        row = build_calculation_row(user.id, op=payload.op, a=payload.a, b=payload.b)
     except ZeroDivisionError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    try:
+        future = queue.submit(row)
+    except WriteBehindFull as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "1"}
+        )
+    if not wait:
+        response.status_code = status.HTTP_202_ACCEPTED
+        return row
+    calc_id, created_at = await asyncio.wrap_future(future)
+    return {**row, "id": calc_id, "created_at": created_at}
+
 
-@router.post("/calculate/expression")
-def api_calculate_expression(
+@router.post("/calculate/batch", response_model=BatchCalcOut, dependencies=[admit("batch")])
+async def api_calculate_batch(
+    payload: BatchCalcIn,
+    user=Depends(get_current_user),
+    db: SessionRunner = Depends(get_runner),
+):
+    items = await db.run(
+        create_calculations_batch,
+        user_id=user.id,
+        items=[(item.op, item.a, item.b) for item in payload.items],
+    )
+    failed = sum(1 for item in items if item["error"] is not None)
+    return {"items": items, "succeeded": len(items) - failed, "failed": failed}
+
+
+@router.post("/calculate/expression", dependencies=[admit("expression")])
+async def api_calculate_expression(
     payload: ExpressionIn,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
 ):
     """
     Returns: { "result": <number> }
     (Optional) You can also store it in DB if your model supports `expression`.
     """
     try:
-        result = evaluate_expression(payload.expression)
+        result = evaluate_expression(payload.expression, payload.variables)
         return {"result": result}
     except ZeroDivisionError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+
+@router.post("/calculate/sweep", dependencies=[admit("sweep")])
+async def api_calculate_sweep(
+    request: Request,
+    payload: SweepIn,
+    user=Depends(get_current_user),
+):
+    """
+    Evaluate one expression over many variable values.
+
+    json: NDJSON stream, a header line then {"offset", "result", "error"} per chunk.
+    binary: packed records of little-endian float64 result + uint8 error code.
+    """
+    # Imported here so NumPy only loads once a sweep (or batch) is requested
+    from app.services.sweep import SweepPlan, iter_sweep_binary, iter_sweep_ndjson
+
+    variables = {
+        name: spec if isinstance(spec, list) else spec.model_dump()
+        for name, spec in payload.variables.items()
+    }
+    try:
+        plan = SweepPlan(payload.expression, variables, mode=payload.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if payload.format == "binary":
+        return _heavy_response(
+            request,
+            "sweep",
+            iter_sweep_binary(plan),
+            media_type="application/octet-stream",
+            headers={"X-Sweep-Rows": str(plan.rows), "X-Sweep-Dtype": "<f8,u1"},
+        )
+    return _heavy_response(request, "sweep", iter_sweep_ndjson(plan), media_type="application/x-ndjson")
+
+
 @router.get("/history", response_model=list[CalcOut])
-def api_history(
+async def api_history(
+    request: Request,
+    response: Response,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
-    limit: int = 20,
+    db: SessionRunner = Depends(get_runner),
+    limit: int = Query(20, ge=1, le=500),
+    cursor: str | None = None,
 ):
-    return list_calculations(db, user_id=user.id, limit=limit)
+    """
+    Newest first. When more rows exist, the opaque cursor for the next page is
+    returned in the X-Next-Cursor header (and as a rel="next" Link).
+    Answers 304 when If-None-Match carries the current ETag.
+    """
+    # Read the version before the rows: a write in between only costs the
+    # client one extra full response, never a stale 304.
+    version, archived_through, _ = await db.run(get_history_state, user_id=user.id)
+    etag = make_etag("history", user.id, version, limit, cursor)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    try:
+        rows, next_cursor = await db.run(
+            list_calculations_page, user_id=user.id, limit=limit, cursor=cursor, archived_through=archived_through
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+        response.headers["Link"] = f'</api/history?limit={limit}&cursor={next_cursor}>; rel="next"'
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    return rows
+
+
+@router.get("/calculations/{calc_id}", response_model=CalcOut)
+async def api_get_calculation(
+    calc_id: int,
+    user=Depends(get_current_user),
+    db: SessionRunner = Depends(get_runner),
+):
+    calc = await db.run(get_calculation, user_id=user.id, calc_id=calc_id)
+    if calc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Calculation not found")
+    return calc
+
+
+@router.put("/calculations/{calc_id}", response_model=CalcOut)
+async def api_update_calculation(
+    calc_id: int,
+    payload: CalcIn,
+    user=Depends(get_current_user),
+    db: SessionRunner = Depends(get_runner),
+):
+    calc = await db.run(get_calculation, user_id=user.id, calc_id=calc_id)
+    if calc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Calculation not found")
+    try:
+        return await db.run(update_calculation, calc, op=payload.op, a=payload.a, b=payload.b)
+    except ZeroDivisionError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.delete("/calculations/{calc_id}")
+async def api_delete_calculation(
+    calc_id: int,
+    user=Depends(get_current_user),
+    db: SessionRunner = Depends(get_runner),
+):
+    calc = await db.run(get_calculation, user_id=user.id, calc_id=calc_id)
+    if calc is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Calculation not found")
+    await db.run(delete_calculation, calc)
+    return {"status": "ok"}
 
 
 @router.get("/stats", response_model=StatsOut)
-def api_stats(
+async def api_stats(
+    request: Request,
+    response: Response,
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
-    return get_stats(db, user_id=user.id)
+    version, stats = await db.run(get_versioned_stats, user_id=user.id)
+    etag = make_etag("stats", user.id, version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    return stats
 
 
-@router.get("/export/history")
-def export_history_csv(
+@router.get("/stats/timeseries", response_model=TimeseriesOut)
+async def api_stats_timeseries(
+    request: Request,
+    response: Response,
+    grain: Literal["hour", "day"] = "day",
+    start: datetime | None = Query(None, description="Inclusive, UTC if no offset; default: 48 hours or 30 days before end"),
+    end: datetime | None = Query(None, description="Exclusive, UTC if no offset; default: end of the current bucket"),
+    op: str | None = Query(None, description="Only this operation (\"expression\" for expression rows)"),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
-    calculations = get_all_calculations(db, user_id=user.id)
+    """Counts, sums and result distribution per hour or day, read from the rollups."""
+    try:
+        start, end = align_range(grain, start, end, settings.timeseries_max_buckets)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    version = await db.run(get_history_version, user_id=user.id)
+    etag = make_etag("timeseries", user.id, version, grain, start.isoformat(), end.isoformat(), op)
+    if etag_matches(request, etag):
+        return not_modified(etag)
 
-    output = StringIO()
-    writer = csv.writer(output)
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = REVALIDATE
+    return await db.run(get_timeseries, user_id=user.id, grain=grain, start=start, end=end, op=op)
+
+
+def _stream_user_rows(user_id: int, **kwargs):
+    # The request's session is closed before the body streams, so use our own.
+    db = SessionLocal()
+    try:
+        yield from iter_row_chunks(db, user_id=user_id, **kwargs)
+    finally:
+        db.close()
 
-    writer.writerow(["operation", "a", "b", "expression", "result"])
 
-    for c in calculations:
-        writer.writerow([
-            getattr(c, "op", None),
-            getattr(c, "a", None),
-            getattr(c, "b", None),
-            getattr(c, "expression", None),
-            getattr(c, "result", None),
-        ])
+async def _astream_history(statements):
+    for stmt in statements:
+        async for partition in astream_partitions(stmt):
+            yield partition
 
-    output.seek(0)
-    return StreamingResponse(
-        output,
+
+def _history_body(request: Request, user_id: int, encoder, columns, since, archived_through):
+    if getattr(request.app.state, "async_db", False):
+        statements = history_statements(user_id, columns, since=since, archived_through=archived_through)
+        return aencode_stream(_astream_history(statements), encoder)
+    return encode_stream(
+        _stream_user_rows(user_id, columns=columns, since=since, archived_through=archived_through), encoder
+    )
+
+
+@router.get("/export/history", dependencies=[admit("export")])
+async def export_history_csv(
+    request: Request,
+    user=Depends(get_current_user),
+    db: SessionRunner = Depends(get_runner),
+    format: Literal["csv", "arrow", "parquet"] = "csv",
+    since: datetime | None = Query(None, description="Only rows created at or after this time"),
+):
+    """Archived history is only read when `since` (or its absence) reaches back to it."""
+    if format != "csv":
+        if not columnar_available():
+            raise HTTPException(
+                status_code=status.HTTP_406_NOT_ACCEPTABLE,
+                detail=f"{format} export requires pyarrow, which is not installed",
+            )
+        extension = "arrows" if format == "arrow" else "parquet"
+        state = await db.run(get_history_state, user_id=user.id)
+        return _heavy_response(
+            request,
+            "export",
+            _history_body(request, user.id, ColumnarEncoder(format), COLUMNAR_COLUMNS, since, state.archived_through),
+            media_type=COLUMNAR_MEDIA_TYPES[format],
+            headers={"Content-Disposition": f"attachment; filename=calculation_history.{extension}"},
+        )
+
+    encoder = CsvEncoder()
+    headers = {
+        "Content-Disposition": "attachment; filename=calculation_history.csv",
+        "Vary": "Accept-Encoding",
+    }
+    if "gzip" in request.headers.get("accept-encoding", "").lower():
+        encoder = GzipEncoder(encoder)
+        headers["Content-Encoding"] = "gzip"
+
+    state = await db.run(get_history_state, user_id=user.id)
+
+    return _heavy_response(
+        request,
+        "export",
+        _history_body(request, user.id, encoder, CSV_COLUMNS, since, state.archived_through),
         media_type="text/csv",
-        headers={"Content-Disposition": "attachment; filename=calculation_history.csv"},
+        headers=headers,
     )
 
 
-@router.post("/undo/push")
-def push_undo(request: Request, payload: dict):
-    session = request.session
-    undo_stack = session.get("undo_stack", [])
-    undo_stack.append(payload)
-    session["undo_stack"] = undo_stack
-    session["redo_stack"] = []
-    return {"status": "ok"}
+def _import_events(user_id: int, reader, index, upload):
+    db = SessionLocal()
+    try:
+        for event in iter_import(
+            db, user_id, reader, index,
+            chunk_rows=settings.import_chunk_rows, max_errors=settings.import_max_errors,
+        ):
+            yield json.dumps(event) + "\n"
+    except Exception:
+        db.rollback()
+        logger.exception("history import for user %s failed", user_id)
+        yield json.dumps({"event": "failed", "error": "Import failed; chunks reported above were saved"}) + "\n"
+    finally:
+        db.close()
+        upload.close()
 
 
-@router.post("/undo/pop")
-def undo_calculation(request: Request):
+@router.post("/import/history", dependencies=[admit("import")])
+async def import_history_csv(request: Request, user=Depends(get_current_user)):
+    """
+    Import a CSV sent as the request body (the export's layout, optionally
+    with created_at). Results are recomputed; the response streams NDJSON
+    progress and per-row error events as each chunk is committed.
+    """
+    # Admission comes first, so a shed request is not read (or spooled) at all
+    slot = _heavy_slot(request, "import")
+    # The body is spooled first: the response cannot read it while streaming
+    upload = tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES)
+    text = io.TextIOWrapper(upload, encoding="utf-8-sig", newline="")
+    try:
+        async for part in request.stream():
+            upload.write(part)
+        upload.seek(0)
+        try:
+            reader, index = open_import(text)
+        except ImportFormatError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except BaseException:
+        text.close()
+        if slot is not None:
+            slot.release()
+        raise
+
+    return SlotStreamingResponse(
+        slot, _import_events(user.id, reader, index, text), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/diagnostics")
+async def api_diagnostics(request: Request, user=Depends(get_current_user)):
+    """In-process cache and pool statistics for this worker."""
+    return {
+        "expression_cache": expression_cache.stats(),
+        "auth_cache": token_cache.stats(),
+        "password_pool": password_pool_stats(),
+        "db_pool": db_pool_stats(),
+        "write_behind": request.app.state.write_behind.stats() if request.app.state.write_behind else None,
+        "retention": request.app.state.retention.stats() if request.app.state.retention else None,
+        "undo": request.app.state.undo_store.stats(),
+        "admission": request.app.state.admission.stats() if request.app.state.admission else None,
+        "templates": renderer.stats(),
+        "sql": sql_trace_stats(),
+    }
+
+
+def _undo_key(request: Request) -> str:
+    """The session cookie only carries this id; the stacks live in the undo store."""
     session = request.session
-    undo_stack = session.get("undo_stack", [])
-    redo_stack = session.get("redo_stack", [])
+    # Drop stacks left over from when they were kept in the cookie itself
+    session.pop("undo_stack", None)
+    session.pop("redo_stack", None)
+    key = session.get("undo_id")
+    if key is None:
+        key = session["undo_id"] = uuid.uuid4().hex
+    return key
 
-    if not undo_stack:
-        return {"status": "empty"}
 
-    last = undo_stack.pop()
-    redo_stack.append(last)
+async def _read_body(request: Request, limit: int) -> bytes:
+    """The request body, or 413 as soon as it is known to exceed `limit` bytes."""
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=f"Body larger than {limit} bytes"
+    )
+    declared = request.headers.get("content-length", "")
+    if declared.isdigit() and int(declared) > limit:
+        raise too_large
+    body = bytearray()
+    async for part in request.stream():
+        body += part
+        if len(body) > limit:
+            raise too_large
+    return bytes(body)
 
-    session["undo_stack"] = undo_stack
-    session["redo_stack"] = redo_stack
 
+@router.post("/undo/push")
+async def push_undo(request: Request):
+    body = await _read_body(request, settings.undo_max_payload_bytes)
+    try:
+        entry = UndoEntryIn.model_validate_json(body)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    await run_in_threadpool(request.app.state.undo_store.push, _undo_key(request), entry.model_dump())
+    return {"status": "ok"}
+
+
+@router.post("/undo/pop")
+def undo_calculation(request: Request):
+    last = request.app.state.undo_store.undo(_undo_key(request))
+    if last is None:
+        return {"status": "empty"}
     return {"status": "ok", "calculation": last}
 
 
 @router.post("/redo")
 def redo_calculation(request: Request):
-    session = request.session
-    undo_stack = session.get("undo_stack", [])
-    redo_stack = session.get("redo_stack", [])
-
-    if not redo_stack:
+    calc = request.app.state.undo_store.redo(_undo_key(request))
+    if calc is None:
         return {"status": "empty"}
-
-    calc = redo_stack.pop()
-    undo_stack.append(calc)
-
-    session["undo_stack"] = undo_stack
-    session["redo_stack"] = redo_stack
-
     return {"status": "ok", "calculation": calc}
@@ -1,22 +1,21 @@
 from fastapi import APIRouter, Depends, Request, Form
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from app.db.session import get_db
+from app.db.session import SessionRunner, get_runner
 from app.core.security import create_access_token
-from app.services.user_service import create_user, authenticate, UserAlreadyExists, InvalidCredentials
+from app.services.user_service import create_user_async, authenticate_async, UserAlreadyExists, InvalidCredentials
 
 router = APIRouter()
 
 @router.post("/auth/register")
-def register(
+async def register(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
     try:
-        create_user(db, username=username, email=email, password=password)
+        await create_user_async(db, username=username, email=email, password=password)
     except UserAlreadyExists as e:
         request.state.flash = ("error", str(e))
         return RedirectResponse(url="/register", status_code=303)
@@ -24,14 +23,14 @@ def register(
     return RedirectResponse(url="/login", status_code=303)
 
 @router.post("/auth/login")
-def login(
+async def login(
     request: Request,
     username: str = Form(...),
     password: str = Form(...),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
     try:
-        user = authenticate(db, username=username, password=password)
+        user = await authenticate_async(db, username=username, password=password)
     except InvalidCredentials:
         request.state.flash = ("error", "Invalid username or password")
         return RedirectResponse(url="/login", status_code=303)
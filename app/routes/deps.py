@@ -1,15 +1,21 @@
-from fastapi import Depends, Request, HTTPException, status
-from sqlalchemy.orm import Session
-from app.db.session import get_db
+import hashlib
+
+from fastapi import Depends, Request, HTTPException, Response, status
+from app.db.session import SessionRunner, get_runner
 from app.core.security import decode_token
-from app.models.user import User
-from app.services.user_service import get_user
+from app.core.token_cache import UserSnapshot, token_cache
+from app.services.user_service import get_user_by_username
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
+async def get_current_user(request: Request, db: SessionRunner = Depends(get_runner)) -> UserSnapshot:
     token = request.cookies.get("access_token")
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
 
+    # Hot path: token already verified and user looked up recently
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
         payload = decode_token(token)
         username = payload.get("sub")
@@ -19,7 +25,30 @@ def get_current_user(request: Request, db: Session = Depends(get_db)) -> User:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
     # Re-fetch the user (in case profile was updated)
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.run(get_user_by_username, username)
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return user
+
+    snapshot = UserSnapshot.from_user(user)
+    token_cache.put(token, snapshot, payload.get("exp"))
+    return snapshot
+
+
+# Conditional GET: polled views carry an ETag derived from the user's history
+# version and answer 304 when the client already has that representation.
+REVALIDATE = "private, no-cache"
+
+def make_etag(*parts) -> str:
+    digest = hashlib.blake2b("\x1f".join(map(str, parts)).encode(), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    # If-None-Match uses weak comparison
+    candidates = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in candidates or "*" in candidates
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": REVALIDATE})
@@ -1,14 +1,13 @@
 from fastapi import APIRouter, Depends, Request
 from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
 from fastapi import Form
-from app.db.session import get_db
-from app.routes.deps import get_current_user
-from app.services.calc_service import list_calculations, get_stats
-from app.services.user_service import update_profile, change_password, UserAlreadyExists, PasswordChangeError
+from markupsafe import Markup
+from app.core.templating import renderer
+from app.db.session import SessionRunner, get_runner
+from app.routes.deps import REVALIDATE, etag_matches, get_current_user, make_etag, not_modified
+from app.services.calc_service import list_calculations, get_history_state
+from app.services.user_service import update_profile_by_id, change_password_async, UserAlreadyExists, PasswordChangeError
 
-templates = Jinja2Templates(directory="templates")
 router = APIRouter()
 
 def _pop_flash(request: Request):
@@ -17,49 +16,80 @@ def _pop_flash(request: Request):
         request.session["flash"] = flash
     return request.session.pop("flash", None)
 
+def _render_page(request: Request, name: str, key: tuple, context: dict) -> str:
+    """
+    Render a full page, served from the fragment cache when `key` captures
+    everything it depends on. Pages showing a flash message are one-offs and
+    are never cached.
+    """
+    flash = _pop_flash(request)
+    if flash is not None:
+        return renderer.render(name, {"request": request, "flash": flash, **context})
+    return renderer.render_cached(key, name, {"request": request, "flash": None, **context})
+
 @router.get("/", response_class=HTMLResponse)
 def home(request: Request):
-    flash = _pop_flash(request)
-    return templates.TemplateResponse("index.html", {"request": request, "flash": flash})
+    return HTMLResponse(_render_page(request, "index.html", ("page", "index.html"), {}))
 
 @router.get("/login", response_class=HTMLResponse)
 def login_page(request: Request):
-    flash = _pop_flash(request)
-    return templates.TemplateResponse("auth/login.html", {"request": request, "flash": flash})
+    return HTMLResponse(_render_page(request, "auth/login.html", ("page", "auth/login.html"), {}))
 
 @router.get("/register", response_class=HTMLResponse)
 def register_page(request: Request):
-    flash = _pop_flash(request)
-    return templates.TemplateResponse("auth/register.html", {"request": request, "flash": flash})
+    return HTMLResponse(_render_page(request, "auth/register.html", ("page", "auth/register.html"), {}))
 
 @router.get("/dashboard", response_class=HTMLResponse)
-def dashboard(request: Request, user=Depends(get_current_user), db: Session = Depends(get_db)):
+async def dashboard(request: Request, user=Depends(get_current_user), db: SessionRunner = Depends(get_runner)):
     flash = _pop_flash(request)
-    calcs = list_calculations(db, user_id=user.id, limit=20)
-    stats = get_stats(db, user_id=user.id)
-    return templates.TemplateResponse("dashboard.html", {
-        "request": request,
-        "user": user,
-        "calcs": calcs,
-        "stats": stats,
-        "flash": flash
-    })
+    version, archived_through, stats = await db.run(get_history_state, user_id=user.id)
+    etag = make_etag("dashboard", user.id, user.username, user.email, version)
+    # A pending flash message is part of the page, so never answer 304 over it
+    if flash is None and etag_matches(request, etag):
+        return not_modified(etag)
+
+    # The whole page, then the history rows, are cached per history version,
+    # so a hit skips both the queries and the rendering.
+    page_key = ("dashboard", user.id, user.username, user.email, version)
+    html = renderer.fragments.get(page_key) if flash is None else None
+    if html is None:
+        rows_key = ("history_rows", user.id, version)
+        rows = renderer.fragments.get(rows_key)
+        if rows is None:
+            calcs = await db.run(list_calculations, user_id=user.id, limit=20, archived_through=archived_through)
+            rows = renderer.render("partials/history_rows.html", {"calcs": calcs})
+            renderer.fragments.put(rows_key, rows)
+        html = renderer.render("dashboard.html", {
+            "request": request,
+            "user": user,
+            "history_rows": Markup(rows),
+            "stats": stats,
+            "flash": flash
+        })
+        if flash is None:
+            renderer.fragments.put(page_key, html)
+
+    response = HTMLResponse(html)
+    if flash is None:
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = REVALIDATE
+    return response
 
 @router.get("/profile", response_class=HTMLResponse)
 def profile_page(request: Request, user=Depends(get_current_user)):
-    flash = _pop_flash(request)
-    return templates.TemplateResponse("profile.html", {"request": request, "user": user, "flash": flash})
+    key = ("profile", user.id, user.username, user.email)
+    return HTMLResponse(_render_page(request, "profile.html", key, {"user": user}))
 
 @router.post("/profile")
-def profile_update(
+async def profile_update(
     request: Request,
     username: str = Form(...),
     email: str = Form(...),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
     try:
-        update_profile(db, user=user, username=username, email=email)
+        await db.run(update_profile_by_id, user.id, username=username, email=email)
         request.state.flash = ("success", "Profile updated.")
     except UserAlreadyExists as e:
         request.state.flash = ("error", str(e))
@@ -67,19 +97,19 @@ def profile_update(
 
 
 @router.post("/profile/password")
-def profile_password_change(
+async def profile_password_change(
     request: Request,
     current_password: str = Form(...),
     new_password: str = Form(...),
     confirm_password: str = Form(...),
     user=Depends(get_current_user),
-    db: Session = Depends(get_db),
+    db: SessionRunner = Depends(get_runner),
 ):
     if new_password != confirm_password:
         request.state.flash = ("error", "New passwords do not match.")
         return RedirectResponse(url="/profile", status_code=303)
     try:
-        change_password(db, user=user, current_password=current_password, new_password=new_password)
+        await change_password_async(db, user.id, current_password=current_password, new_password=new_password)
         request.state.flash = ("success", "Password changed. Please login again.")
         resp = RedirectResponse(url="/login", status_code=303)
         resp.delete_cookie("access_token")
@@ -1,5 +1,10 @@
+from datetime import datetime
+from typing import Literal
+
 from pydantic import BaseModel, Field
 
+from app.core.config import settings
+
 
 class CalcIn(BaseModel):
     op: str = Field(description="add/sub/mul/div/mod/pow")
@@ -7,17 +12,45 @@ class CalcIn(BaseModel):
     b: float
 
 
+class UndoEntryIn(BaseModel):
+    """An (op, a, b) calculation kept on the undo stack; other fields are dropped."""
+
+    op: str = Field(min_length=1, max_length=20)
+    a: float
+    b: float
+
+
+class BatchCalcIn(BaseModel):
+    items: list[CalcIn] = Field(min_length=1, max_length=settings.batch_max_items)
+
+
 class ExpressionIn(BaseModel):
     expression: str = Field(min_length=1, description="Math expression like (5+3)*2")
+    variables: dict[str, float] | None = Field(default=None, description="Values for named variables, e.g. {\"x\": 2}")
+
+
+class RangeIn(BaseModel):
+    start: float
+    stop: float
+    step: float | None = Field(default=None, description="Spacing; stop is exclusive")
+    num: int | None = Field(default=None, description="Number of points; stop is inclusive")
+
+
+class SweepIn(BaseModel):
+    expression: str = Field(min_length=1, description="Expression with variables like (x + 3) * y")
+    variables: dict[str, list[float] | RangeIn] = Field(default_factory=dict)
+    mode: Literal["zip", "grid"] = Field(default="zip", description="zip: row-aligned columns, grid: all combinations")
+    format: Literal["json", "binary"] = Field(default="json", description="json: NDJSON chunks, binary: packed <f8,u1 records")
 
 
 class CalcOut(BaseModel):
-    id: int
-    op: str
-    a: float
-    b: float
+    id: int | None = Field(default=None, description="None while the row is queued for write-behind")
+    op: str | None = None
+    a: float | None = None
+    b: float | None = None
     expression: str | None = None
     result: float
+    created_at: datetime | None = None
 
     class Config:
         from_attributes = True
@@ -27,3 +60,41 @@ class StatsOut(BaseModel):
     total_calculations: int
     average_result: float
     last_operation: str | None
+
+
+class TimeseriesSummary(BaseModel):
+    count: int
+    sum: float
+    mean: float | None
+    min: float | None
+    max: float | None
+
+
+class TimeseriesPoint(TimeseriesSummary):
+    bucket: datetime
+
+
+class OpSummary(TimeseriesSummary):
+    op: str
+
+
+class TimeseriesOut(BaseModel):
+    grain: Literal["hour", "day"]
+    start: datetime
+    end: datetime
+    series: list[TimeseriesPoint]
+    by_op: list[OpSummary]
+    distribution: dict[str, int] = Field(description="Result counts per value band over the range")
+
+
+class BatchItemOut(BaseModel):
+    index: int
+    id: int | None = None
+    result: float | None = None
+    error: str | None = None
+
+
+class BatchCalcOut(BaseModel):
+    items: list[BatchItemOut]
+    succeeded: int
+    failed: int
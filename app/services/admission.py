@@ -0,0 +1,263 @@
+"""
+Admission control for the expensive API routes.
+
+Two checks, both answered immediately so nothing queues without bound:
+
+- a token bucket per user (ADMISSION_RATE tokens/s, up to ADMISSION_BURST),
+  where each route costs a fixed number of tokens; an empty bucket is a 429
+  with Retry-After set to when enough tokens will have refilled.
+- a cap on concurrent heavy requests (sweeps, exports, imports), held until the
+  streamed response ends; a full cap is a 503.
+
+The state lives in a backend: MemoryAdmissionBackend per process,
+DatabaseAdmissionBackend for buckets shared by every worker, or any class
+named by ADMISSION_BACKEND that provides the same methods.
+"""
+import importlib
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import case, select, update
+from sqlalchemy.exc import IntegrityError
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+from app.core.config import settings
+from app.models.rate_limit_bucket import RateLimitBucket
+
+# Tokens charged per request; a bucket refills ADMISSION_RATE per second
+COSTS = {
+    "calculate": 1,
+    "expression": 1,
+    "batch": 10,
+    "sweep": 10,
+    "export": 10,
+    "import": 10,
+}
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, status_code: int, detail: str, retry_after: float):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))}
+
+
+def _refill(tokens: float, elapsed: float, rate: float, burst: float) -> float:
+    return min(burst, tokens + max(0.0, elapsed) * rate)
+
+
+class MemoryAdmissionBackend:
+    """
+    Buckets and concurrency counters for this process only. Buckets are kept
+    in LRU order and the least recently used is dropped past max_keys, which
+    at worst lets that user start again from a full bucket.
+    """
+
+    blocking = False
+
+    def __init__(self, max_keys: int = 10000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._slots: dict[str, int] = {}
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        """Charge `cost` tokens; returns 0 if admitted, else seconds until it would be."""
+        with self._lock:
+            now = time.monotonic()
+            tokens, stamp = self._buckets.get(key, (burst, now))
+            tokens = _refill(tokens, now - stamp, rate, burst)
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def acquire(self, name: str, limit: int) -> bool:
+        with self._lock:
+            in_use = self._slots.get(name, 0)
+            if in_use >= limit:
+                return False
+            self._slots[name] = in_use + 1
+            return True
+
+    def release(self, name: str) -> None:
+        with self._lock:
+            self._slots[name] = max(0, self._slots.get(name, 0) - 1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "buckets": len(self._buckets), "slots_in_use": dict(self._slots)}
+
+
+class DatabaseAdmissionBackend(MemoryAdmissionBackend):
+    """
+    Token buckets in the rate_limit_buckets table, so a user's rate holds
+    across workers. A check is one conditional UPDATE that refills and
+    debits the bucket in SQL, so concurrent checks cannot both spend the same
+    tokens on any database (no reliance on SELECT ... FOR UPDATE, which
+    SQLite ignores); only a refused or first check reads the row.
+    Concurrency caps stay per worker: they protect this process's threads
+    and connections, and a crashed worker cannot leak a shared slot.
+    """
+
+    blocking = True
+
+    def __init__(self, session_factory, max_keys: int = 10000):
+        super().__init__(max_keys=max_keys)
+        self.session_factory = session_factory
+
+    def take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        try:
+            return self._take(key, cost, rate, burst)
+        except IntegrityError:
+            # Another worker created this user's bucket first
+            return self._take(key, cost, rate, burst)
+
+    def _take(self, key: str, cost: float, rate: float, burst: float) -> float:
+        now = time.time()
+        stamp = RateLimitBucket.updated_at
+        # _refill, in SQL; the stamp never moves backwards if worker clocks differ
+        filled = RateLimitBucket.tokens + case((stamp < now, now - stamp), else_=0.0) * rate
+        refilled = case((filled > burst, burst), else_=filled)
+        with self.session_factory() as db:
+            taken = db.execute(
+                update(RateLimitBucket)
+                .where(RateLimitBucket.key == key, refilled >= cost)
+                .values(tokens=refilled - cost, updated_at=case((stamp < now, now), else_=stamp))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if taken:
+                db.commit()
+                return 0.0
+
+            row = db.execute(
+                select(RateLimitBucket.tokens, RateLimitBucket.updated_at).where(RateLimitBucket.key == key)
+            ).one_or_none()
+            if row is None:
+                admitted = burst >= cost
+                db.add(RateLimitBucket(key=key, tokens=burst - cost if admitted else burst, updated_at=now))
+                db.commit()
+                return 0.0 if admitted else (cost - burst) / rate
+            tokens = _refill(row.tokens, now - row.updated_at, rate, burst)
+            if tokens >= cost:
+                # Another worker created the bucket after the UPDATE missed it
+                return self._take(key, cost, rate, burst)
+            # A refused check changes nothing: the refill is recomputed from the stamp next time
+            return (cost - tokens) / rate
+
+    def stats(self) -> dict:
+        return {**super().stats(), "backend": "database"}
+
+
+class Slot:
+    """One held concurrency slot; released once, however the request ends."""
+
+    def __init__(self, backend, name: str):
+        self.backend = backend
+        self.name = name
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self.backend.release(self.name)
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """
+    A StreamingResponse holding a heavy-request slot until it has been sent.
+    The slot is released when the response call returns, not from inside the
+    body, so a client that disconnects before the body starts (and the body
+    generator never runs) does not leak it.
+    """
+
+    def __init__(self, slot: Slot | None, content, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.slot is not None:
+                self.slot.release()
+
+
+class AdmissionController:
+    def __init__(self, backend, rate: float, burst: float, heavy_concurrency: int):
+        self.backend = backend
+        self.rate = rate
+        self.burst = burst
+        self.heavy_concurrency = heavy_concurrency
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    async def check_rate(self, user_id: int, route: str) -> None:
+        """Raises AdmissionRejected (429) when the user's bucket cannot cover the route."""
+        cost = min(COSTS[route], self.burst)
+        key = f"user:{user_id}"
+        if self.backend.blocking:
+            wait = await run_in_threadpool(self.backend.take, key, cost, self.rate, self.burst)
+        else:
+            wait = self.backend.take(key, cost, self.rate, self.burst)
+        if wait > 0:
+            self.rate_limited += 1
+            raise AdmissionRejected(429, "Rate limit exceeded, slow down", wait)
+        self.admitted += 1
+
+    def heavy_slot(self, name: str) -> Slot:
+        """Raises AdmissionRejected (503) when this worker is at its cap for heavy requests."""
+        if not self.backend.acquire("heavy", self.heavy_concurrency):
+            self.shed += 1
+            raise AdmissionRejected(503, f"Too many {name} requests in progress, try again shortly", 1.0)
+        return Slot(self.backend, "heavy")
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "heavy_concurrency": self.heavy_concurrency,
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed": self.shed,
+            **self.backend.stats(),
+        }
+
+
+def _load_backend(path: str):
+    module_name, _, class_name = path.partition(":")
+    if not class_name:
+        raise ValueError(f"Unsupported ADMISSION_BACKEND: {path}")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+def create_admission_controller(session_factory) -> AdmissionController | None:
+    if not settings.admission_enabled:
+        return None
+    if settings.admission_backend == "memory":
+        backend = MemoryAdmissionBackend(max_keys=settings.admission_max_keys)
+    elif settings.admission_backend == "database":
+        backend = DatabaseAdmissionBackend(session_factory, max_keys=settings.admission_max_keys)
+    else:
+        backend = _load_backend(settings.admission_backend)
+    return AdmissionController(
+        backend,
+        rate=settings.admission_rate,
+        burst=settings.admission_burst,
+        heavy_concurrency=settings.admission_heavy_concurrency,
+    )
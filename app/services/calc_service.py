@@ -1,37 +1,45 @@
+import base64
+import json
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func, desc
-import ast
-import operator as op
+from sqlalchemy import select, func, desc, insert, update, tuple_, case, or_
 
 from app.models.calculation import Calculation
-from app.services.calculator import calculate
-
-# Allowed operators for expression evaluation
-_ALLOWED_OPS = {
-    ast.Add: op.add,
-    ast.Sub: op.sub,
-    ast.Mult: op.mul,
-    ast.Div: op.truediv,
-    ast.Mod: op.mod,
-    ast.Pow: op.pow,
-    ast.USub: op.neg,
-}
-
-def _safe_eval(expr: str) -> float:
-    def _eval(node):
-        if isinstance(node, ast.Constant):
-            return node.value
-        elif isinstance(node, ast.BinOp):
-            return _ALLOWED_OPS[type(node.op)](
-                _eval(node.left), _eval(node.right)
-            )
-        elif isinstance(node, ast.UnaryOp):
-            return _ALLOWED_OPS[type(node.op)](_eval(node.operand))
-        else:
-            raise ValueError("Invalid expression")
+from app.models.calculation_archive import ArchivedCalculation
+from app.models.user import User
+from app.models.user_stats import UserStats
+from app.services.calculator import calculate, calculate_batch, evaluate_expression
+from app.services.rollups import record_rollups, recompute_buckets
+
 
-    tree = ast.parse(expr, mode="eval")
-    return float(_eval(tree.body))
+def build_calculation_row(
+    user_id: int,
+    op: str | None = None,
+    a: float | None = None,
+    b: float | None = None,
+    expression: str | None = None,
+) -> dict:
+    """Evaluate one calculation into an insertable row; raises like `calculate`."""
+    if expression:
+        return {
+            "user_id": user_id,
+            "op": None,
+            "a": None,
+            "b": None,
+            "expression": expression,
+            "result": evaluate_expression(expression),
+        }
+    return {
+        "user_id": user_id,
+        "op": op.lower().strip(),
+        "a": a,
+        "b": b,
+        "expression": None,
+        "result": calculate(op, a, b),
+    }
 
 
 def create_calculation(
@@ -42,62 +50,369 @@ def create_calculation(
     b: float | None = None,
     expression: str | None = None,
 ) -> Calculation:
-
-    if expression:
-        result = _safe_eval(expression)
-        calc = Calculation(
-            user_id=user_id,
-            expression=expression,
-            result=result,
-        )
-    else:
-        result = calculate(op, a, b)
-        calc = Calculation(
-            user_id=user_id,
-            op=op.lower().strip(),
-            a=a,
-            b=b,
-            result=result,
-        )
+    calc = Calculation(**build_calculation_row(user_id, op=op, a=a, b=b, expression=expression))
 
     db.add(calc)
+    db.flush()
+    _record_written(db, user_id, [_written(calc.id, calc.op, calc.result, calc.created_at)])
     db.commit()
     db.refresh(calc)
     return calc
 
 
-def list_calculations(db: Session, user_id: int, limit: int = 20):
-    return list(
-        db.execute(
-            select(Calculation)
-            .where(Calculation.user_id == user_id)
-            .order_by(desc(Calculation.created_at))
-            .limit(limit)
-        ).scalars().all()
+def _written(calc_id: int, op: str | None, result: float, created_at: datetime) -> dict:
+    return {"id": calc_id, "op": op, "result": result, "created_at": created_at}
+
+
+def _record_written(db: Session, user_id: int, written: list[dict]) -> None:
+    """Fold freshly inserted (flushed, uncommitted) rows into the user's aggregates and rollups."""
+    if not written:
+        return
+    record_rollups(db, user_id, written)
+    last = max(written, key=lambda w: (w["created_at"], w["id"]))
+    # Backdated rows (imports) must not displace a newer latest calculation
+    newer = or_(UserStats.last_created_at.is_(None), UserStats.last_created_at <= last["created_at"])
+    update_stmt = (
+        update(UserStats)
+        .where(UserStats.user_id == user_id)
+        .values(
+            calc_count=UserStats.calc_count + len(written),
+            result_sum=UserStats.result_sum + sum(w["result"] for w in written),
+            last_calc_id=case((newer, last["id"]), else_=UserStats.last_calc_id),
+            last_op=case((newer, last["op"]), else_=UserStats.last_op),
+            last_created_at=case((newer, last["created_at"]), else_=UserStats.last_created_at),
+            version=UserStats.version + 1,
+        )
     )
+    updated = db.execute(update_stmt)
+    if updated.rowcount == 0 and not _seed_user_stats(db, user_id):
+        # A concurrent writer seeded the row first, from history without the
+        # rows above (still uncommitted here), so add them to it after all
+        db.execute(update_stmt)
 
 
-def get_stats(db: Session, user_id: int) -> dict:
-    total = db.execute(
-        select(func.count(Calculation.id)).where(Calculation.user_id == user_id)
-    ).scalar_one()
+def insert_calculation_rows(db: Session, rows: list[dict]) -> list[tuple[int, datetime]]:
+    """
+    Save prepared rows (possibly for many users) with one multi-row insert and
+    fold them into each user's aggregates. Returns (id, created_at) per row in
+    input order; the caller commits.
+    """
+    inserted = db.execute(
+        insert(Calculation).returning(
+            Calculation.id, Calculation.created_at, sort_by_parameter_order=True
+        ),
+        rows,
+    ).all()
 
-    avg = db.execute(
-        select(func.avg(Calculation.result)).where(Calculation.user_id == user_id)
-    ).scalar_one()
+    by_user: dict[int, list[dict]] = {}
+    for row, (new_id, created_at) in zip(rows, inserted):
+        by_user.setdefault(row["user_id"], []).append(
+            _written(new_id, row["op"], row["result"], created_at)
+        )
+    for user_id, written in by_user.items():
+        _record_written(db, user_id, written)
+    return [tuple(r) for r in inserted]
 
-    last_op = db.execute(
-        select(Calculation.op)
-        .where(Calculation.user_id == user_id)
-        .order_by(desc(Calculation.created_at))
-        .limit(1)
-    ).scalar_one_or_none()
 
+def create_calculations_batch(
+    db: Session,
+    user_id: int,
+    items: list[tuple[str, float, float]],
+) -> list[dict]:
+    """
+    Evaluate many (op, a, b) triples at once and save the successful ones
+    with a single multi-row insert and one commit.
+
+    Returns one dict per input item, in input order, with either the saved
+    row's id and result or the error message.
+    """
+    ops = [item[0] for item in items]
+    results, errors = calculate_batch(ops, [item[1] for item in items], [item[2] for item in items])
+
+    ok = [i for i, error in enumerate(errors) if error is None]
+    rows = [
+        {
+            "user_id": user_id,
+            "op": ops[i].lower().strip(),
+            "a": float(items[i][1]),
+            "b": float(items[i][2]),
+            "expression": None,
+            "result": float(results[i]),
+        }
+        for i in ok
+    ]
+
+    ids: dict[int, int] = {}
+    if rows:
+        inserted = insert_calculation_rows(db, rows)
+        db.commit()
+        ids = {i: new_id for i, (new_id, _) in zip(ok, inserted)}
+
+    return [
+        {
+            "index": i,
+            "id": ids.get(i),
+            "result": float(results[i]) if errors[i] is None else None,
+            "error": errors[i],
+        }
+        for i in range(len(items))
+    ]
+
+
+def encode_cursor(created_at: datetime, calc_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), calc_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, calc_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(calc_id)
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+
+def _history_page(db: Session, model, user_id: int, limit: int, after: tuple[datetime, int] | None) -> list:
+    stmt = (
+        select(model)
+        .where(model.user_id == user_id)
+        .order_by(desc(model.created_at), desc(model.id))
+        .limit(limit)
+    )
+    if after is not None:
+        stmt = stmt.where(tuple_(model.created_at, model.id) < tuple_(*after))
+    return list(db.execute(stmt).scalars().all())
+
+
+def list_calculations(
+    db: Session,
+    user_id: int,
+    limit: int = 20,
+    cursor: str | None = None,
+    archived_through: datetime | None = None,
+):
+    """
+    Newest first; `cursor` continues after the row it was encoded from.
+    With `archived_through` (see get_history_state), archived rows are merged
+    in once the page reaches back that far; otherwise only live rows are read.
+    """
+    after = decode_cursor(cursor) if cursor else None
+    rows = _history_page(db, Calculation, user_id, limit, after)
+    if archived_through is not None and (len(rows) < limit or rows[-1].created_at <= archived_through):
+        rows += _history_page(db, ArchivedCalculation, user_id, limit, after)
+        rows.sort(key=lambda calc: (calc.created_at, calc.id), reverse=True)
+        del rows[limit:]
+    return rows
+
+
+def list_calculations_page(
+    db: Session,
+    user_id: int,
+    limit: int = 20,
+    cursor: str | None = None,
+    archived_through: datetime | None = None,
+) -> tuple[list, str | None]:
+    """One keyset page plus the cursor for the next page (None on the last page)."""
+    rows = list_calculations(
+        db, user_id=user_id, limit=limit + 1, cursor=cursor, archived_through=archived_through
+    )
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def _latest_calculation(db: Session, user_id: int):
+    """Newest live row, or newest archived row once everything has been archived."""
+    latest = _history_page(db, Calculation, user_id, 1, None)
+    return latest[0] if latest else next(iter(_history_page(db, ArchivedCalculation, user_id, 1, None)), None)
+
+
+def _compute_user_stats(db: Session, user_id: int) -> UserStats:
+    total, result_sum = 0, 0.0
+    for model in (Calculation, ArchivedCalculation):
+        count, subtotal = db.execute(
+            select(func.count(model.id), func.sum(model.result)).where(model.user_id == user_id)
+        ).one()
+        total += count or 0
+        result_sum += subtotal or 0.0
+    archived_through = db.execute(
+        select(func.max(ArchivedCalculation.created_at)).where(ArchivedCalculation.user_id == user_id)
+    ).scalar()
+    last = _latest_calculation(db, user_id)
+    return UserStats(
+        user_id=user_id,
+        calc_count=int(total),
+        result_sum=float(result_sum),
+        last_calc_id=last.id if last else None,
+        last_op=last.op if last else None,
+        last_created_at=last.created_at if last else None,
+        archived_through=archived_through,
+    )
+
+
+def _seed_user_stats(db: Session, user_id: int) -> bool:
+    """
+    Insert the user's aggregate row, computed from history, unless one exists
+    already (caller commits). Returns False when another writer got there
+    first; the insert never fails on the primary key, so the caller's
+    transaction survives the race.
+    """
+    stats = _compute_user_stats(db, user_id)
+    values = {
+        column.name: getattr(stats, column.name)
+        for column in UserStats.__table__.columns
+        if getattr(stats, column.name) is not None
+    }
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(UserStats).values(values).on_conflict_do_nothing(index_elements=[UserStats.user_id])
+        return db.execute(stmt).rowcount > 0
+    try:
+        with db.begin_nested():
+            db.execute(insert(UserStats).values(values))
+    except IntegrityError:
+        return False
+    return True
+
+
+def rebuild_all_stats(db: Session, check_only: bool = False, user_id: int | None = None) -> list[dict]:
+    """
+    Compare every user's (or one user's) stored aggregates with their history
+    and, unless `check_only`, overwrite the ones that drifted. Returns the
+    drifted users.
+    """
+    drift = []
+    stmt = select(User.id).order_by(User.id)
+    if user_id is not None:
+        stmt = stmt.where(User.id == user_id)
+    user_ids = db.execute(stmt).scalars().all()
+    for user_id in user_ids:
+        expected = _compute_user_stats(db, user_id)
+        stored = db.get(UserStats, user_id)
+        if stored is not None and (
+            stored.calc_count == expected.calc_count
+            and abs(stored.result_sum - expected.result_sum) <= 1e-9 * max(1.0, abs(expected.result_sum))
+            and stored.last_calc_id == expected.last_calc_id
+            and stored.last_op == expected.last_op
+            and stored.archived_through == expected.archived_through
+        ):
+            continue
+        drift.append({
+            "user_id": user_id,
+            "stored_count": stored.calc_count if stored else None,
+            "expected_count": expected.calc_count,
+        })
+        if not check_only:
+            expected.version = stored.version + 1 if stored else 1
+            db.merge(expected)
+    if not check_only:
+        db.commit()
+    return drift
+
+
+def _stored_stats(db: Session, user_id: int) -> UserStats:
+    stats = db.get(UserStats, user_id)
+    if stats is None:
+        # Users registered before the stats table existed
+        _seed_user_stats(db, user_id)
+        db.commit()
+        stats = db.get(UserStats, user_id)
+    return stats
+
+
+def get_history_version(db: Session, user_id: int) -> int:
+    """Changes whenever the user's history does; one primary-key lookup."""
+    return _stored_stats(db, user_id).version
+
+
+def _stats_dict(stats: UserStats) -> dict:
+    count = stats.calc_count
     return {
-        "total_calculations": int(total or 0),
-        "average_result": float(avg or 0.0),
-        "last_operation": last_op,
+        "total_calculations": count,
+        "average_result": (stats.result_sum / count) if count else 0.0,
+        "last_operation": stats.last_op,
+    }
+
+
+def get_stats(db: Session, user_id: int) -> dict:
+    return _stats_dict(_stored_stats(db, user_id))
+
+
+def get_versioned_stats(db: Session, user_id: int) -> tuple[int, dict]:
+    """History version and stats from the same row, so callers that need both make one lookup."""
+    stats = _stored_stats(db, user_id)
+    return stats.version, _stats_dict(stats)
+
+
+class HistoryState(NamedTuple):
+    version: int
+    archived_through: datetime | None
+    stats: dict
+
+
+def get_history_state(db: Session, user_id: int) -> HistoryState:
+    """Version, archive horizon and stats from the one user_stats row."""
+    stats = _stored_stats(db, user_id)
+    return HistoryState(stats.version, stats.archived_through, _stats_dict(stats))
+
+
+def get_calculation(db: Session, user_id: int, calc_id: int) -> Calculation | None:
+    calc = db.get(Calculation, calc_id)
+    if calc is None or calc.user_id != user_id:
+        return None
+    return calc
+
+
+def update_calculation(db: Session, calc: Calculation, op: str, a: float, b: float) -> Calculation:
+    """Re-run an (op, a, b) calculation with new inputs and adjust the aggregates."""
+    result = calculate(op, a, b)
+    delta = result - calc.result
+
+    calc.op = op.lower().strip()
+    calc.a = a
+    calc.b = b
+    calc.expression = None
+    calc.result = result
+    db.add(calc)
+    db.flush()
+    recompute_buckets(db, calc.user_id, calc.created_at)
+
+    values = {"result_sum": UserStats.result_sum + delta, "version": UserStats.version + 1}
+    stats = db.get(UserStats, calc.user_id)
+    if stats is not None and stats.last_calc_id == calc.id:
+        values["last_op"] = calc.op
+    db.execute(update(UserStats).where(UserStats.user_id == calc.user_id).values(**values))
+
+    db.commit()
+    db.refresh(calc)
+    return calc
+
+
+def delete_calculation(db: Session, calc: Calculation) -> None:
+    user_id = calc.user_id
+    db.delete(calc)
+    db.flush()
+    recompute_buckets(db, user_id, calc.created_at)
+
+    values = {
+        "calc_count": UserStats.calc_count - 1,
+        "result_sum": UserStats.result_sum - calc.result,
+        "version": UserStats.version + 1,
     }
+    stats = db.get(UserStats, user_id)
+    if stats is not None and stats.last_calc_id == calc.id:
+        last = _latest_calculation(db, user_id)
+        values["last_calc_id"] = last.id if last else None
+        values["last_op"] = last.op if last else None
+        values["last_created_at"] = last.created_at if last else None
+    db.execute(update(UserStats).where(UserStats.user_id == user_id).values(**values))
+    db.commit()
 
 
 def get_all_calculations(db: Session, user_id: int):
@@ -1,6 +1,10 @@
 import math
-import ast
-import operator as op
+from typing import TYPE_CHECKING, Mapping, Sequence
+
+from app.services.expression_engine import compile_expression
+
+if TYPE_CHECKING:
+    import numpy as np
 
 
 ALLOWED_OPS = {"add", "sub", "mul", "div", "mod", "pow"}
@@ -33,69 +37,85 @@ def calculate(op_name: str, a: float, b: float) -> float:
     raise ValueError("Invalid operation")
 
 
-# Multi-level expression
+def calculate_batch(
+    op_names: Sequence[str], a: Sequence[float], b: Sequence[float]
+) -> "tuple[np.ndarray, list[str | None]]":
+    """
+    Vectorized counterpart of `calculate` for many (op, a, b) triples.
 
-_ALLOWED_AST_BINOPS = {
-    ast.Add: op.add,
-    ast.Sub: op.sub,
-    ast.Mult: op.mul,
-    ast.Div: op.truediv,
-    ast.Mod: op.mod,
-    ast.Pow: op.pow,
-}
+    Items are grouped by operation and each group is evaluated as one NumPy
+    array operation with the same zero-division and pow guards. Returns the
+    results (NaN where an item failed) and a per-item error message list,
+    both in input order.
+    """
+    import numpy as np
+
+    names = np.array([name.lower().strip() for name in op_names], dtype=object)
+    av = np.asarray(a, dtype=np.float64)
+    bv = np.asarray(b, dtype=np.float64)
+
+    results = np.full(len(names), np.nan, dtype=np.float64)
+    errors: list[str | None] = [None] * len(names)
+
+    def _fail(idx, message: str) -> None:
+        for i in idx.tolist():
+            errors[i] = message
+
+    for op_name in set(names.tolist()):
+        idx = np.flatnonzero(names == op_name)
+        if op_name not in ALLOWED_OPS:
+            _fail(idx, f"Unsupported operation: {op_name}")
+            continue
+
+        x = av[idx]
+        y = bv[idx]
+
+        if op_name in ("div", "mod"):
+            bad = y == 0
+            _fail(idx[bad], "Division by zero" if op_name == "div" else "Modulus by zero")
+        elif op_name == "pow":
+            bad = (np.abs(x) > 1e6) | (np.abs(y) > 1e3)
+            _fail(idx[bad], "Inputs too large for pow")
+        else:
+            bad = np.zeros(len(idx), dtype=bool)
+
+        ok = ~bad
+        x = x[ok]
+        y = y[ok]
+        with np.errstate(all="ignore"):
+            if op_name == "add":
+                out = x + y
+            elif op_name == "sub":
+                out = x - y
+            elif op_name == "mul":
+                out = x * y
+            elif op_name == "div":
+                out = x / y
+            elif op_name == "mod":
+                out = np.mod(x, y)
+            else:
+                out = np.power(x, y)
+
+        # math.pow raises where NumPy quietly returns nan/inf; report those per item.
+        finite = np.isfinite(out)
+        if not finite.all():
+            _fail(idx[ok][~finite], "Result is not a finite number")
+        results[idx[ok][finite]] = out[finite]
+
+    return results, errors
 
-_ALLOWED_AST_UNARYOPS = {
-    ast.UAdd: op.pos,
-    ast.USub: op.neg,
-}
 
+# Multi-level expression
 
-def evaluate_expression(expression: str) -> float:
+def evaluate_expression(expression: str, variables: Mapping[str, float] | None = None) -> float:
     """
     Safely evaluate expressions like:
       (5 + 3) * 2
       10 / (2 + 3)
       2^3 + 4   (we treat ^ as power)
-    Allowed: numbers, + - * / % ** parentheses, unary +/-
-    """
-    if expression is None:
-        raise ValueError("Expression is required")
-
-    expr = expression.strip()
-    if not expr:
-        raise ValueError("Expression is required")
-
-    # Support caret power used in many calculators
-    expr = expr.replace("^", "**")
-
-    try:
-        node = ast.parse(expr, mode="eval")
-    except SyntaxError:
-        raise ValueError("Invalid expression syntax")
+    Allowed: numbers, named variables, + - * / % ** parentheses, unary +/-
 
-    def _eval(n: ast.AST) -> float:
-        if isinstance(n, ast.Expression):
-            return _eval(n.body)
-
-        if isinstance(n, ast.Constant) and isinstance(n.value, (int, float)):
-            return float(n.value)
-
-        if isinstance(n, ast.UnaryOp) and type(n.op) in _ALLOWED_AST_UNARYOPS:
-            return float(_ALLOWED_AST_UNARYOPS[type(n.op)](_eval(n.operand)))
-
-        if isinstance(n, ast.BinOp) and type(n.op) in _ALLOWED_AST_BINOPS:
-            left = _eval(n.left)
-            right = _eval(n.right)
-
-            if isinstance(n.op, (ast.Div, ast.Mod)) and right == 0:
-                raise ZeroDivisionError("Division by zero")
-
-            # small guardrails for huge exponent
-            if isinstance(n.op, ast.Pow) and (abs(left) > 1e6 or abs(right) > 1e3):
-                raise ValueError("Inputs too large for exponentiation")
-
-            return float(_ALLOWED_AST_BINOPS[type(n.op)](left, right))
-
-        raise ValueError("Unsupported expression content")
-
-    return float(_eval(node))
+    Parsing and validation happen once per distinct expression; the compiled
+    form is reused from the shared expression cache.
+    """
+    return compile_expression(expression).evaluate(variables)
@@ -0,0 +1,242 @@
+import csv
+import importlib.util
+import zlib
+from datetime import datetime, timezone
+from io import StringIO
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator
+
+from sqlalchemy import select, desc
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.calculation import Calculation
+from app.models.calculation_archive import ArchivedCalculation
+
+CSV_HEADER = ["operation", "a", "b", "expression", "result"]
+
+CSV_COLUMNS = (
+    Calculation.op,
+    Calculation.a,
+    Calculation.b,
+    Calculation.expression,
+    Calculation.result,
+)
+
+# Columnar exports (format=arrow/parquet) also carry the timestamp.
+COLUMNAR_COLUMNS = CSV_COLUMNS + (Calculation.created_at,)
+
+COLUMNAR_MEDIA_TYPES = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+def history_statement(
+    user_id: int,
+    columns=CSV_COLUMNS,
+    chunk_size: int | None = None,
+    model=Calculation,
+    since: datetime | None = None,
+):
+    """
+    A user's history (from `model`, live or archived) as plain column tuples,
+    newest first, in index order.
+
+    yield_per makes the rows arrive chunk by chunk (a server-side cursor on
+    Postgres) and never hydrates Calculation objects.
+    """
+    stmt = (
+        select(*(getattr(model, column.key) for column in columns))
+        .where(model.user_id == user_id)
+        .order_by(desc(model.created_at), desc(model.id))
+        .execution_options(yield_per=chunk_size or settings.export_chunk_rows)
+    )
+    if since is not None:
+        stmt = stmt.where(model.created_at >= since)
+    return stmt
+
+
+def _utc(value: datetime) -> datetime:
+    """Naive values are UTC already; aware ones are converted (SQLite drops the offset)."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def history_statements(
+    user_id: int,
+    columns=CSV_COLUMNS,
+    chunk_size: int | None = None,
+    since: datetime | None = None,
+    archived_through: datetime | None = None,
+) -> list:
+    """
+    Live rows, then archived rows if [since, now) reaches back to the user's
+    archive horizon (UserStats.archived_through). The retention job archives
+    the oldest rows, so the concatenation is newest first (barring rows
+    written with old timestamps since its last run).
+    """
+    if since is not None:
+        since = _utc(since)
+    statements = [history_statement(user_id, columns, chunk_size, since=since)]
+    if archived_through is not None and (since is None or since <= _utc(archived_through)):
+        statements.append(history_statement(user_id, columns, chunk_size, model=ArchivedCalculation, since=since))
+    return statements
+
+
+def iter_row_chunks(
+    db: Session,
+    user_id: int,
+    columns=CSV_COLUMNS,
+    chunk_size: int | None = None,
+    since: datetime | None = None,
+    archived_through: datetime | None = None,
+) -> Iterator[list[tuple]]:
+    for stmt in history_statements(user_id, columns, chunk_size, since=since, archived_through=archived_through):
+        result = db.execute(stmt)
+        try:
+            for partition in result.partitions():
+                yield partition
+        finally:
+            result.close()
+
+
+# Encoders turn row chunks into bytes incrementally: start(), then encode()
+# per chunk, then finish(). They are driven by encode_stream (sync sources)
+# or aencode_stream (async-mode sources).
+
+class CsvEncoder:
+    def __init__(self):
+        self._buffer = StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _take(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def start(self) -> bytes:
+        self._writer.writerow(CSV_HEADER)
+        return self._take()
+
+    def encode(self, rows: list[tuple]) -> bytes:
+        self._writer.writerows(rows)
+        return self._take()
+
+    def finish(self) -> bytes:
+        return b""
+
+
+class GzipEncoder:
+    """Wraps another encoder and compresses its output into one gzip member."""
+
+    def __init__(self, inner, level: int = 6):
+        self.inner = inner
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def start(self) -> bytes:
+        return self._compressor.compress(self.inner.start())
+
+    def encode(self, rows: list[tuple]) -> bytes:
+        return self._compressor.compress(self.inner.encode(rows))
+
+    def finish(self) -> bytes:
+        return self._compressor.compress(self.inner.finish()) + self._compressor.flush()
+
+
+def columnar_available() -> bool:
+    """pyarrow is an optional dependency, only needed for arrow/parquet exports."""
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+class _ChunkSink:
+    """Write-only file object whose buffered bytes are drained after each batch."""
+
+    closed = False
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class ColumnarEncoder:
+    """
+    Arrow IPC stream or Parquet file from row chunks in COLUMNAR_COLUMNS
+    order: one record batch / row group per chunk, emitted as soon as it is
+    written.
+    """
+
+    def __init__(self, fmt: str = "arrow"):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.schema = pa.schema([
+            ("op", pa.string()),
+            ("a", pa.float64()),
+            ("b", pa.float64()),
+            ("expression", pa.string()),
+            ("result", pa.float64()),
+            ("created_at", pa.timestamp("us", tz="UTC")),
+        ])
+        self._sink = _ChunkSink()
+        if fmt == "parquet":
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(self._sink, self.schema)
+        elif fmt == "arrow":
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+        else:
+            raise ValueError(f"Unsupported export format: {fmt}")
+
+    def start(self) -> bytes:
+        return self._sink.drain()
+
+    def encode(self, rows: list[tuple]) -> bytes:
+        pa = self._pa
+        columns = list(zip(*rows)) if rows else [()] * len(self.schema)
+        batch = pa.record_batch(
+            [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema,
+        )
+        self._writer.write_batch(batch)
+        return self._sink.drain()
+
+    def finish(self) -> bytes:
+        self._writer.close()
+        return self._sink.drain()
+
+
+def encode_stream(chunks: Iterable[list[tuple]], encoder) -> Iterator[bytes]:
+    yield encoder.start()
+    for rows in chunks:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    yield encoder.finish()
+
+
+async def aencode_stream(chunks: AsyncIterable[list[tuple]], encoder) -> AsyncIterator[bytes]:
+    yield encoder.start()
+    async for rows in chunks:
+        data = encoder.encode(rows)
+        if data:
+            yield data
+    yield encoder.finish()
@@ -0,0 +1,361 @@
+import ast
+import math
+import operator as op
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Mapping
+
+from app.core.config import settings
+
+# NumPy is only imported by the array evaluator (batches and sweeps); scalar
+# evaluation never needs it.
+if TYPE_CHECKING:
+    import numpy as np
+
+
+_BINOPS = {
+    ast.Add: op.add,
+    ast.Sub: op.sub,
+    ast.Mult: op.mul,
+    ast.Div: op.truediv,
+    ast.Mod: op.mod,
+    ast.Pow: op.pow,
+}
+
+# Left-associative operators of equal precedence, which chain without nesting
+_ADDITIVE = (ast.Add, ast.Sub)
+_MULTIPLICATIVE = (ast.Mult, ast.Div, ast.Mod)
+_CHAINS = {kind: group for group in (_ADDITIVE, _MULTIPLICATIVE) for kind in group}
+
+_UNARYOPS = {
+    ast.UAdd: op.pos,
+    ast.USub: op.neg,
+}
+
+# NumPy ufunc names
+_ARRAY_BINOPS = {
+    ast.Add: "add",
+    ast.Sub: "subtract",
+    ast.Mult: "multiply",
+    ast.Div: "true_divide",
+    ast.Mod: "mod",
+    ast.Pow: "power",
+}
+
+# Per-row error codes reported by CompiledExpression.evaluate_array
+OK = 0
+DIVISION_BY_ZERO = 1
+INPUTS_TOO_LARGE = 2
+OVERFLOW = 3
+NOT_A_NUMBER = 4
+
+ERROR_CODES = {
+    DIVISION_BY_ZERO: "division_by_zero",
+    INPUTS_TOO_LARGE: "inputs_too_large",
+    OVERFLOW: "overflow",
+    NOT_A_NUMBER: "not_a_number",
+}
+
+Env = Mapping[str, float]
+ArrayEnv = Mapping[str, "np.ndarray"]
+
+# Instruction kinds of a compiled (postfix) program
+_CONST = 0
+_VAR = 1
+_UNARY = 2
+_BINARY = 3
+
+
+class ExpressionTooComplex(ValueError):
+    """The expression exceeds one of the EXPRESSION_MAX_* budgets."""
+
+
+def normalize_expression(expression: str) -> str:
+    """Canonical text used both for parsing and as the cache key."""
+    if expression is None:
+        raise ValueError("Expression is required")
+
+    expr = expression.strip()
+    if not expr:
+        raise ValueError("Expression is required")
+    if len(expr) > settings.expression_max_length:
+        raise ExpressionTooComplex(
+            f"Expression too long: {len(expr)} characters (max {settings.expression_max_length})"
+        )
+
+    # Support caret power used in many calculators
+    return expr.replace("^", "**")
+
+
+class CompiledExpression:
+    """
+    A validated expression compiled into a postfix program of
+    (kind, argument) instructions.
+
+    Both `evaluate` (scalars) and `evaluate_array` (NumPy columns) run the
+    program with an explicit value stack, so evaluation never recurses and
+    its cost is linear in the (budgeted) program length.
+    """
+
+    __slots__ = ("source", "variables", "_program", "max_magnitude")
+
+    def __init__(self, source: str, variables: tuple[str, ...], program: list, max_magnitude: float):
+        self.source = source
+        self.variables = variables
+        self._program = program
+        self.max_magnitude = max_magnitude
+
+    def _check_variables(self, names) -> None:
+        for name in self.variables:
+            if name not in names:
+                raise ValueError(f"Missing value for variable: {name}")
+
+    def evaluate(self, variables: Env | None = None) -> float:
+        env = variables or {}
+        self._check_variables(env)
+        limit = self.max_magnitude
+        stack: list[float] = []
+        push = stack.append
+        pop = stack.pop
+
+        for kind, arg in self._program:
+            if kind == _CONST:
+                # Checked against the limit when compiled
+                push(arg)
+            elif kind == _VAR:
+                push(_within(float(env[arg]), limit, "Variable value out of range"))
+            elif kind == _UNARY:
+                push(_within(float(arg(pop())), limit, "Result too large"))
+            else:
+                rv = pop()
+                push(_within(_scalar_binop(arg, pop(), rv), limit, "Result too large"))
+        return stack[0]
+
+    def evaluate_array(self, columns: ArrayEnv) -> "tuple[np.ndarray, np.ndarray]":
+        """
+        Evaluate over broadcastable float64 columns without raising.
+
+        Returns (values, errors): errors holds one of the ERROR_CODES per row
+        (0 when the row is fine) and values is NaN wherever errors is set.
+        """
+        import numpy as np
+
+        self._check_variables(columns)
+        shape = np.broadcast_shapes(*(np.shape(columns[name]) for name in self.variables))
+        limit = self.max_magnitude
+        stack: list = []
+        push = stack.append
+        pop = stack.pop
+
+        with np.errstate(all="ignore"):
+            for kind, arg in self._program:
+                if kind == _CONST:
+                    push((arg, OK))
+                elif kind == _VAR:
+                    push((np.asarray(columns[arg], dtype=np.float64), OK))
+                elif kind == _UNARY:
+                    values, errors = pop()
+                    push((arg(values), errors))
+                else:
+                    right = pop()
+                    values, errors = _array_binop(arg, pop(), right)
+                    push((values, _flag(errors, np.abs(values) > limit, OVERFLOW)))
+            values, errors = stack[0]
+
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), shape)
+        errors = np.broadcast_to(np.asarray(errors, dtype=np.uint8), shape)
+
+        errors = _flag(errors, np.isinf(values), OVERFLOW)
+        errors = _flag(errors, np.isnan(values), NOT_A_NUMBER)
+        values = np.where(errors == OK, values, np.nan)
+        return values, np.asarray(errors, dtype=np.uint8)
+
+
+def _within(value: float, limit: float, message: str) -> float:
+    """`value` if finite and at most `limit` in magnitude (NaN fails both), else ValueError."""
+    if not math.isfinite(value) or abs(value) > limit:
+        raise ValueError(message)
+    return value
+
+
+def _flag(errors, mask, code: int):
+    """Set `code` on rows matching mask that do not already carry an error."""
+    import numpy as np
+
+    return np.where((errors == OK) & mask, np.uint8(code), errors)
+
+
+def _scalar_binop(node_op: type, lv: float, rv: float) -> float:
+    fn = _BINOPS[node_op]
+
+    if node_op in (ast.Div, ast.Mod):
+        if rv == 0:
+            raise ZeroDivisionError("Division by zero")
+        return float(fn(lv, rv))
+
+    if node_op is ast.Pow:
+        # small guardrails for huge exponent
+        if abs(lv) > 1e6 or abs(rv) > 1e3:
+            raise ValueError("Inputs too large for exponentiation")
+        try:
+            value = fn(lv, rv)
+        except OverflowError:
+            raise ValueError("Result too large")
+        if isinstance(value, complex):
+            raise ValueError("Result is not a real number")
+        return float(value)
+
+    return float(fn(lv, rv))
+
+
+def _array_binop(node_op: type, left, right):
+    import numpy as np
+
+    lv, le = left
+    rv, re = right
+    errors = np.where(le != OK, le, re)
+
+    if node_op in (ast.Div, ast.Mod):
+        errors = _flag(errors, rv == 0, DIVISION_BY_ZERO)
+    elif node_op is ast.Pow:
+        errors = _flag(errors, (np.abs(lv) > 1e6) | (np.abs(rv) > 1e3), INPUTS_TOO_LARGE)
+
+    return getattr(np, _ARRAY_BINOPS[node_op])(lv, rv), errors
+
+
+def _paren_depth(expr: str) -> int:
+    depth = deepest = 0
+    for ch in expr:
+        if ch == "(":
+            depth += 1
+            deepest = max(deepest, depth)
+        elif ch == ")":
+            depth -= 1
+    return deepest
+
+
+def _compile(expr: str) -> CompiledExpression:
+    """
+    Parse, validate against the node and depth budgets and flatten to a
+    postfix program, all with an explicit work list instead of recursion.
+    """
+    max_nodes = settings.expression_max_nodes
+    max_depth = settings.expression_max_depth
+    max_magnitude = settings.expression_max_magnitude
+
+    # Checked up front so the (recursive) parser never sees deep nesting
+    if _paren_depth(expr) > max_depth:
+        raise ExpressionTooComplex(f"Expression nested too deeply (max depth {max_depth})")
+    try:
+        tree = ast.parse(expr, mode="eval")
+    except SyntaxError:
+        raise ValueError("Invalid expression syntax")
+    except (RecursionError, MemoryError):
+        raise ExpressionTooComplex(f"Expression nested too deeply (max depth {max_depth})")
+
+    program: list = []
+    names: dict[str, None] = {}
+    nodes = 0
+    todo = [(tree.body, 1, False)]
+    while todo:
+        n, depth, operands_done = todo.pop()
+        if operands_done:
+            if isinstance(n, ast.UnaryOp):
+                program.append((_UNARY, _UNARYOPS[type(n.op)]))
+            else:
+                program.append((_BINARY, type(n.op)))
+            continue
+
+        nodes += 1
+        if nodes > max_nodes:
+            raise ExpressionTooComplex(f"Expression too complex: more than {max_nodes} nodes")
+        if depth > max_depth:
+            raise ExpressionTooComplex(f"Expression nested too deeply (max depth {max_depth})")
+
+        if isinstance(n, ast.Constant) and isinstance(n.value, (int, float)):
+            # Literals like 1e400 parse to inf and huge integers overflow float()
+            try:
+                value = _within(float(n.value), max_magnitude, "Number too large")
+            except OverflowError:
+                raise ValueError("Number too large")
+            program.append((_CONST, value))
+        elif isinstance(n, ast.Name) and isinstance(n.ctx, ast.Load):
+            names.setdefault(n.id, None)
+            program.append((_VAR, n.id))
+        elif isinstance(n, ast.UnaryOp) and type(n.op) in _UNARYOPS:
+            todo.append((n, depth, True))
+            todo.append((n.operand, depth + 1, False))
+        elif isinstance(n, ast.BinOp) and type(n.op) in _BINOPS:
+            # A flat chain like 1+2-3+... parses as a left spine of same-precedence
+            # BinOps; that is not nesting, so the spine stays at this depth
+            # (its length is bounded by the node budget instead)
+            group = _CHAINS.get(type(n.op))
+            chained = group is not None and isinstance(n.left, ast.BinOp) and type(n.left.op) in group
+            # Right is pushed first so the left operand is emitted first
+            todo.append((n, depth, True))
+            todo.append((n.right, depth + 1, False))
+            todo.append((n.left, depth if chained else depth + 1, False))
+        else:
+            raise ValueError("Unsupported expression content")
+
+    return CompiledExpression(expr, tuple(names), program, max_magnitude)
+
+
+class ExpressionCache:
+    """Thread-safe bounded LRU of compiled expressions keyed by normalized text."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[str, CompiledExpression]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, expression: str) -> CompiledExpression:
+        key = normalize_expression(expression)
+
+        with self._lock:
+            compiled = self._entries.get(key)
+            if compiled is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        # Compile outside the lock; invalid expressions raise and are not cached.
+        compiled = _compile(key)
+        if self.maxsize <= 0:
+            return compiled
+
+        with self._lock:
+            self._entries[key] = compiled
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return compiled
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+expression_cache = ExpressionCache(maxsize=settings.expression_cache_size)
+
+
+def compile_expression(expression: str) -> CompiledExpression:
+    return expression_cache.get(expression)
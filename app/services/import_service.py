@@ -0,0 +1,151 @@
+"""
+Bulk import of calculation history from CSV, in the layout export_history_csv
+writes (operation, a, b, expression, result), optionally with a created_at
+column (ISO 8601, UTC when it has no offset).
+
+Rows are read, validated and evaluated `chunk_rows` at a time: operation rows
+go through calculate_batch, expression rows through evaluate_expression, and
+the file's result column is ignored in favour of the recomputed value. Each
+chunk is saved with insert_calculation_rows (one executemany, aggregates and
+rollups included) and committed, so memory stays flat whatever the file
+size, and a failure part-way keeps the chunks already committed.
+"""
+import csv
+import math
+from datetime import datetime, timezone
+from typing import Iterable, Iterator
+
+from sqlalchemy.orm import Session
+
+from app.models.calculation import Calculation
+from app.services.calc_service import insert_calculation_rows
+from app.services.calculator import calculate_batch, evaluate_expression
+
+REQUIRED_COLUMNS = ("operation", "a", "b", "expression")
+# Longer expressions would fail their whole chunk's insert (Postgres) or
+# silently exceed the column (SQLite), so they are rejected per row
+_EXPRESSION_LENGTH = Calculation.__table__.c.expression.type.length
+
+
+class ImportFormatError(ValueError):
+    """The file is not a calculation history CSV (missing or empty header)."""
+
+
+def open_import(lines: Iterable[str]):
+    """Read and check the header; returns (reader, column index) for iter_import."""
+    reader = csv.reader(lines)
+    try:
+        header = next(reader, None)
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise ImportFormatError(f"Unreadable CSV header: {e}") from e
+    if not header:
+        raise ImportFormatError("The file is empty")
+    index = {name.strip().lower(): i for i, name in enumerate(header)}
+    missing = [name for name in REQUIRED_COLUMNS if name not in index]
+    if missing:
+        raise ImportFormatError(f"Missing column(s): {', '.join(missing)}")
+    return reader, index
+
+
+def _parse_time(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    return parsed.replace(tzinfo=timezone.utc) if parsed.tzinfo is None else parsed.astimezone(timezone.utc)
+
+
+def _prepare_chunk(
+    user_id: int, chunk: list[tuple[int, list[str]]], index: dict[str, int]
+) -> tuple[list[dict], list[tuple[int, str]]]:
+    """Evaluate one chunk into insertable rows (file order) and (line, error) pairs."""
+    now = datetime.now(timezone.utc)
+    prepared: list[tuple[int, dict]] = []
+    errors: list[tuple[int, str]] = []
+    batch: list[int] = []
+
+    for line, fields in chunk:
+        def field(name: str) -> str:
+            i = index.get(name)
+            return fields[i].strip() if i is not None and i < len(fields) else ""
+
+        try:
+            created_at = _parse_time(field("created_at")) if field("created_at") else now
+            expression = field("expression")
+            if expression:
+                if len(expression) > _EXPRESSION_LENGTH:
+                    raise ValueError(f"Expression longer than {_EXPRESSION_LENGTH} characters")
+                result = evaluate_expression(expression)
+                if not math.isfinite(result):
+                    raise ValueError("Result is not a finite number")
+                row = {"op": None, "a": None, "b": None, "expression": expression, "result": result}
+            else:
+                a, b = float(field("a")), float(field("b"))
+                if not (math.isfinite(a) and math.isfinite(b)):
+                    raise ValueError("a and b must be finite numbers")
+                row = {"op": field("operation").lower(), "a": a, "b": b, "expression": None, "result": None}
+                batch.append(len(prepared))
+        except (ValueError, ZeroDivisionError, OverflowError) as e:
+            errors.append((line, str(e)))
+            continue
+        prepared.append((line, {"user_id": user_id, "created_at": created_at, **row}))
+
+    if batch:
+        results, batch_errors = calculate_batch(
+            [prepared[i][1]["op"] for i in batch],
+            [prepared[i][1]["a"] for i in batch],
+            [prepared[i][1]["b"] for i in batch],
+        )
+        for i, result, error in zip(batch, results.tolist(), batch_errors):
+            if error is None:
+                prepared[i][1]["result"] = result
+            else:
+                errors.append((prepared[i][0], error))
+
+    errors.sort()
+    return [row for _, row in prepared if row["result"] is not None], errors
+
+
+def iter_import(
+    db: Session,
+    user_id: int,
+    reader,
+    index: dict[str, int],
+    chunk_rows: int = 5000,
+    max_errors: int = 1000,
+) -> Iterator[dict]:
+    """
+    Import the rows behind `reader` (from open_import), yielding events:
+    {"event": "error", "line", "error"} per rejected row (the first
+    `max_errors` of them), {"event": "progress", ...} after each committed
+    chunk, then {"event": "done", ...} or {"event": "failed", "error", ...}.
+    """
+    totals = {"rows": 0, "imported": 0, "failed": 0}
+    reported = 0
+
+    def flush(chunk):
+        nonlocal reported
+        rows, errors = _prepare_chunk(user_id, chunk, index)
+        if rows:
+            insert_calculation_rows(db, rows)
+            db.commit()
+        totals["rows"] += len(chunk)
+        totals["imported"] += len(rows)
+        totals["failed"] += len(errors)
+        for line, error in errors[:max(0, max_errors - reported)]:
+            yield {"event": "error", "line": line, "error": error}
+        reported = min(max_errors, reported + len(errors))
+        yield {"event": "progress", **totals}
+
+    chunk: list[tuple[int, list[str]]] = []
+    try:
+        for fields in reader:
+            if not any(value.strip() for value in fields):
+                continue
+            chunk.append((reader.line_num, fields))
+            if len(chunk) >= chunk_rows:
+                yield from flush(chunk)
+                chunk = []
+        if chunk:
+            yield from flush(chunk)
+    except (csv.Error, UnicodeDecodeError) as e:
+        yield {"event": "failed", "error": f"Unreadable CSV near line {reader.line_num}: {e}", **totals}
+        return
+    yield {"event": "done", **totals, "errors_reported": reported}
@@ -0,0 +1,184 @@
+"""
+History retention: calculations older than RETENTION_DAYS move to
+calculations_archive, oldest id first, in batches of RETENTION_BATCH_ROWS.
+
+Each batch is one short transaction (copy, raise the owners' archive
+horizon, delete), followed by a pause, so writers are never locked out for
+long. Aggregates and rollups are untouched: archiving moves rows, it does
+not change anyone's history.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.calculation import Calculation
+from app.models.calculation_archive import ArchivedCalculation
+from app.models.user_stats import UserStats
+
+logger = logging.getLogger(__name__)
+
+_COLUMNS = [column.name for column in ArchivedCalculation.__table__.columns]
+
+
+def archive_batch(db: Session, cutoff: datetime, batch_rows: int) -> int:
+    """Move up to `batch_rows` rows created before `cutoff` and commit; returns how many moved."""
+    rows = db.execute(
+        select(Calculation.id, Calculation.user_id, Calculation.created_at)
+        .where(Calculation.created_at < cutoff)
+        .order_by(Calculation.id)
+        .limit(batch_rows)
+    ).all()
+    if not rows:
+        return 0
+    ids = [row.id for row in rows]
+    live = Calculation.__table__
+    db.execute(
+        insert(ArchivedCalculation).from_select(
+            _COLUMNS, select(*(live.c[name] for name in _COLUMNS)).where(live.c.id.in_(ids))
+        )
+    )
+
+    horizons: dict[int, datetime] = {}
+    for row in rows:
+        if row.user_id not in horizons or row.created_at > horizons[row.user_id]:
+            horizons[row.user_id] = row.created_at
+    # Users without a stats row get their horizon when it is rebuilt
+    stats = UserStats.__table__
+    db.execute(
+        update(stats)
+        .where(
+            stats.c.user_id == bindparam("owner"),
+            or_(stats.c.archived_through.is_(None), stats.c.archived_through < bindparam("newest")),
+        )
+        .values(archived_through=bindparam("newest")),
+        [{"owner": owner, "newest": newest} for owner, newest in horizons.items()],
+    )
+
+    db.execute(delete(Calculation).where(Calculation.id.in_(ids)))
+    db.commit()
+    return len(ids)
+
+
+def archive_older_than(
+    db: Session,
+    cutoff: datetime,
+    batch_rows: int = 1000,
+    pause: float = 0.05,
+    stop: threading.Event | None = None,
+    progress=None,
+) -> int:
+    """Archive batch after batch until nothing before `cutoff` is left (or `stop` is set)."""
+    moved = 0
+    while stop is None or not stop.is_set():
+        try:
+            n = archive_batch(db, cutoff, batch_rows)
+        except IntegrityError:
+            # Another worker archived (some of) the same rows first
+            db.rollback()
+            logger.warning("retention batch conflicted with a concurrent run; stopping this run")
+            break
+        moved += n
+        if progress is not None and n:
+            progress(moved)
+        if n < batch_rows:
+            break
+        if stop is not None:
+            stop.wait(pause)
+        else:
+            time.sleep(pause)
+    return moved
+
+
+def count_archivable(db: Session, cutoff: datetime) -> int:
+    return db.execute(select(func.count(Calculation.id)).where(Calculation.created_at < cutoff)).scalar_one()
+
+
+class RetentionJob:
+    """Background thread running archive_older_than every `interval` seconds, starting at once."""
+
+    def __init__(
+        self,
+        session_factory,
+        max_age: timedelta,
+        interval: float = 3600.0,
+        batch_rows: int = 1000,
+        pause: float = 0.05,
+    ):
+        self.session_factory = session_factory
+        self.max_age = max_age
+        self.interval = interval
+        self.batch_rows = batch_rows
+        self.pause = pause
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._stats_lock = threading.Lock()
+        self.runs = 0
+        self.rows_archived = 0
+        self.failures = 0
+        self.last_run_at: datetime | None = None
+        self.last_run_seconds = 0.0
+
+    def start(self) -> "RetentionJob":
+        self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Finish the current batch and join the thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_once(self) -> int:
+        started = time.perf_counter()
+        cutoff = datetime.now(timezone.utc) - self.max_age
+        db = self.session_factory()
+        try:
+            moved = archive_older_than(db, cutoff, self.batch_rows, self.pause, stop=self._stop)
+        finally:
+            db.close()
+        with self._stats_lock:
+            self.runs += 1
+            self.rows_archived += moved
+            self.last_run_at = datetime.now(timezone.utc)
+            self.last_run_seconds = time.perf_counter() - started
+        return moved
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                moved = self.run_once()
+                if moved:
+                    logger.info("retention archived %d calculations older than %s", moved, self.max_age)
+            except Exception:
+                logger.exception("retention run failed")
+                with self._stats_lock:
+                    self.failures += 1
+            self._stop.wait(self.interval)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "max_age_days": self.max_age / timedelta(days=1),
+                "runs": self.runs,
+                "rows_archived": self.rows_archived,
+                "failures": self.failures,
+                "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+                "last_run_ms": 1000 * self.last_run_seconds,
+            }
+
+
+def create_retention_job(session_factory) -> RetentionJob:
+    return RetentionJob(
+        session_factory,
+        max_age=timedelta(days=settings.retention_days),
+        interval=settings.retention_interval_seconds,
+        batch_rows=settings.retention_batch_rows,
+        pause=settings.retention_batch_pause_ms / 1000,
+    )
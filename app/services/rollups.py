@@ -0,0 +1,314 @@
+"""
+Hourly and daily rollups of calculation history (the calc_rollups table).
+
+Writes fold new rows in with one upsert that adds to the counters, so
+concurrent writers never overwrite each other. Edits and deletes recompute
+the affected hour and day from `calculations`, since a minimum or maximum
+cannot be taken back out. Range reads only touch rollup rows, one per
+user x op x bucket, however many calculations those buckets hold.
+"""
+from bisect import bisect_right
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import case, delete, func, insert, literal, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models.calc_rollup import CalcRollup
+from app.models.calculation import Calculation
+from app.models.calculation_archive import ArchivedCalculation
+
+GRAINS = {"hour": timedelta(hours=1), "day": timedelta(days=1)}
+# Range served when a request gives no start: two days of hours, a month of days
+DEFAULT_BUCKETS = {"hour": 48, "day": 30}
+# Upper edges of the result distribution bands; the last band is open-ended
+RESULT_BANDS = (-1000.0, -1.0, 0.0, 1.0, 10.0, 100.0, 1000.0)
+BAND_COLUMNS = tuple(f"band_{i}" for i in range(len(RESULT_BANDS) + 1))
+EXPRESSION_OP = "expression"
+
+# Keeps each upsert well under SQLite's bound-parameter limit
+_UPSERT_ROWS = 500
+
+
+def band_labels() -> list[str]:
+    edges = [f"{edge:g}" for edge in RESULT_BANDS]
+    return [f"<{edges[0]}"] + [f"[{lo},{hi})" for lo, hi in zip(edges, edges[1:])] + [f">={edges[-1]}"]
+
+
+def bucket_start(created_at: datetime, grain: str) -> datetime:
+    """Start of the hour or day holding `created_at`, as naive UTC."""
+    created_at = _naive_utc(created_at)
+    if grain == "hour":
+        return created_at.replace(minute=0, second=0, microsecond=0)
+    return created_at.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _naive_utc(value: datetime) -> datetime:
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _utc(value: datetime) -> datetime:
+    """Naive UTC -> aware, for comparisons against Calculation.created_at."""
+    return value.replace(tzinfo=timezone.utc)
+
+
+class _Agg:
+    __slots__ = ("count", "total", "low", "high", "bands")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.low = float("inf")
+        self.high = float("-inf")
+        self.bands = [0] * len(BAND_COLUMNS)
+
+    def add(self, result: float) -> None:
+        self.count += 1
+        self.total += result
+        self.low = min(self.low, result)
+        self.high = max(self.high, result)
+        self.bands[bisect_right(RESULT_BANDS, result)] += 1
+
+
+def aggregate(rows, grains=tuple(GRAINS)) -> dict[tuple[str, datetime, str], _Agg]:
+    """(op, result, created_at) rows -> one _Agg per (grain, bucket_start, op)."""
+    aggs: dict[tuple[str, datetime, str], _Agg] = {}
+    for op, result, created_at in rows:
+        op = op or EXPRESSION_OP
+        for grain in grains:
+            key = (grain, bucket_start(created_at, grain), op)
+            agg = aggs.get(key)
+            if agg is None:
+                agg = aggs[key] = _Agg()
+            agg.add(result)
+    return aggs
+
+
+def _dialect_insert(db: Session):
+    """The dialect's insert with ON CONFLICT support, or None where there is none."""
+    name = db.get_bind().dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert
+
+
+def _accumulate(new) -> dict:
+    """SET clause adding `new` (excluded row or literal values, by column name) to a rollup row."""
+    return {
+        "calc_count": CalcRollup.calc_count + new("calc_count"),
+        "result_sum": CalcRollup.result_sum + new("result_sum"),
+        "result_min": case((new("result_min") < CalcRollup.result_min, new("result_min")), else_=CalcRollup.result_min),
+        "result_max": case((new("result_max") > CalcRollup.result_max, new("result_max")), else_=CalcRollup.result_max),
+        **{column: getattr(CalcRollup, column) + new(column) for column in BAND_COLUMNS},
+    }
+
+
+def _upsert_generic(db: Session, values: list[dict]) -> None:
+    """Update-then-insert per row, for dialects without ON CONFLICT; a lost insert race retries the update."""
+    for row in values:
+        stmt = (
+            update(CalcRollup)
+            .where(
+                CalcRollup.user_id == row["user_id"],
+                CalcRollup.grain == row["grain"],
+                CalcRollup.bucket_start == row["bucket_start"],
+                CalcRollup.op == row["op"],
+            )
+            .values(_accumulate(lambda name: literal(row[name])))
+        )
+        if db.execute(stmt).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(CalcRollup).values(row))
+        except IntegrityError:
+            db.execute(stmt)
+
+
+def upsert_rollups(db: Session, user_id: int, aggs: dict[tuple[str, datetime, str], _Agg]) -> None:
+    """Add `aggs` to the user's rollup rows, creating the missing ones (caller commits)."""
+    if not aggs:
+        return
+    values = [
+        {
+            "user_id": user_id,
+            "grain": grain,
+            "bucket_start": start,
+            "op": op,
+            "calc_count": agg.count,
+            "result_sum": agg.total,
+            "result_min": agg.low,
+            "result_max": agg.high,
+            **dict(zip(BAND_COLUMNS, agg.bands)),
+        }
+        for (grain, start, op), agg in aggs.items()
+    ]
+    upsert = _dialect_insert(db)
+    if upsert is None:
+        _upsert_generic(db, values)
+        return
+    for offset in range(0, len(values), _UPSERT_ROWS):
+        stmt = upsert(CalcRollup).values(values[offset:offset + _UPSERT_ROWS])
+        new = stmt.excluded
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[CalcRollup.user_id, CalcRollup.grain, CalcRollup.bucket_start, CalcRollup.op],
+            set_=_accumulate(lambda name: getattr(new, name)),
+        )
+        db.execute(stmt)
+
+
+def record_rollups(db: Session, user_id: int, written: list[dict]) -> None:
+    """Fold freshly inserted rows (dicts with op, result, created_at) into the rollups."""
+    upsert_rollups(db, user_id, aggregate((w["op"], w["result"], w["created_at"]) for w in written))
+
+
+def recompute_buckets(db: Session, user_id: int, created_at: datetime) -> None:
+    """Rebuild the hour and day holding `created_at` from history, after an edit or delete."""
+    for grain, span in GRAINS.items():
+        start = bucket_start(created_at, grain)
+        db.execute(
+            delete(CalcRollup).where(
+                CalcRollup.user_id == user_id, CalcRollup.grain == grain, CalcRollup.bucket_start == start
+            )
+        )
+        rows = []
+        for model in (Calculation, ArchivedCalculation):
+            rows += db.execute(
+                select(model.op, model.result, model.created_at).where(
+                    model.user_id == user_id,
+                    model.created_at >= _utc(start),
+                    model.created_at < _utc(start + span),
+                )
+            ).all()
+        upsert_rollups(db, user_id, aggregate(rows, grains=(grain,)))
+
+
+def rebuild_rollups(db: Session, user_id: int | None = None, chunk_rows: int = 50_000, progress=None) -> int:
+    """
+    Backfill: drop the rollups (of every user, or one) and rebuild them from
+    `calculations` and the archive, reading `chunk_rows` rows per query in
+    id order and committing after each chunk. Rows written after the rollups
+    were dropped are left to the normal write path; rows the retention job
+    moves while this runs can be counted twice or missed, so pause it first.
+    Returns the rows folded in.
+    """
+    cleared = delete(CalcRollup)
+    if user_id is not None:
+        cleared = cleared.where(CalcRollup.user_id == user_id)
+    db.execute(cleared)
+    # Read after the delete, in the same transaction, so every row either
+    # falls at or below these ids or was written (and rolled up) afterwards
+    last_ids = {}
+    for model in (Calculation, ArchivedCalculation):
+        newest = select(func.max(model.id))
+        if user_id is not None:
+            newest = newest.where(model.user_id == user_id)
+        last_ids[model] = db.execute(newest).scalar() or 0
+    db.commit()
+
+    done = 0
+    for model, last_id in last_ids.items():
+        after = 0
+        while after < last_id:
+            stmt = (
+                select(model.id, model.user_id, model.op, model.result, model.created_at)
+                .where(model.id > after, model.id <= last_id)
+                .order_by(model.id)
+                .limit(chunk_rows)
+            )
+            if user_id is not None:
+                stmt = stmt.where(model.user_id == user_id)
+            rows = db.execute(stmt).all()
+            if not rows:
+                break
+            by_user: dict[int, list[tuple]] = {}
+            for row in rows:
+                by_user.setdefault(row.user_id, []).append((row.op, row.result, row.created_at))
+            for owner, owned in by_user.items():
+                upsert_rollups(db, owner, aggregate(owned))
+            db.commit()
+            after = rows[-1].id
+            done += len(rows)
+            if progress is not None:
+                progress(done)
+    return done
+
+
+def align_range(grain: str, start: datetime | None, end: datetime | None, max_buckets: int) -> tuple[datetime, datetime]:
+    """
+    Widen [start, end) to whole buckets as naive UTC. `end` defaults to the
+    end of the current bucket, `start` to DEFAULT_BUCKETS[grain] before it.
+    Naive inputs are taken as UTC. Raises ValueError for empty or oversized ranges.
+    """
+    span = GRAINS[grain]
+    if end is None:
+        end = datetime.now(timezone.utc)
+    aligned_end = bucket_start(end, grain)
+    if aligned_end < _naive_utc(end):
+        aligned_end += span
+    aligned_start = bucket_start(start, grain) if start is not None else aligned_end - DEFAULT_BUCKETS[grain] * span
+    if aligned_start >= aligned_end:
+        raise ValueError("start must be before end")
+    if (aligned_end - aligned_start) / span > max_buckets:
+        raise ValueError(f"Range spans more than {max_buckets} {grain} buckets")
+    return aligned_start, aligned_end
+
+
+def get_timeseries(
+    db: Session, user_id: int, grain: str, start: datetime, end: datetime, op: str | None = None
+) -> dict:
+    """
+    Buckets in [start, end) for one grain: a dense series (empty buckets
+    included), per-op totals and the result distribution over the range.
+    `start` and `end` must already be bucket-aligned naive UTC.
+    """
+    stmt = select(CalcRollup).where(
+        CalcRollup.user_id == user_id,
+        CalcRollup.grain == grain,
+        CalcRollup.bucket_start >= start,
+        CalcRollup.bucket_start < end,
+    )
+    if op is not None:
+        stmt = stmt.where(CalcRollup.op == op)
+
+    points: dict[datetime, dict] = {}
+    by_op: dict[str, dict] = {}
+    bands = [0] * len(BAND_COLUMNS)
+    for row in db.execute(stmt).scalars():
+        for totals, key in ((points, row.bucket_start), (by_op, row.op)):
+            entry = totals.get(key)
+            if entry is None:
+                entry = totals[key] = {"count": 0, "sum": 0.0, "min": row.result_min, "max": row.result_max}
+            entry["count"] += row.calc_count
+            entry["sum"] += row.result_sum
+            entry["min"] = min(entry["min"], row.result_min)
+            entry["max"] = max(entry["max"], row.result_max)
+        for i, column in enumerate(BAND_COLUMNS):
+            bands[i] += getattr(row, column)
+
+    def summary(entry: dict | None) -> dict:
+        if entry is None:
+            return {"count": 0, "sum": 0.0, "mean": None, "min": None, "max": None}
+        return {**entry, "mean": entry["sum"] / entry["count"]}
+
+    series = []
+    span = GRAINS[grain]
+    bucket = start
+    while bucket < end:
+        series.append({"bucket": _utc(bucket), **summary(points.get(bucket))})
+        bucket += span
+
+    return {
+        "grain": grain,
+        "start": _utc(start),
+        "end": _utc(end),
+        "series": series,
+        "by_op": [{"op": name, **summary(entry)} for name, entry in sorted(by_op.items())],
+        "distribution": dict(zip(band_labels(), bands)),
+    }
@@ -0,0 +1,139 @@
+import json
+import math
+from typing import Iterator, Mapping, Sequence
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.expression_engine import ERROR_CODES, compile_expression
+
+# Binary sweep output: one packed record per row.
+SWEEP_DTYPE = np.dtype([("result", "<f8"), ("error", "u1")])
+
+
+class ListColumn:
+    def __init__(self, values: Sequence[float]):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.length = len(self.values)
+
+    def take(self, idx: np.ndarray) -> np.ndarray:
+        return self.values[idx]
+
+
+class RangeColumn:
+    """Evenly spaced values generated on demand, never materialized in full."""
+
+    def __init__(self, start: float, step: float, length: int):
+        self.start = start
+        self.step = step
+        self.length = length
+
+    def take(self, idx: np.ndarray) -> np.ndarray:
+        return self.start + idx * self.step
+
+
+def build_column(spec) -> ListColumn | RangeColumn:
+    """A variable is either a list of values or {start, stop, step} / {start, stop, num}."""
+    if not isinstance(spec, Mapping):
+        if len(spec) == 0:
+            raise ValueError("Variable columns must not be empty")
+        return ListColumn(spec)
+
+    start = float(spec["start"])
+    stop = float(spec["stop"])
+    if spec.get("num") is not None:
+        num = int(spec["num"])
+        if num < 1:
+            raise ValueError("Range num must be at least 1")
+        step = (stop - start) / (num - 1) if num > 1 else 0.0
+        return RangeColumn(start, step, num)
+
+    step = float(spec.get("step") or 0)
+    if step == 0 or (stop - start) / step < 0:
+        raise ValueError("Range step must be non-zero and move from start towards stop")
+    return RangeColumn(start, step, max(1, math.ceil((stop - start) / step)))
+
+
+class SweepPlan:
+    """
+    An expression bound to variable columns.
+
+    In "zip" mode the columns are aligned row by row (length-1 columns
+    broadcast); in "grid" mode every combination of values is evaluated.
+    """
+
+    def __init__(self, expression: str, variables: Mapping[str, object], mode: str = "zip"):
+        self.compiled = compile_expression(expression)
+
+        unknown = sorted(set(variables) - set(self.compiled.variables))
+        if unknown:
+            raise ValueError(f"Unknown variable: {unknown[0]}")
+        missing = [name for name in self.compiled.variables if name not in variables]
+        if missing:
+            raise ValueError(f"Missing value for variable: {missing[0]}")
+
+        self.names = self.compiled.variables
+        self.columns = {name: build_column(variables[name]) for name in self.names}
+        self.mode = mode
+
+        lengths = [self.columns[name].length for name in self.names]
+        if mode == "grid":
+            self.shape = tuple(lengths)
+            self.rows = math.prod(lengths)
+        elif mode == "zip":
+            self.rows = max(lengths, default=1)
+            if any(length not in (1, self.rows) for length in lengths):
+                raise ValueError("Variable columns must have the same length (or length 1)")
+        else:
+            raise ValueError(f"Unsupported sweep mode: {mode}")
+
+        if self.rows > settings.sweep_max_rows:
+            raise ValueError(f"Sweep too large: {self.rows} rows (max {settings.sweep_max_rows})")
+
+    def _chunk_columns(self, start: int, stop: int) -> dict[str, np.ndarray]:
+        idx = np.arange(start, stop)
+        if self.mode == "grid":
+            positions = np.unravel_index(idx, self.shape) if self.names else ()
+            return {name: self.columns[name].take(pos) for name, pos in zip(self.names, positions)}
+
+        out = {}
+        for name in self.names:
+            column = self.columns[name]
+            out[name] = column.take(idx) if column.length > 1 else column.take(np.zeros(1, dtype=np.intp))
+        return out
+
+    def chunks(self, chunk_rows: int | None = None) -> Iterator[tuple[int, np.ndarray, np.ndarray]]:
+        """Yields (offset, values, errors) for consecutive row ranges."""
+        chunk_rows = chunk_rows or settings.sweep_chunk_rows
+        for start in range(0, self.rows, chunk_rows):
+            stop = min(start + chunk_rows, self.rows)
+            values, errors = self.compiled.evaluate_array(self._chunk_columns(start, stop))
+            n = stop - start
+            yield start, np.broadcast_to(values, (n,)), np.broadcast_to(errors, (n,))
+
+
+def iter_sweep_ndjson(plan: SweepPlan) -> Iterator[bytes]:
+    """One header line, then one line per chunk with results (null on error) and error codes."""
+    header = {
+        "rows": plan.rows,
+        "variables": list(plan.names),
+        "mode": plan.mode,
+        "error_codes": ERROR_CODES,
+    }
+    yield (json.dumps(header) + "\n").encode()
+
+    for offset, values, errors in plan.chunks():
+        results = values.tolist()
+        for i in np.flatnonzero(errors).tolist():
+            results[i] = None
+        line = {"offset": offset, "result": results, "error": errors.tolist()}
+        yield (json.dumps(line) + "\n").encode()
+
+
+def iter_sweep_binary(plan: SweepPlan) -> Iterator[bytes]:
+    """Packed SWEEP_DTYPE records (little-endian float64 result + uint8 error code)."""
+    for _, values, errors in plan.chunks():
+        records = np.empty(len(values), dtype=SWEEP_DTYPE)
+        records["result"] = values
+        records["error"] = errors
+        yield records.tobytes()
@@ -0,0 +1,193 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app.core.config import settings
+from app.models.undo_entry import UndoEntry
+
+# Tries per database push/pop before a seq conflict is surfaced
+_ATTEMPTS = 5
+# Idle database sessions are looked for at most this often (seconds)
+_EXPIRY_INTERVAL = 3600.0
+
+
+class _Conflict(Exception):
+    pass
+
+
+class MemoryUndoStore:
+    """
+    Per-process undo/redo stacks, one pair per session key.
+
+    Each stack is a deque with maxlen=depth, so push/pop are O(1) and the
+    oldest entry falls off once a stack is full. Session keys are kept in
+    LRU order and the least recently used one is dropped past max_sessions.
+    History is lost on restart and not shared between workers; use
+    DatabaseUndoStore for that.
+    """
+
+    def __init__(self, depth: int = 50, max_sessions: int = 10000):
+        self.depth = depth
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._stacks: OrderedDict[str, tuple[deque, deque]] = OrderedDict()
+
+    def _get(self, key: str) -> tuple[deque, deque]:
+        stacks = self._stacks.get(key)
+        if stacks is None:
+            stacks = (deque(maxlen=self.depth), deque(maxlen=self.depth))
+            self._stacks[key] = stacks
+            while len(self._stacks) > self.max_sessions:
+                self._stacks.popitem(last=False)
+        else:
+            self._stacks.move_to_end(key)
+        return stacks
+
+    def push(self, key: str, payload: dict) -> None:
+        with self._lock:
+            undo, redo = self._get(key)
+            undo.append(payload)
+            redo.clear()
+
+    def undo(self, key: str) -> dict | None:
+        with self._lock:
+            undo, redo = self._get(key)
+            if not undo:
+                return None
+            payload = undo.pop()
+            redo.append(payload)
+            return payload
+
+    def redo(self, key: str) -> dict | None:
+        with self._lock:
+            undo, redo = self._get(key)
+            if not redo:
+                return None
+            payload = redo.pop()
+            undo.append(payload)
+            return payload
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._stacks), "depth": self.depth}
+
+
+class DatabaseUndoStore:
+    """
+    Undo/redo stacks in the undo_entries table, shared by every worker.
+
+    Entries carry a per-stack sequence number, unique per stack; the top of a
+    stack is the highest seq, found through the (owner, stack, seq) index,
+    and anything more than `depth` below the top is deleted on push.
+
+    Sessions are never closed explicitly, so a push at most once an hour
+    also deletes the stacks of every session idle for longer than `ttl`
+    seconds (judged by its newest entry).
+    """
+
+    def __init__(self, session_factory, depth: int = 50, ttl: float = 7 * 24 * 3600):
+        self.session_factory = session_factory
+        self.depth = depth
+        self.ttl = ttl
+        self._expiry_lock = threading.Lock()
+        self._next_expiry = 0.0
+
+    @staticmethod
+    def _top(db, key: str, stack: str) -> UndoEntry | None:
+        return db.execute(
+            select(UndoEntry)
+            .where(UndoEntry.owner == key, UndoEntry.stack == stack)
+            .order_by(UndoEntry.seq.desc())
+            .limit(1)
+        ).scalar_one_or_none()
+
+    def _append(self, db, key: str, stack: str, payload: dict) -> None:
+        # seq is computed inside the INSERT, so writers that serialize (SQLite)
+        # never collide; elsewhere the unique index rejects a duplicate
+        in_stack = (UndoEntry.owner == key, UndoEntry.stack == stack)
+        top = select(func.max(UndoEntry.seq)).where(*in_stack).scalar_subquery()
+        db.execute(
+            insert(UndoEntry).values(
+                owner=key, stack=stack, seq=func.coalesce(top, 0) + 1, payload=payload, written_at=time.time()
+            )
+        )
+        newest = db.execute(select(func.max(UndoEntry.seq)).where(*in_stack)).scalar_one()
+        db.execute(delete(UndoEntry).where(*in_stack, UndoEntry.seq <= newest - self.depth))
+
+    def _transaction(self, work):
+        """Run `work(db)` and commit, starting over when a concurrent request took the same seq."""
+        for attempt in range(_ATTEMPTS):
+            with self.session_factory() as db:
+                try:
+                    result = work(db)
+                    db.commit()
+                    return result
+                except (IntegrityError, _Conflict):
+                    db.rollback()
+                    if attempt == _ATTEMPTS - 1:
+                        raise
+
+    def push(self, key: str, payload: dict) -> None:
+        def work(db):
+            self._append(db, key, "undo", payload)
+            db.execute(delete(UndoEntry).where(UndoEntry.owner == key, UndoEntry.stack == "redo"))
+
+        self._transaction(work)
+        now = time.monotonic()
+        with self._expiry_lock:
+            due = now >= self._next_expiry
+            if due:
+                self._next_expiry = now + min(self.ttl, _EXPIRY_INTERVAL)
+        if due:
+            self.expire()
+
+    def expire(self, now: float | None = None) -> int:
+        """Delete the stacks of sessions idle for more than `ttl`; returns the entries removed."""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        idle = (
+            select(UndoEntry.owner)
+            .group_by(UndoEntry.owner)
+            .having(func.max(UndoEntry.written_at) < cutoff)
+        )
+        with self.session_factory() as db:
+            removed = db.execute(
+                delete(UndoEntry)
+                .where(UndoEntry.owner.in_(idle))
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            db.commit()
+        return removed
+
+    def _move(self, key: str, source: str, target: str) -> dict | None:
+        def work(db):
+            top = self._top(db, key, source)
+            if top is None:
+                return None
+            if db.execute(delete(UndoEntry).where(UndoEntry.id == top.id)).rowcount == 0:
+                raise _Conflict()  # popped by a concurrent request
+            self._append(db, key, target, top.payload)
+            return top.payload
+
+        return self._transaction(work)
+
+    def undo(self, key: str) -> dict | None:
+        return self._move(key, "undo", "redo")
+
+    def redo(self, key: str) -> dict | None:
+        return self._move(key, "redo", "undo")
+
+    def stats(self) -> dict:
+        with self.session_factory() as db:
+            sessions = db.execute(select(func.count(func.distinct(UndoEntry.owner)))).scalar_one()
+        return {"backend": "database", "sessions": sessions, "depth": self.depth, "ttl_seconds": self.ttl}
+
+
+def create_undo_store(session_factory):
+    if settings.undo_backend == "database":
+        return DatabaseUndoStore(session_factory, depth=settings.undo_depth, ttl=settings.undo_session_ttl_seconds)
+    if settings.undo_backend == "memory":
+        return MemoryUndoStore(depth=settings.undo_depth, max_sessions=settings.undo_max_sessions)
+    raise ValueError(f"Unsupported UNDO_BACKEND: {settings.undo_backend}")
@@ -1,8 +1,18 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import select
+from sqlalchemy import or_, select
 
 from app.models.user import User
-from app.core.security import hash_password, verify_password
+from app.models.user_stats import UserStats
+from app.core.security import (
+    hash_password,
+    hash_password_async,
+    verify_and_update_password,
+    verify_and_update_password_async,
+    verify_password,
+    verify_password_async,
+)
+from app.core.token_cache import token_cache
+from app.db.session import SessionRunner
 
 class UserAlreadyExists(Exception):
     pass
@@ -22,20 +32,45 @@ def get_user_by_email(db: Session, email: str) -> User | None:
 def get_user(db: Session, user_id: int) -> User | None:
     return db.get(User, user_id)
 
-def create_user(db: Session, username: str, email: str, password: str) -> User:
-    if get_user_by_username(db, username) or get_user_by_email(db, email):
+def _ensure_available(db: Session, username: str, email: str) -> None:
+    # One round-trip for both unique columns
+    taken = db.execute(
+        select(User.id).where(or_(User.username == username, User.email == email)).limit(1)
+    ).first()
+    if taken:
         raise UserAlreadyExists("Username or email already exists")
 
-    user = User(username=username, email=email, hashed_password=hash_password(password))
+def _insert_user(db: Session, username: str, email: str, hashed_password: str) -> User:
+    user = User(username=username, email=email, hashed_password=hashed_password)
     db.add(user)
+    db.flush()
+    # Created with the user so concurrent first calculations only ever update it
+    db.add(UserStats(user_id=user.id, calc_count=0, result_sum=0.0))
     db.commit()
     db.refresh(user)
     return user
 
+def _store_password_hash(db: Session, user: User, hashed_password: str) -> None:
+    user.hashed_password = hashed_password
+    db.add(user)
+    db.commit()
+    db.refresh(user)
+    token_cache.invalidate_user(user.id)
+
+def create_user(db: Session, username: str, email: str, password: str) -> User:
+    _ensure_available(db, username, email)
+    return _insert_user(db, username, email, hash_password(password))
+
 def authenticate(db: Session, username: str, password: str) -> User:
     user = get_user_by_username(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        raise InvalidCredentials("Invalid username or password")
+    ok, new_hash = verify_and_update_password(password, user.hashed_password)
+    if not ok:
         raise InvalidCredentials("Invalid username or password")
+    if new_hash:
+        # Stored with a different bcrypt cost than configured: upgrade in place
+        _store_password_hash(db, user, new_hash)
     return user
 
 def update_profile(db: Session, user: User, username: str, email: str) -> User:
@@ -50,11 +85,41 @@ def update_profile(db: Session, user: User, username: str, email: str) -> User:
     db.add(user)
     db.commit()
     db.refresh(user)
+    token_cache.invalidate_user(user.id)
     return user
 
+def update_profile_by_id(db: Session, user_id: int, username: str, email: str) -> User:
+    return update_profile(db, get_user(db, user_id), username=username, email=email)
+
 def change_password(db: Session, user: User, current_password: str, new_password: str) -> None:
     if not verify_password(current_password, user.hashed_password):
         raise PasswordChangeError("Current password is incorrect")
-    user.hashed_password = hash_password(new_password)
-    db.add(user)
-    db.commit()
+    _store_password_hash(db, user, hash_password(new_password))
+
+
+# Async variants for the request path. Database work goes through the
+# SessionRunner; bcrypt is awaited on the password pool, so neither holds a
+# thread or blocks the event loop.
+
+async def create_user_async(db: SessionRunner, username: str, email: str, password: str) -> User:
+    await db.run(_ensure_available, username, email)
+    hashed = await hash_password_async(password)
+    return await db.run(_insert_user, username, email, hashed)
+
+async def authenticate_async(db: SessionRunner, username: str, password: str) -> User:
+    user = await db.run(get_user_by_username, username)
+    if not user:
+        raise InvalidCredentials("Invalid username or password")
+    ok, new_hash = await verify_and_update_password_async(password, user.hashed_password)
+    if not ok:
+        raise InvalidCredentials("Invalid username or password")
+    if new_hash:
+        await db.run(_store_password_hash, user, new_hash)
+    return user
+
+async def change_password_async(db: SessionRunner, user_id: int, current_password: str, new_password: str) -> None:
+    user = await db.run(get_user, user_id)
+    if not await verify_password_async(current_password, user.hashed_password):
+        raise PasswordChangeError("Current password is incorrect")
+    hashed = await hash_password_async(new_password)
+    await db.run(_store_password_hash, user, hashed)
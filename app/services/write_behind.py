@@ -0,0 +1,154 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.core.config import settings
+from app.services.calc_service import insert_calculation_rows
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class WriteBehindFull(Exception):
+    """The in-process queue is at capacity (or shutting down)."""
+
+
+class WriteBehindQueue:
+    """
+    Group-commit queue for calculation inserts.
+
+    Requests enqueue prepared rows and get a Future; one background thread
+    writes them in batches with a single multi-row insert and commit, when
+    `batch_size` rows are waiting or `flush_interval` seconds after the first
+    one arrived. Queued rows live in process memory only: `stop()` drains the
+    queue on shutdown, but a crash loses whatever has not been flushed.
+    """
+
+    def __init__(self, session_factory, batch_size: int = 500, flush_interval: float = 0.05, max_queue: int = 10000):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.max_batch = 0
+        self.failures = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+
+    def start(self) -> "WriteBehindQueue":
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        return self
+
+    def submit(self, row: dict) -> Future:
+        """Queue one row; the Future resolves to (id, created_at) once committed."""
+        if self._closed:
+            raise WriteBehindFull("Write queue is shutting down")
+        future: Future = Future()
+        try:
+            self._queue.put_nowait((row, future))
+        except queue.Full:
+            raise WriteBehindFull("Write queue is full, please retry shortly")
+        return future
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Stop accepting rows, flush everything queued so far and join the flusher."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self._flush(batch)
+
+        # Rows that raced with stop() still get written
+        leftover = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._flush(leftover)
+
+    def _flush(self, batch: list[tuple[dict, Future]]) -> None:
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            inserted = insert_calculation_rows(db, [row for row, _ in batch])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.exception("write-behind flush of %d rows failed", len(batch))
+            with self._stats_lock:
+                self.failures += 1
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.batches += 1
+            self.rows += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            self.flush_seconds_total += elapsed
+            self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+        for (_, future), result in zip(batch, inserted):
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "queued": self._queue.qsize(),
+                "batches": self.batches,
+                "rows": self.rows,
+                "avg_batch_size": (self.rows / self.batches) if self.batches else 0.0,
+                "max_batch_size": self.max_batch,
+                "avg_flush_ms": (1000 * self.flush_seconds_total / self.batches) if self.batches else 0.0,
+                "max_flush_ms": 1000 * self.flush_seconds_max,
+                "failures": self.failures,
+            }
+
+
+def create_write_behind_queue(session_factory) -> WriteBehindQueue:
+    return WriteBehindQueue(
+        session_factory,
+        batch_size=settings.write_behind_batch_size,
+        flush_interval=settings.write_behind_flush_ms / 1000,
+        max_queue=settings.write_behind_max_queue,
+    )
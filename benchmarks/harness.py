@@ -0,0 +1,74 @@
+import gc
+import math
+import statistics
+import time
+import tracemalloc
+from typing import Callable
+
+
+def percentile(samples: list[float], q: float) -> float:
+    """Nearest-rank percentile of already collected samples (q in 0..100)."""
+    ordered = sorted(samples)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def run_case(fn: Callable[[], object], warmup: int = 5, repeat: int = 50) -> dict:
+    """
+    Time `fn` after `warmup` untimed calls, then trace one extra call for its
+    peak Python allocation (kept out of the timed runs, which tracemalloc
+    would slow down). Times are in milliseconds.
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter_ns()
+            fn()
+            samples.append((time.perf_counter_ns() - started) / 1e6)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "runs": repeat,
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": percentile(samples, 50),
+        "p99_ms": percentile(samples, 99),
+        "min_ms": min(samples),
+        "max_ms": max(samples),
+        "peak_kb": peak / 1024,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float = 0.2, metric: str = "p50_ms") -> list[dict]:
+    """
+    Cases whose `metric` grew by more than `threshold` (0.2 = 20%) over the
+    baseline. Cases missing from either side are ignored.
+    """
+    regressions = []
+    for name, current in results.get("cases", {}).items():
+        before = baseline.get("cases", {}).get(name)
+        if not before or before[metric] <= 0:
+            continue
+        ratio = current[metric] / before[metric]
+        if ratio > 1 + threshold:
+            regressions.append({
+                "case": name,
+                "metric": metric,
+                "baseline": before[metric],
+                "current": current[metric],
+                "ratio": ratio,
+            })
+    return regressions
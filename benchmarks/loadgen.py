@@ -0,0 +1,251 @@
+"""
+Load generator: simulated user sessions against the app, in process or over
+HTTP, with per-route throughput, error rate and latency histograms.
+
+    python -m benchmarks.loadgen --users 50 --duration 30
+    python -m benchmarks.loadgen --users 10,50,100,200 --duration 20      # find the knee
+    python -m benchmarks.loadgen --users 100 --rate 500 --duration 60     # open-loop, 500 req/s
+    python -m benchmarks.loadgen --url http://127.0.0.1:8000 --users 100  # a running uvicorn
+
+Every virtual user registers, logs in, then loops over a weighted mix of
+calculate / expression / history / stats / export requests until the stage
+ends. With --rate the whole stage is paced to that many requests per second
+(requests queue behind the schedule when the app falls behind, so latency
+includes that wait); without it each user fires as fast as responses return.
+
+In-process runs drive create_app() through httpx's ASGI transport against
+their own SQLite database (--database-url) with cheap bcrypt rounds, so
+results reflect the app and not the tool's network stack. Users that outrun
+their admission budget get 429s, which count as errors; pass --no-admission
+to measure the routes themselves.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+# Upper bounds (ms) of the latency histogram buckets; the last is open-ended
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+ACTIONS = {
+    "calculate": 40,
+    "expression": 20,
+    "history": 20,
+    "stats": 15,
+    "export": 5,
+}
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.statuses: dict[str, dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, route: str, started: float, status: int | None, ok: bool) -> None:
+        self.latencies[route].append(1000 * (time.perf_counter() - started))
+        if status is not None:
+            self.statuses[route][status] += 1
+        if not ok:
+            self.errors[route] += 1
+
+    def report(self, elapsed: float) -> dict:
+        from benchmarks.harness import percentile
+
+        routes = {}
+        for route, samples in sorted(self.latencies.items()):
+            histogram = [0] * (len(BUCKETS_MS) + 1)
+            for ms in samples:
+                histogram[next((i for i, bound in enumerate(BUCKETS_MS) if ms <= bound), len(BUCKETS_MS))] += 1
+            routes[route] = {
+                "requests": len(samples),
+                "rps": len(samples) / elapsed,
+                "error_rate": self.errors[route] / len(samples),
+                "p50_ms": percentile(samples, 50),
+                "p90_ms": percentile(samples, 90),
+                "p99_ms": percentile(samples, 99),
+                "max_ms": max(samples),
+                "statuses": dict(self.statuses[route]),
+                "histogram": {
+                    **{f"<={bound}ms": count for bound, count in zip(BUCKETS_MS, histogram)},
+                    f">{BUCKETS_MS[-1]}ms": histogram[-1],
+                },
+            }
+        total = sum(len(samples) for samples in self.latencies.values())
+        return {
+            "elapsed_s": elapsed,
+            "requests": total,
+            "rps": total / elapsed,
+            "error_rate": (sum(self.errors.values()) / total) if total else 0.0,
+            "routes": routes,
+        }
+
+
+class Pacer:
+    """Hands out evenly spaced start times for an open-loop target rate."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self._next = time.perf_counter()
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> float:
+        """Returns the scheduled start, which latency is measured from."""
+        if not self.interval:
+            return time.perf_counter()
+        async with self._lock:
+            scheduled = max(self._next, time.perf_counter() - 1.0)
+            self._next = scheduled + self.interval
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return scheduled
+
+
+async def _request(
+    client, recorder: Recorder, pacer: Pacer, route: str, method: str, url: str,
+    expect=(200,), location: str | None = None, **kwargs,
+):
+    started = await pacer.wait()
+    try:
+        response = await client.request(method, url, **kwargs)
+    except Exception:
+        recorder.record(route, started, None, ok=False)
+        return None
+    # Auth routes report failures as a redirect back to the form
+    ok = response.status_code in expect and (location is None or response.headers.get("location") == location)
+    recorder.record(route, started, response.status_code, ok)
+    return response
+
+
+async def user_session(client, recorder: Recorder, pacer: Pacer, deadline: float, rng: random.Random) -> None:
+    name = f"load_{uuid.uuid4().hex[:12]}"
+    password = "Password123!"
+    await _request(
+        client, recorder, pacer, "register", "POST", "/auth/register", expect=(303,), location="/login",
+        data={"username": name, "email": f"{name}@load.local", "password": password},
+    )
+    await _request(
+        client, recorder, pacer, "login", "POST", "/auth/login", expect=(303,), location="/dashboard",
+        data={"username": name, "password": password},
+    )
+
+    actions = list(ACTIONS)
+    weights = list(ACTIONS.values())
+    while time.perf_counter() < deadline:
+        action = rng.choices(actions, weights)[0]
+        if action == "calculate":
+            payload = {"op": rng.choice(("add", "sub", "mul", "div", "pow")), "a": rng.uniform(1, 100), "b": rng.uniform(1, 5)}
+            await _request(client, recorder, pacer, action, "POST", "/api/calculate", expect=(200, 202), json=payload)
+        elif action == "expression":
+            expression = f"({rng.randint(1, 99)} + {rng.randint(1, 99)}) * 2 ^ {rng.randint(1, 4)}"
+            await _request(client, recorder, pacer, action, "POST", "/api/calculate/expression", json={"expression": expression})
+        elif action == "history":
+            await _request(client, recorder, pacer, action, "GET", "/api/history", params={"limit": 20})
+        elif action == "stats":
+            await _request(client, recorder, pacer, action, "GET", "/api/stats")
+        else:
+            await _request(client, recorder, pacer, action, "GET", "/api/export/history")
+
+
+async def run_stage(make_client, users: int, duration: float, rate: float, seed: int) -> dict:
+    recorder = Recorder()
+    pacer = Pacer(rate)
+    started = time.perf_counter()
+    deadline = started + duration
+
+    async def one(i: int) -> None:
+        async with make_client() as client:
+            await user_session(client, recorder, pacer, deadline, random.Random(seed + i))
+
+    await asyncio.gather(*(one(i) for i in range(users)))
+    return {"users": users, "target_rps": rate or None, **recorder.report(time.perf_counter() - started)}
+
+
+def print_stage(stage: dict) -> None:
+    print(
+        f"\n== {stage['users']} users"
+        + (f", target {stage['target_rps']:.0f} req/s" if stage["target_rps"] else "")
+        + f": {stage['requests']} requests in {stage['elapsed_s']:.1f}s, "
+        f"{stage['rps']:.1f} req/s, {100 * stage['error_rate']:.2f}% errors"
+    )
+    print(f"{'route':<12}{'reqs':>8}{'req/s':>9}{'err%':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}  (ms)")
+    for route, r in stage["routes"].items():
+        print(
+            f"{route:<12}{r['requests']:>8}{r['rps']:>9.1f}{100 * r['error_rate']:>7.2f}"
+            f"{r['p50_ms']:>9.1f}{r['p90_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['max_ms']:>9.1f}"
+        )
+
+
+async def main_async(args) -> list[dict]:
+    import httpx
+
+    stages = [int(n) for n in args.users.split(",")]
+    results = []
+
+    if args.url:
+        def make_client():
+            return httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+
+        for users in stages:
+            results.append(await run_stage(make_client, users, args.duration, args.rate, args.seed))
+            print_stage(results[-1])
+        return results
+
+    from app.main import create_app
+
+    app = create_app(async_db=args.async_db)
+    transport = httpx.ASGITransport(app=app)
+
+    def make_client():
+        return httpx.AsyncClient(transport=transport, base_url="http://loadgen", timeout=args.timeout)
+
+    # ASGITransport does not send lifespan events, so run startup/shutdown here
+    async with app.router.lifespan_context(app):
+        for users in stages:
+            results.append(await run_stage(make_client, users, args.duration, args.rate, args.seed))
+            print_stage(results[-1])
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Drive simulated user sessions and report per-route latency.")
+    parser.add_argument("--users", default="50", help="concurrent users; comma-separated for successive stages")
+    parser.add_argument("--duration", type=float, default=30, help="seconds per stage")
+    parser.add_argument("--rate", type=float, default=0, help="target requests/s per stage (0 = as fast as possible)")
+    parser.add_argument("--url", default=None, help="base URL of a running server instead of the in-process app")
+    parser.add_argument("--database-url", default=f"sqlite:///{HERE / '.data' / 'loadgen.db'}", help="in-process only")
+    parser.add_argument("--async-db", action="store_true", help="in-process only: use the async database mode")
+    parser.add_argument("--no-admission", action="store_true", help="in-process only: turn off per-user rate limits")
+    parser.add_argument("--bcrypt-rounds", type=int, default=4, help="in-process only: bcrypt cost for the simulated users")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, default=None, help="write the stages as JSON")
+    args = parser.parse_args(argv)
+
+    if not args.url:
+        # Must be set before any app module reads the settings
+        (HERE / ".data").mkdir(parents=True, exist_ok=True)
+        os.environ["DATABASE_URL"] = args.database_url
+        os.environ["BCRYPT_ROUNDS"] = str(args.bcrypt_rounds)
+        if args.no_admission:
+            os.environ["ADMISSION_ENABLED"] = "false"
+
+    results = asyncio.run(main_async(args))
+    if args.output:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"\nresults written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
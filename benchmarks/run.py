@@ -0,0 +1,181 @@
+"""
+Service-layer benchmarks against a seeded SQLite database.
+
+    python -m benchmarks.run --size 100k
+    python -m benchmarks.run --size 1k --cases calculate,get_stats --repeat 200
+    python -m benchmarks.run --size 100k --save-baseline
+    python -m benchmarks.run --size 100k --baseline benchmarks/baselines/100k.json --threshold 0.15
+
+Each size gets its own database under --data-dir, seeded once and reused.
+Results (mean/p50/p99/min/max in ms, traced peak allocation in KiB) are
+written as JSON; with a baseline, any case whose p50 grew by more than the
+threshold is reported and the run exits 1.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+CASES = (
+    "calculate",
+    "evaluate_expression",
+    "evaluate_expression_cold",
+    "create_calculation",
+    "list_calculations",
+    "get_stats",
+    "get_timeseries",
+    "export_history_csv",
+    "login",
+)
+# bcrypt dominates login; a handful of runs is plenty
+SLOW_CASES = {"login": 10}
+
+
+def parse_size(value: str) -> int:
+    if value.lower() in SIZES:
+        return SIZES[value.lower()]
+    return int(value)
+
+
+def build_cases(user_ids: list[int]) -> dict:
+    # App modules are imported only after DATABASE_URL points at the bench DB
+    from app.db.session import SessionLocal
+    from app.services.calc_service import create_calculation, get_stats, list_calculations
+    from app.services.calculator import calculate, evaluate_expression
+    from app.services.export_service import CsvEncoder, encode_stream, iter_row_chunks
+    from app.services.expression_engine import expression_cache
+    from app.services.rollups import align_range, get_timeseries
+    from app.services.user_service import authenticate
+    from benchmarks.seed import BENCH_PASSWORD, bench_username
+
+    user_id = user_ids[0]
+    username = bench_username(0)
+
+    def with_session(fn):
+        def run():
+            db = SessionLocal()
+            try:
+                return fn(db)
+            finally:
+                db.close()
+        return run
+
+    def evaluate_cold():
+        expression_cache.clear()
+        return evaluate_expression("(5 + 3) * 2 ^ 3 - 7 / 2")
+
+    def timeseries(db):
+        start, end = align_range("day", None, None, max_buckets=366)
+        return get_timeseries(db, user_id=user_id, grain="day", start=start, end=end)
+
+    def export(db):
+        return sum(len(part) for part in encode_stream(iter_row_chunks(db, user_id=user_id), CsvEncoder()))
+
+    return {
+        "calculate": lambda: calculate("mul", 12.5, 4.0),
+        "evaluate_expression": lambda: evaluate_expression("(5 + 3) * 2 ^ 3 - 7 / 2"),
+        "evaluate_expression_cold": evaluate_cold,
+        "create_calculation": with_session(lambda db: create_calculation(db, user_id, op="add", a=1.0, b=2.0)),
+        "list_calculations": with_session(lambda db: list_calculations(db, user_id=user_id, limit=20)),
+        "get_stats": with_session(lambda db: get_stats(db, user_id=user_id)),
+        "get_timeseries": with_session(timeseries),
+        "export_history_csv": with_session(export),
+        "login": with_session(lambda db: authenticate(db, username, BENCH_PASSWORD)),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the service layer.")
+    parser.add_argument("--size", default="1k", help="calculations to seed: 1k, 100k, 1m or a number")
+    parser.add_argument("--users", type=int, default=None, help="users to spread them over (default size/1000, at least 10)")
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated subset of: " + ", ".join(CASES))
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--data-dir", type=Path, default=HERE / ".data")
+    parser.add_argument("--output", type=Path, default=None, help="results JSON (default benchmarks/results/<size>.json)")
+    parser.add_argument("--baseline", type=Path, default=None, help="baseline JSON (default benchmarks/baselines/<size>.json if present)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed p50 growth over baseline (0.2 = 20%%)")
+    parser.add_argument("--save-baseline", action="store_true", help="write these results as the new baseline")
+    args = parser.parse_args(argv)
+
+    calculations = parse_size(args.size)
+    users = args.users or max(10, calculations // 1000)
+    selected = [name.strip() for name in args.cases.split(",") if name.strip()]
+    unknown = sorted(set(selected) - set(CASES))
+    if unknown:
+        parser.error(f"unknown case: {unknown[0]}")
+
+    args.data_dir.mkdir(parents=True, exist_ok=True)
+    db_path = args.data_dir / f"bench_{calculations}_{users}.db"
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+    from app.db.init_db import init_db
+    from app.db.session import SessionLocal
+    from app.models.user import User
+    from sqlalchemy import select
+    from benchmarks.harness import compare, run_case
+    from benchmarks.seed import is_seeded, seed
+
+    init_db()
+    with SessionLocal() as db:
+        if not is_seeded(db, calculations, users):
+            print(f"seeding {calculations} calculations across {users} users into {db_path} ...", flush=True)
+            seed(db, calculations, users)
+        user_ids = db.execute(
+            select(User.id).where(User.username.like("bench_%")).order_by(User.username)
+        ).scalars().all()
+
+    cases = build_cases(user_ids)
+    results = {
+        "meta": {
+            "calculations": calculations,
+            "users": users,
+            "warmup": args.warmup,
+            "repeat": args.repeat,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "cases": {},
+    }
+    for name in selected:
+        repeat = min(args.repeat, SLOW_CASES.get(name, args.repeat))
+        stats = run_case(cases[name], warmup=min(args.warmup, repeat), repeat=repeat)
+        results["cases"][name] = stats
+        print(
+            f"{name:<26} mean {stats['mean_ms']:9.3f} ms  p50 {stats['p50_ms']:9.3f} ms  "
+            f"p99 {stats['p99_ms']:9.3f} ms  peak {stats['peak_kb']:9.1f} KiB",
+            flush=True,
+        )
+
+    size_name = args.size.lower()
+    output = args.output or HERE / "results" / f"{size_name}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"results written to {output}")
+
+    baseline_path = args.baseline or HERE / "baselines" / f"{size_name}.json"
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2))
+        print(f"baseline saved to {baseline_path}")
+        return 0
+
+    if not baseline_path.exists():
+        return 0
+    regressions = compare(results, json.loads(baseline_path.read_text()), threshold=args.threshold)
+    for r in regressions:
+        print(
+            f"REGRESSION {r['case']}: {r['metric']} {r['baseline']:.3f} -> {r['current']:.3f} ms "
+            f"({(r['ratio'] - 1) * 100:+.0f}%, threshold {args.threshold * 100:.0f}%)"
+        )
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Seeding for benchmark databases: `users` accounts sharing one password and
+`calculations` rows spread evenly across them, written with chunked
+multi-row inserts, then the aggregates and rollups rebuilt from them.
+Expects DATABASE_URL to point at the benchmark database before any app
+module is imported (see benchmarks.run).
+"""
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
+
+from app.core.security import hash_password
+from app.models.calculation import Calculation
+from app.models.user import User
+from app.services.calc_service import rebuild_all_stats
+from app.services.calculator import calculate_batch
+from app.services.rollups import rebuild_rollups
+
+BENCH_PASSWORD = "Benchmark123!"
+OPS = ("add", "sub", "mul", "div", "mod", "pow")
+
+
+def bench_username(i: int) -> str:
+    return f"bench_{i:06d}"
+
+
+def is_seeded(db: Session, calculations: int, users: int) -> bool:
+    """create_calculation runs add rows, so a reused database may hold a few more."""
+    calc_count = db.execute(select(func.count(Calculation.id))).scalar_one()
+    user_count = db.execute(
+        select(func.count(User.id)).where(User.username.like("bench_%"))
+    ).scalar_one()
+    return calc_count >= calculations and user_count == users
+
+
+def seed(db: Session, calculations: int, users: int, chunk_rows: int = 50_000) -> list[int]:
+    """Insert the users and their history; returns the user ids."""
+    hashed = hash_password(BENCH_PASSWORD)
+    user_ids = db.execute(
+        insert(User).returning(User.id, sort_by_parameter_order=True),
+        [
+            {
+                "username": bench_username(i),
+                "email": f"{bench_username(i)}@bench.local",
+                "hashed_password": hashed,
+            }
+            for i in range(users)
+        ],
+    ).scalars().all()
+    db.commit()
+
+    started = datetime.now(timezone.utc) - timedelta(seconds=calculations)
+    for offset in range(0, calculations, chunk_rows):
+        n = min(chunk_rows, calculations - offset)
+        index = range(offset, offset + n)
+        op_names = [OPS[i % len(OPS)] for i in index]
+        a = [float(i % 997 + 1) for i in index]
+        b = [float(i % 7 + 1) for i in index]
+        results, _ = calculate_batch(op_names, a, b)
+        db.execute(
+            insert(Calculation),
+            [
+                {
+                    "user_id": user_ids[i % users],
+                    "op": op_names[k],
+                    "a": a[k],
+                    "b": b[k],
+                    "expression": None,
+                    "result": float(results[k]),
+                    "created_at": started + timedelta(seconds=i),
+                }
+                for k, i in enumerate(index)
+            ],
+        )
+        db.commit()
+
+    rebuild_all_stats(db)
+    rebuild_rollups(db)
+    return list(user_ids)
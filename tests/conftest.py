@@ -13,10 +13,11 @@ def _set_test_env():
     os.environ["DATABASE_URL"] = "sqlite:///./test.db"
     os.environ["BASE_URL"] = "http://127.0.0.1:8001"
 
-@pytest.fixture()
-def client():
+@pytest.fixture(params=["sync", "async"])
+def client(request):
+    """Every test using the app runs against both the sync and async DB modes."""
     init_db()
-    app = create_app()
+    app = create_app(async_db=request.param == "async")
     with TestClient(app) as c:
         yield c
 
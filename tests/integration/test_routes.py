@@ -1,3 +1,10 @@
+import json
+import uuid
+
+import pytest
+
+from tests.conftest import register_and_login
+
 def test_register_login_and_dashboard(client):
     r = client.get("/")
     assert r.status_code == 200
@@ -28,3 +35,442 @@ def test_api_calculate_and_history(client):
     r = client.get("/api/history")
     assert r.status_code == 200
     assert len(r.json()) >= 1
+
+def test_api_calculate_batch(client):
+    client.post("/auth/register", data={"username":"arth3","email":"arth3@example.com","password":"Password123!"}, follow_redirects=False)
+    r = client.post("/auth/login", data={"username":"arth3","password":"Password123!"}, follow_redirects=False)
+    client.cookies.set("access_token", r.cookies.get("access_token"))
+
+    r = client.post("/api/calculate/batch", json={"items": [
+        {"op":"add","a":1,"b":2},
+        {"op":"div","a":1,"b":0},
+        {"op":"mul","a":4,"b":2.5},
+    ]})
+    assert r.status_code == 200
+    body = r.json()
+    assert body["succeeded"] == 2 and body["failed"] == 1
+    assert [i["result"] for i in body["items"]] == [3, None, 10]
+    assert body["items"][1]["error"] == "Division by zero"
+    assert body["items"][0]["id"] is not None and body["items"][1]["id"] is None
+
+def test_api_calculate_sweep(client):
+    client.post("/auth/register", data={"username":"arth4","email":"arth4@example.com","password":"Password123!"}, follow_redirects=False)
+    r = client.post("/auth/login", data={"username":"arth4","password":"Password123!"}, follow_redirects=False)
+    client.cookies.set("access_token", r.cookies.get("access_token"))
+
+    r = client.post("/api/calculate/sweep", json={"expression": "1 / x", "variables": {"x": [1, 0, 4]}})
+    assert r.status_code == 200
+    lines = [json.loads(line) for line in r.text.splitlines()]
+    assert lines[0]["rows"] == 3
+    assert lines[1]["result"] == [1, None, 0.25]
+    assert lines[1]["error"] == [0, 1, 0]
+
+    r = client.post("/api/calculate/sweep", json={"expression": "x + y", "variables": {"x": [1]}})
+    assert r.status_code == 400
+
+def test_api_history_keyset_pagination(client):
+    name = f"page_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    client.post("/api/calculate/batch", json={"items": [{"op":"add","a":i,"b":0} for i in range(5)]})
+    client.post("/api/calculate", json={"op":"add","a":5,"b":0})
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        r = client.get("/api/history", params=params)
+        assert r.status_code == 200
+        seen += [row["result"] for row in r.json()]
+        cursor = r.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [5, 4, 3, 2, 1, 0]
+
+    assert client.get("/api/history", params={"cursor": "not-a-cursor"}).status_code == 400
+
+def test_stats_follow_creates_edits_and_deletes(client):
+    name = f"stats_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    assert client.get("/api/stats").json() == {"total_calculations": 0, "average_result": 0.0, "last_operation": None}
+
+    first = client.post("/api/calculate", json={"op":"add","a":1,"b":1}).json()
+    client.post("/api/calculate/batch", json={"items": [{"op":"mul","a":2,"b":2}, {"op":"sub","a":9,"b":3}]})
+    assert client.get("/api/stats").json() == {"total_calculations": 3, "average_result": 4.0, "last_operation": "sub"}
+
+    r = client.put(f"/api/calculations/{first['id']}", json={"op":"add","a":5,"b":5})
+    assert r.status_code == 200 and r.json()["result"] == 10
+    assert client.get("/api/stats").json()["average_result"] == 20 / 3
+
+    last_id = client.get("/api/history").json()[0]["id"]
+    assert client.delete(f"/api/calculations/{last_id}").status_code == 200
+    assert client.get("/api/stats").json() == {"total_calculations": 2, "average_result": 7.0, "last_operation": "mul"}
+    assert client.get(f"/api/calculations/{last_id}").status_code == 404
+
+    from app.db.session import SessionLocal
+    from app.services.calc_service import rebuild_all_stats
+    from app.services.user_service import get_user_by_username
+    db = SessionLocal()
+    try:
+        user_id = get_user_by_username(db, name).id
+        assert rebuild_all_stats(db, check_only=True, user_id=user_id) == []
+    finally:
+        db.close()
+
+def test_export_history_csv_streams_and_gzips(client):
+    name = f"export_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    client.post("/api/calculate/batch", json={"items": [{"op":"add","a":i,"b":1} for i in range(3)]})
+
+    r = client.get("/api/export/history", headers={"Accept-Encoding": "identity"})
+    assert r.status_code == 200
+    assert "content-encoding" not in r.headers
+    lines = r.text.strip().splitlines()
+    assert lines[0] == "operation,a,b,expression,result"
+    assert lines[1:] == ["add,2.0,1.0,,3.0", "add,1.0,1.0,,2.0", "add,0.0,1.0,,1.0"]
+
+    r = client.get("/api/export/history", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.text.strip().splitlines() == lines
+
+def test_export_history_columnar(client, monkeypatch):
+    name = f"arrow_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    client.post("/api/calculate/batch", json={"items": [{"op":"add","a":i,"b":1} for i in range(3)]})
+
+    from app.routes import api
+    monkeypatch.setattr(api, "columnar_available", lambda: False)
+    assert client.get("/api/export/history", params={"format": "arrow"}).status_code == 406
+    monkeypatch.undo()
+
+    pa = pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    r = client.get("/api/export/history", params={"format": "arrow"})
+    assert r.status_code == 200
+    table = pa.ipc.open_stream(r.content).read_all()
+    assert table.column("result").to_pylist() == [3.0, 2.0, 1.0]
+    assert str(table.schema.field("created_at").type) == "timestamp[us, tz=UTC]"
+
+    r = client.get("/api/export/history", params={"format": "parquet"})
+    table = pq.read_table(pa.BufferReader(r.content))
+    assert table.column("op").to_pylist() == ["add", "add", "add"]
+
+def test_auth_cache_invalidated_on_profile_change(client):
+    name = f"cache_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    assert client.get("/api/stats").status_code == 200
+    before = client.get("/api/diagnostics").json()["auth_cache"]
+    assert client.get("/api/stats").status_code == 200
+    after = client.get("/api/diagnostics").json()["auth_cache"]
+    assert after["hits"] > before["hits"]
+
+    # Renaming the user must take effect at once: the old token names a user that no longer exists
+    r = client.post("/profile", data={"username": f"{name}_new", "email": f"{name}@example.com"}, follow_redirects=False)
+    assert r.status_code == 303
+    assert client.get("/api/stats").status_code == 401
+
+def test_api_calculate_write_behind(monkeypatch):
+    from fastapi.testclient import TestClient
+    from app.core.config import settings
+    from app.main import create_app
+
+    monkeypatch.setattr(settings, "write_behind_enabled", True)
+    name = f"wb_{uuid.uuid4().hex[:8]}"
+    with TestClient(create_app()) as c:
+        register_and_login(c, username=name, email=f"{name}@example.com")
+
+        r = c.post("/api/calculate", json={"op":"add","a":1,"b":2})
+        assert r.status_code == 202
+        assert r.json()["id"] is None and r.json()["result"] == 3
+
+        r = c.post("/api/calculate", params={"wait": True}, json={"op":"mul","a":2,"b":5})
+        assert r.status_code == 200
+        assert r.json()["id"] is not None
+
+        assert c.post("/api/calculate", json={"op":"div","a":1,"b":0}).status_code == 400
+        assert c.get("/api/diagnostics").json()["write_behind"]["rows"] >= 2
+
+    # Shutdown flushed everything that was queued
+    with TestClient(create_app()) as c:
+        c.post("/auth/login", data={"username": name, "password": "Password123!"})
+        assert c.get("/api/stats").json()["total_calculations"] == 2
+
+def test_engine_pragmas_and_pool_stats(client):
+    from app.db.session import engine
+
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == "wal"
+            assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+
+    name = f"pool_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    pools = client.get("/api/diagnostics").json()["db_pool"]
+    mode = "async" if client.app.state.async_db else "sync"
+    assert pools[mode]["checkouts"] >= 1
+    assert pools[mode]["max_wait_ms"] >= 0
+
+def test_undo_history_stays_out_of_the_cookie(client):
+    for n in range(100):
+        assert client.post("/api/undo/push", json={"op": "add", "a": n, "b": 1, "padding": "x" * 50}).status_code == 200
+    assert len(client.cookies.get("session", "")) < 200
+
+    assert client.post("/api/undo/pop").json()["calculation"]["a"] == 99
+    assert client.post("/api/redo").json()["calculation"]["a"] == 99
+    assert client.post("/api/redo").json() == {"status": "empty"}
+
+    assert client.post("/api/undo/push", json={"op": "add", "a": 1, "b": 1, "padding": "x" * 5000}).status_code == 413
+    assert client.post("/api/undo/push", json={"op": "add", "a": "one"}).status_code == 422
+    assert client.post("/api/undo/pop").json()["calculation"] == {"op": "add", "a": 99, "b": 1}
+
+def test_conditional_get_short_circuits_to_304(client):
+    name = f"etag_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    client.post("/api/calculate", json={"op": "add", "a": 1, "b": 2})
+
+    etags = {}
+    for path in ("/api/history", "/api/stats", "/dashboard"):
+        etags[path] = client.get(path).headers["etag"]
+        again = client.get(path, headers={"If-None-Match": etags[path]})
+        assert again.status_code == 304
+        assert again.content == b""
+
+    client.post("/api/calculate", json={"op": "mul", "a": 2, "b": 3})
+    for path, etag in etags.items():
+        changed = client.get(path, headers={"If-None-Match": etag})
+        assert changed.status_code == 200
+        assert changed.headers["etag"] != etag
+
+def test_pages_are_served_from_the_fragment_cache(client):
+    from app.core.templating import renderer
+
+    name = f"frag_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    client.post("/api/calculate", json={"op": "add", "a": 40, "b": 2})
+
+    assert "<td>40.0</td>" in client.get("/dashboard").text
+    hits = renderer.fragments.stats()["hits"]
+    renders = renderer.stats()["renders"]["dashboard.html"]["renders"]
+    assert "<td>40.0</td>" in client.get("/dashboard").text
+    assert renderer.fragments.stats()["hits"] == hits + 1
+    assert renderer.stats()["renders"]["dashboard.html"]["renders"] == renders
+
+    # A write moves the history version on, so the new row shows up
+    client.post("/api/calculate", json={"op": "mul", "a": 6, "b": 7})
+    assert "<td>6.0</td>" in client.get("/dashboard").text
+
+    assert client.get("/login").text == client.get("/login").text
+    assert renderer.stats()["precompiled"] >= 6
+
+def test_metrics_exposes_route_and_query_stats(client):
+    name = f"metrics_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    client.get("/api/stats")
+    client.get("/api/calculations/999999999")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/api/stats",status="2xx"}' in body
+    assert 'http_requests_total{method="GET",route="/api/calculations/{calc_id}",status="4xx"}' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/api/stats",le="+Inf"}' in body
+    assert "http_requests_in_flight 1" in body
+
+    queries = [
+        line for line in body.splitlines()
+        if line.startswith('http_request_db_queries_sum{method="GET",route="/api/stats"}')
+    ]
+    assert queries and float(queries[0].split()[-1]) >= 1
+
+def test_routes_stay_within_query_budgets(client):
+    from app.core.sql_trace import query_budget
+
+    name = f"budget_{uuid.uuid4().hex[:8]}"
+    with query_budget(4, route="/auth/register", method="POST"):
+        register_and_login(client, username=name, email=f"{name}@example.com")
+    client.post("/api/calculate", json={"op": "add", "a": 1, "b": 2})
+
+    # Stats and version come from one user_stats row; the user is cached by token
+    with query_budget(1, route="/api/stats"):
+        client.get("/api/stats")
+    with query_budget(2, route="/api/history"):
+        client.get("/api/history")
+    with query_budget(2, route="/dashboard"):
+        client.get("/dashboard")
+
+def test_admission_control_limits_each_user(client):
+    from app.services.admission import AdmissionController, MemoryAdmissionBackend
+
+    client.app.state.admission = AdmissionController(MemoryAdmissionBackend(), rate=0.1, burst=3, heavy_concurrency=0)
+    name = f"adm_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    for _ in range(3):
+        assert client.post("/api/calculate", json={"op": "add", "a": 1, "b": 1}).status_code == 200
+    r = client.post("/api/calculate", json={"op": "add", "a": 1, "b": 1})
+    assert r.status_code == 429
+    assert int(r.headers["retry-after"]) >= 1
+    # Reads are not charged
+    assert client.get("/api/stats").json()["total_calculations"] == 3
+
+    # With no heavy slots free, exports are shed instead of queued
+    client.app.state.admission = AdmissionController(MemoryAdmissionBackend(), rate=10, burst=100, heavy_concurrency=0)
+    r = client.get("/api/export/history")
+    assert r.status_code == 503 and r.headers["retry-after"] == "1"
+    assert client.get("/api/diagnostics").json()["admission"]["shed"] == 1
+
+def test_stats_timeseries_follows_writes(client):
+    name = f"series_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    first = client.post("/api/calculate", json={"op": "add", "a": 1, "b": 1}).json()
+    client.post("/api/calculate", json={"op": "mul", "a": 3, "b": 3})
+    client.post("/api/calculate/expression", json={"expression": "1 + 1"})
+
+    r = client.get("/api/stats/timeseries", params={"grain": "hour"})
+    assert r.status_code == 200
+    body = r.json()
+    assert len(body["series"]) == 48
+    assert sum(point["count"] for point in body["series"]) == 2
+    assert max(point["max"] for point in body["series"] if point["count"]) == 9
+    assert {entry["op"]: entry["count"] for entry in body["by_op"]} == {"add": 1, "mul": 1}
+    assert client.get(
+        "/api/stats/timeseries", params={"grain": "hour"}, headers={"If-None-Match": r.headers["etag"]}
+    ).status_code == 304
+
+    # Edits and deletes rebuild the affected buckets, extremes included
+    client.put(f"/api/calculations/{first['id']}", json={"op": "sub", "a": 1, "b": 11})
+    day = client.get("/api/stats/timeseries").json()
+    assert min(point["min"] for point in day["series"] if point["count"]) == -10
+    assert day["distribution"]["[-1000,-1)"] == 1
+
+    mul_id = client.get("/api/history").json()[0]["id"]
+    client.delete(f"/api/calculations/{mul_id}")
+    day = client.get("/api/stats/timeseries", params={"op": "mul"}).json()
+    assert sum(point["count"] for point in day["series"]) == 0 and day["by_op"] == []
+
+    assert client.get("/api/stats/timeseries", params={"grain": "hour", "start": "2000-01-01T00:00:00"}).status_code == 400
+
+def test_history_and_export_reach_into_the_archive(client):
+    from datetime import datetime, timedelta, timezone
+    from sqlalchemy import update
+    from app.db.session import SessionLocal
+    from app.models.calculation import Calculation
+    from app.services.retention import archive_older_than
+
+    name = f"archive_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    for a in (1, 2, 3):
+        client.post("/api/calculate", json={"op": "add", "a": a, "b": 0})
+    stats = client.get("/api/stats").json()
+
+    db = SessionLocal()
+    try:
+        oldest = client.get("/api/history").json()[-1]["id"]
+        db.execute(
+            update(Calculation).where(Calculation.id == oldest)
+            .values(created_at=datetime.now(timezone.utc) - timedelta(days=400))
+        )
+        db.commit()
+        archive_older_than(db, datetime.now(timezone.utc) - timedelta(days=365), pause=0)
+        assert db.get(Calculation, oldest) is None
+    finally:
+        db.close()
+
+    assert client.get("/api/stats").json() == stats
+    assert [row["result"] for row in client.get("/api/history").json()] == [3, 2, 1]
+    # Archived rows are read-only
+    assert client.delete(f"/api/calculations/{oldest}").status_code == 404
+
+    assert client.get("/api/export/history").text.count("\n") == 4
+    recent = (datetime.now(timezone.utc) - timedelta(days=1)).isoformat()
+    assert client.get("/api/export/history", params={"since": recent}).text.count("\n") == 3
+
+def test_import_history_csv_streams_progress(client):
+    name = f"import_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+
+    body = "operation,a,b,expression,result\nadd,1,2,,\ndiv,1,0,,\n,,,3*3,\n"
+    r = client.post("/api/import/history", content=body, headers={"Content-Type": "text/csv"})
+    assert r.status_code == 200
+    assert r.headers["content-type"] == "application/x-ndjson"
+    events = [json.loads(line) for line in r.text.splitlines()]
+    assert events[0] == {"event": "error", "line": 3, "error": "Division by zero"}
+    assert events[-1] == {"event": "done", "rows": 3, "imported": 2, "failed": 1, "errors_reported": 1}
+
+    assert [row["result"] for row in client.get("/api/history").json()] == [9, 3]
+    assert client.get("/api/stats").json()["total_calculations"] == 2
+
+    r = client.post("/api/import/history", content="op,a,b\n", headers={"Content-Type": "text/csv"})
+    assert r.status_code == 400
+
+def test_import_releases_its_slot_and_spool_when_refused(client, monkeypatch):
+    import tempfile
+    from app.routes import api
+    from app.services.admission import AdmissionController, MemoryAdmissionBackend
+
+    spools = []
+    make_spool = tempfile.SpooledTemporaryFile
+
+    def spool(*args, **kwargs):
+        spools.append(make_spool(*args, **kwargs))
+        return spools[-1]
+
+    monkeypatch.setattr(api.tempfile, "SpooledTemporaryFile", spool)
+    name = f"impslot_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    headers = {"Content-Type": "text/csv"}
+
+    admission = AdmissionController(MemoryAdmissionBackend(), rate=100, burst=100, heavy_concurrency=1)
+    client.app.state.admission = admission
+    assert client.post("/api/import/history", content="op,a,b\n", headers=headers).status_code == 400
+    assert admission.stats()["slots_in_use"] == {"heavy": 0}
+    assert len(spools) == 1 and spools[0].closed
+
+    # Shed before the body is read, so nothing is spooled
+    client.app.state.admission = AdmissionController(MemoryAdmissionBackend(), rate=100, burst=100, heavy_concurrency=0)
+    assert client.post("/api/import/history", content="operation,a,b,expression\n", headers=headers).status_code == 503
+    assert len(spools) == 1
+
+def test_heavy_slots_survive_clients_that_disconnect_before_the_body(client):
+    from app.services.admission import AdmissionController, MemoryAdmissionBackend
+
+    admission = AdmissionController(MemoryAdmissionBackend(), rate=100, burst=100, heavy_concurrency=2)
+    client.app.state.admission = admission
+    name = f"gone_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    cookie = f"access_token={client.cookies['access_token']}".encode()
+
+    import asyncio
+
+    async def export_and_leave():
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": "/api/export/history", "raw_path": b"/api/export/history",
+            "query_string": b"", "root_path": "", "client": ("testclient", 50000), "server": ("testserver", 80),
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie)],
+        }
+        messages = [{"type": "http.request", "body": b"", "more_body": False}, {"type": "http.disconnect"}]
+
+        async def receive():
+            await asyncio.sleep(0)
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            await asyncio.sleep(0)
+
+        await client.app(scope, receive, send)
+
+    for _ in range(5):
+        client.portal.call(export_and_leave)
+    assert admission.stats()["slots_in_use"] == {"heavy": 0}
+    assert client.get("/api/export/history").status_code == 200
+
+def test_expression_route_rejects_out_of_range_numbers(client):
+    name = f"expr_{uuid.uuid4().hex[:8]}"
+    register_and_login(client, username=name, email=f"{name}@example.com")
+    for expression in ("1e400", "9" * 400, "1e400*0"):
+        r = client.post("/api/calculate/expression", json={"expression": expression})
+        assert r.status_code == 400 and r.json()["detail"] == "Number too large"
@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import uuid
+
+import pytest
+
+from app.db.init_db import init_db
+from app.db.session import SessionLocal
+from app.services.admission import (
+    AdmissionController,
+    AdmissionRejected,
+    DatabaseAdmissionBackend,
+    MemoryAdmissionBackend,
+    SlotStreamingResponse,
+)
+
+
+@pytest.fixture(params=["memory", "database"])
+def backend(request):
+    if request.param == "memory":
+        return MemoryAdmissionBackend(max_keys=2)
+    init_db()
+    return DatabaseAdmissionBackend(SessionLocal)
+
+
+def test_bucket_admits_a_burst_then_reports_the_wait(backend):
+    key = f"user:{uuid.uuid4().hex}"
+    assert all(backend.take(key, 1, rate=0.5, burst=3) == 0 for _ in range(3))
+    wait = backend.take(key, 1, rate=0.5, burst=3)
+    # One token refills every 2 s
+    assert 1.5 < wait <= 2.0
+    # A different user has their own bucket
+    assert backend.take(f"user:{uuid.uuid4().hex}", 1, rate=0.5, burst=3) == 0
+
+
+def test_concurrent_database_checks_never_overspend_a_bucket():
+    from concurrent.futures import ThreadPoolExecutor
+
+    init_db()
+    backend = DatabaseAdmissionBackend(SessionLocal)
+    key = f"user:{uuid.uuid4().hex}"
+    start = threading.Barrier(8)
+
+    def take(_):
+        start.wait()
+        return [backend.take(key, 1, rate=1e-6, burst=5) for _ in range(3)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        waits = [wait for batch in pool.map(take, range(8)) for wait in batch]
+    assert sum(wait == 0 for wait in waits) == 5
+
+
+def test_memory_backend_bounds_its_buckets():
+    backend = MemoryAdmissionBackend(max_keys=2)
+    for key in ("a", "b", "c"):
+        backend.take(key, 1, rate=1, burst=5)
+    assert backend.stats()["buckets"] == 2
+
+
+def test_heavy_slots_are_capped_and_released_after_the_body():
+    controller = AdmissionController(MemoryAdmissionBackend(), rate=10, burst=10, heavy_concurrency=1)
+    slot = controller.heavy_slot("export")
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.heavy_slot("export")
+    assert rejected.value.status_code == 503 and rejected.value.headers == {"Retry-After": "1"}
+
+    sent = []
+
+    async def receive():
+        await asyncio.sleep(1)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    response = SlotStreamingResponse(slot, iter([b"a", b"b"]))
+    asyncio.run(response({"type": "http"}, receive, send))
+    assert [m.get("body") for m in sent[1:]] == [b"a", b"b", b""]
+    controller.heavy_slot("export").release()
+    assert controller.stats()["shed"] == 1
+
+
+def test_slot_is_released_when_the_client_leaves_before_the_body_starts():
+    controller = AdmissionController(MemoryAdmissionBackend(), rate=10, burst=10, heavy_concurrency=1)
+    started = []
+
+    def body():
+        started.append(True)
+        yield b"never sent"
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    for _ in range(3):
+        response = SlotStreamingResponse(controller.heavy_slot("export"), body())
+        asyncio.run(response({"type": "http"}, receive, send))
+    assert started == []
+    assert controller.stats()["slots_in_use"] == {"heavy": 0}
+
+
+def test_rate_limit_rejection_carries_retry_after():
+    controller = AdmissionController(MemoryAdmissionBackend(), rate=0.25, burst=10, heavy_concurrency=1)
+    asyncio.run(controller.check_rate(1, "export"))
+    with pytest.raises(AdmissionRejected) as rejected:
+        asyncio.run(controller.check_rate(1, "calculate"))
+    assert rejected.value.status_code == 429
+    assert rejected.value.headers == {"Retry-After": "4"}
@@ -0,0 +1,35 @@
+from benchmarks.harness import compare, percentile, run_case
+
+def test_percentile_nearest_rank():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 99) == 99
+    assert percentile([3.0], 99) == 3.0
+
+def test_run_case_reports_timings_and_memory():
+    stats = run_case(lambda: [0] * 10000, warmup=1, repeat=5)
+    assert stats["runs"] == 5
+    assert 0 <= stats["min_ms"] <= stats["p50_ms"] <= stats["max_ms"]
+    assert stats["peak_kb"] > 70
+
+def test_compare_flags_cases_over_threshold():
+    baseline = {"cases": {"fast": {"p50_ms": 1.0}, "slow": {"p50_ms": 1.0}}}
+    results = {"cases": {"fast": {"p50_ms": 1.1}, "slow": {"p50_ms": 1.5}, "new": {"p50_ms": 9.0}}}
+    regressions = compare(results, baseline, threshold=0.2)
+    assert [r["case"] for r in regressions] == ["slow"]
+
+def test_load_recorder_histogram_and_error_rate():
+    import time
+    from benchmarks.loadgen import Recorder
+
+    recorder = Recorder()
+    now = time.perf_counter()
+    recorder.record("stats", now, 200, ok=True)
+    recorder.record("stats", now - 0.3, 500, ok=False)
+    report = recorder.report(elapsed=1.0)
+    stats = report["routes"]["stats"]
+    assert stats["requests"] == 2
+    assert stats["error_rate"] == 0.5
+    assert stats["statuses"] == {200: 1, 500: 1}
+    assert stats["histogram"]["<=1ms"] == 1
+    assert stats["histogram"]["<=500ms"] == 1
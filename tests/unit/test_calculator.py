@@ -1,5 +1,5 @@
 import pytest
-from app.services.calculator import calculate
+from app.services.calculator import calculate, calculate_batch
 
 def test_add():
     assert calculate("add", 2, 3) == 5
@@ -32,4 +32,16 @@ def test_invalid_operation():
 
 def test_pow_limits():
     with pytest.raises(ValueError):
-        calculate("pow", 1e9, 2)
\ No newline at end of file
+        calculate("pow", 1e9, 2)
+
+def test_calculate_batch_matches_calculate():
+    results, errors = calculate_batch(
+        ["add", "div", "MOD", "pow", "div", "pow", "sqrt"],
+        [2, 7, -7, 2, 1, 1e9, 4],
+        [3, 2, 3, 10, 0, 2, 0],
+    )
+    assert results[:4].tolist() == [5, 3.5, calculate("mod", -7, 3), 1024]
+    assert errors[:4] == [None, None, None, None]
+    assert errors[4] == "Division by zero"
+    assert errors[5] == "Inputs too large for pow"
+    assert errors[6] == "Unsupported operation: sqrt"
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+from app.services.calculator import evaluate_expression
+from app.core.config import settings
+from app.services.expression_engine import ExpressionCache, ExpressionTooComplex, compile_expression
+
+def test_evaluate_expression():
+    assert evaluate_expression("(5 + 3) * 2") == 16
+    assert evaluate_expression("2^3 + 4") == 12
+    assert evaluate_expression("-3 + +1") == -2
+
+def test_expression_errors():
+    with pytest.raises(ZeroDivisionError):
+        evaluate_expression("1 / (2 - 2)")
+    with pytest.raises(ValueError):
+        evaluate_expression("2 ** 1e9")
+    with pytest.raises(ValueError):
+        evaluate_expression("__import__('os')")
+    with pytest.raises(ValueError):
+        evaluate_expression("(1 +")
+    with pytest.raises(ValueError):
+        evaluate_expression("   ")
+
+def test_compiled_expression_is_reused():
+    assert compile_expression(" 7 ^ 2 ") is compile_expression("7 ** 2")
+
+def test_cache_counters_and_eviction():
+    cache = ExpressionCache(maxsize=2)
+    cache.get("1 + 1")
+    cache.get("1 + 1")
+    cache.get("2 + 2")
+    cache.get("3 + 3")
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["evictions"] == 1
+    assert stats["size"] == 2
+
+def test_budgets_reject_before_evaluation(monkeypatch):
+    monkeypatch.setattr(settings, "expression_max_length", 50)
+    with pytest.raises(ExpressionTooComplex, match="too long"):
+        evaluate_expression("1 + " * 20 + "1")
+
+def test_deep_and_large_expressions_are_rejected(monkeypatch):
+    with pytest.raises(ExpressionTooComplex, match="nested too deeply"):
+        evaluate_expression("(" * 500 + "1" + ")" * 500)
+    with pytest.raises(ExpressionTooComplex, match="nested too deeply"):
+        evaluate_expression("-" * 500 + "1")
+    monkeypatch.setattr(settings, "expression_max_nodes", 50)
+    with pytest.raises(ExpressionTooComplex, match="more than 50 nodes"):
+        evaluate_expression("+".join(["1*2"] * 30))
+
+def test_flat_chains_are_not_nesting(monkeypatch):
+    # More terms than the depth budget, but no nesting: bounded by the node budget
+    assert evaluate_expression("+".join(["1"] * 300)) == 300
+    assert evaluate_expression("-".join(["1"] * 150) + "*2/2" * 100) == -148
+    monkeypatch.setattr(settings, "expression_max_depth", 10)
+    with pytest.raises(ExpressionTooComplex, match="nested too deeply"):
+        evaluate_expression("1+(" * 20 + "1" + ")" * 20)
+    with pytest.raises(ExpressionTooComplex, match="nested too deeply"):
+        evaluate_expression("**".join(["1"] * 20))
+
+def test_long_chains_evaluate_without_recursion(monkeypatch):
+    monkeypatch.setattr(settings, "expression_max_depth", 10000)
+    monkeypatch.setattr(settings, "expression_max_nodes", 10000)
+    monkeypatch.setattr(settings, "expression_max_length", 100000)
+    assert evaluate_expression("+".join(["1"] * 500)) == 500
+
+def test_magnitude_budget_applies_per_operation():
+    with pytest.raises(ValueError, match="Result too large"):
+        evaluate_expression("1 / (1e200 * 1e200)")
+    values, errors = compile_expression("1 / (x * x)").evaluate_array({"x": np.array([2.0, 1e200])})
+    assert values[0] == 0.25
+    assert errors.tolist() == [0, 3]
+
+def test_out_of_range_literals_and_nan_are_rejected():
+    with pytest.raises(ValueError, match="Number too large"):
+        evaluate_expression("1e400")
+    with pytest.raises(ValueError, match="Number too large"):
+        evaluate_expression("9" * 400)
+    with pytest.raises(ValueError, match="Result too large"):
+        evaluate_expression("1e300*10*0")
+    with pytest.raises(ValueError, match="Variable value out of range"):
+        evaluate_expression("x*0", {"x": float("inf")})
+    with pytest.raises(ValueError, match="Variable value out of range"):
+        evaluate_expression("-x", {"x": float("nan")})
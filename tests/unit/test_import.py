@@ -0,0 +1,122 @@
+import io
+import uuid
+
+import pytest
+
+from app.services.calc_service import get_history_state, list_calculations, rebuild_all_stats
+from app.services.export_service import CsvEncoder, encode_stream, iter_row_chunks
+from app.services.import_service import ImportFormatError, iter_import, open_import
+
+
+def _user(db, prefix):
+    from app.services.user_service import create_user
+
+    uid = uuid.uuid4().hex
+    return create_user(db, f"{prefix}_{uid}", f"{prefix}_{uid}@example.com", "Password123!")
+
+
+def _run(db, user_id, text, **kwargs):
+    reader, index = open_import(io.StringIO(text))
+    return list(iter_import(db, user_id, reader, index, **kwargs))
+
+
+def test_open_import_checks_the_header():
+    with pytest.raises(ImportFormatError):
+        open_import(io.StringIO(""))
+    with pytest.raises(ImportFormatError, match="expression"):
+        open_import(io.StringIO("operation,a,b\nadd,1,2\n"))
+    _, index = open_import(io.StringIO("Operation, A ,b,expression,result\n"))
+    assert index["a"] == 1
+
+
+def test_import_recomputes_in_chunks_and_reports_bad_rows(client):
+    from app.db.session import SessionLocal
+
+    db = SessionLocal()
+    try:
+        user = _user(db, "imp")
+        text = (
+            "operation,a,b,expression,result,created_at\n"
+            "add,1,2,,999,2020-01-01T00:00:00\n"      # result is recomputed
+            "foo,2,2,,,\n"                            # unsupported op
+            "div,1,0,,,\n"                            # division by zero
+            ",,,2*(3+4),,2020-01-02T12:00:00+02:00\n"
+            "\n"
+            "mul,x,2,,,\n"                            # not a number
+            "sub,5,3,,,\n"
+        )
+        events = _run(db, user.id, text, chunk_rows=2, max_errors=2)
+
+        errors = [e for e in events if e["event"] == "error"]
+        assert [e["line"] for e in errors] == [3, 4]
+        assert [e for e in events if e["event"] == "progress"][-1] == {
+            "event": "progress", "rows": 6, "imported": 3, "failed": 3,
+        }
+        assert events[-1] == {"event": "done", "rows": 6, "imported": 3, "failed": 3, "errors_reported": 2}
+
+        db.expire_all()
+        rows = list_calculations(db, user.id, limit=10)
+        assert sorted((r.op or "", r.result) for r in rows) == [("", 14.0), ("add", 3.0), ("sub", 2.0)]
+        stamps = {r.result: r.created_at.replace(tzinfo=None) for r in rows}
+        assert stamps[14.0].isoformat() == "2020-01-02T10:00:00"
+
+        # The newest row stays the latest even though older ones were imported after it
+        state = get_history_state(db, user.id)
+        assert state.stats["total_calculations"] == 3
+        assert state.stats["last_operation"] == "sub"
+        assert rebuild_all_stats(db, check_only=True, user_id=user.id) == []
+    finally:
+        db.close()
+
+
+def test_expressions_longer_than_the_column_are_rejected(client):
+    from app.db.session import SessionLocal
+
+    db = SessionLocal()
+    try:
+        user = _user(db, "imp")
+        long_sum = "+".join(["1"] * 128)  # 255 characters
+        text = f"operation,a,b,expression\n,,,{long_sum}\n,,,{long_sum}+1\n"
+        events = _run(db, user.id, text)
+        assert events[0] == {"event": "error", "line": 3, "error": "Expression longer than 255 characters"}
+        assert events[-1]["imported"] == 1 and events[-1]["failed"] == 1
+    finally:
+        db.close()
+
+
+def test_non_finite_results_are_rejected(client, monkeypatch):
+    from app.db.session import SessionLocal
+    from app.services import import_service
+
+    # Whatever the expression engine lets through, inf/nan never reach the table
+    monkeypatch.setattr(import_service, "evaluate_expression", lambda expression: float(expression))
+    db = SessionLocal()
+    try:
+        user = _user(db, "imp")
+        events = _run(db, user.id, "operation,a,b,expression\n,,,inf\n,,,nan\n,,,2.5\n")
+        errors = [(e["line"], e["error"]) for e in events if e["event"] == "error"]
+        assert errors == [(2, "Result is not a finite number"), (3, "Result is not a finite number")]
+        assert events[-1]["imported"] == 1
+        db.expire_all()
+        assert [r.result for r in list_calculations(db, user.id, limit=10)] == [2.5]
+    finally:
+        db.close()
+
+
+def test_exported_csv_imports_back(client):
+    from app.db.session import SessionLocal
+    from app.services.calc_service import create_calculations_batch
+
+    db = SessionLocal()
+    try:
+        source = _user(db, "exp")
+        create_calculations_batch(db, source.id, [("add", 1.0, 2.0), ("mul", 3.0, 4.0)])
+        exported = b"".join(encode_stream(iter_row_chunks(db, user_id=source.id), CsvEncoder()))
+
+        target = _user(db, "imp")
+        events = _run(db, target.id, exported.decode())
+        assert events[-1]["imported"] == 2 and events[-1]["failed"] == 0
+        db.expire_all()
+        assert sorted(r.result for r in list_calculations(db, target.id, limit=10)) == [3.0, 12.0]
+    finally:
+        db.close()
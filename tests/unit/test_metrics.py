@@ -0,0 +1,25 @@
+import gc
+import threading
+import uuid
+
+from app.core import metrics
+
+
+def test_finished_threads_fold_their_shard_into_the_retired_total():
+    route = f"/retired/{uuid.uuid4().hex[:8]}"
+    before = len(metrics._shards)
+
+    def work():
+        metrics._route_stats("GET", route).requests += 1
+        metrics._shard().queries += 2
+
+    for _ in range(5):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    gc.collect()
+
+    assert len(metrics._shards) == before
+    routes, totals = metrics._merge()
+    assert routes[("GET", route)].requests == 5
+    assert totals.queries >= 10
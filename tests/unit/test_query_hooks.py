@@ -0,0 +1,27 @@
+import pytest
+from sqlalchemy import create_engine, text
+
+from app.core import query_hooks
+from app.core.query_hooks import track_request, untrack_request
+
+
+def test_nested_middlewares_share_one_request_tally():
+    engine = create_engine("sqlite://")
+    scope = {"type": "http", "method": "GET", "path": "/x"}
+    outer, outer_token = track_request(scope)
+    inner, inner_token = track_request(scope)
+    try:
+        assert inner is outer and inner_token is None
+        inner.records = []
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+    finally:
+        untrack_request(inner_token)
+        untrack_request(outer_token)
+    engine.dispose()
+
+    # Each statement is timed once and feeds both the tally and the records
+    assert outer.count == len(outer.records) == 2
+    assert outer.seconds == pytest.approx(sum(r.duration for r in outer.records))
+    assert query_hooks._current_request.get() is None
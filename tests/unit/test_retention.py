@@ -0,0 +1,104 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import func, select
+
+from app.db.init_db import init_db
+from app.db.session import SessionLocal
+from app.models.calculation import Calculation
+from app.models.calculation_archive import ArchivedCalculation
+from app.services.calc_service import (
+    get_history_state,
+    insert_calculation_rows,
+    list_calculations_page,
+    rebuild_all_stats,
+)
+from app.services.export_service import iter_row_chunks
+from app.services.retention import RetentionJob, archive_older_than, count_archivable
+from app.services.user_service import create_user
+
+
+@pytest.fixture
+def db():
+    init_db()
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+def _user(db):
+    uid = uuid.uuid4().hex
+    return create_user(db, f"ret_{uid}", f"ret_{uid}@example.com", "Password123!")
+
+
+def _archived(db, user_id):
+    return db.execute(select(func.count()).where(ArchivedCalculation.user_id == user_id)).scalar_one()
+
+
+def _seed(db, user_id, ages_days):
+    now = datetime.now(timezone.utc)
+    rows = [
+        {"user_id": user_id, "op": "add", "a": float(i), "b": 0.0, "expression": None, "result": float(i),
+         "created_at": now - timedelta(days=age)}
+        for i, age in enumerate(ages_days)
+    ]
+    insert_calculation_rows(db, rows)
+    db.commit()
+
+
+def test_archival_moves_old_rows_and_reads_stay_whole(db):
+    user = _user(db)
+    # Results 0..5, oldest first: four rows past a 30 day cutoff, two recent
+    _seed(db, user.id, [400, 300, 200, 100, 2, 1])
+    before = get_history_state(db, user.id).stats
+    cutoff = datetime.now(timezone.utc) - timedelta(days=30)
+
+    assert count_archivable(db, cutoff) >= 4
+    archive_older_than(db, cutoff, batch_rows=3, pause=0)
+    live = db.execute(select(func.count()).where(Calculation.user_id == user.id)).scalar_one()
+    assert (live, _archived(db, user.id)) == (2, 4)
+
+    db.expire_all()
+    state = get_history_state(db, user.id)
+    assert state.stats == before
+    assert state.archived_through is not None
+
+    # The first page is served from live rows alone; paging continues into the archive
+    page, cursor = list_calculations_page(db, user.id, limit=2, archived_through=state.archived_through)
+    results = [calc.result for calc in page]
+    while cursor:
+        page, cursor = list_calculations_page(
+            db, user.id, limit=2, cursor=cursor, archived_through=state.archived_through
+        )
+        results += [calc.result for calc in page]
+    assert results == [5.0, 4.0, 3.0, 2.0, 1.0, 0.0]
+
+    def exported(**kwargs):
+        return [row[-1] for chunk in iter_row_chunks(db, user.id, archived_through=state.archived_through, **kwargs)
+                for row in chunk]
+
+    assert exported() == [5.0, 4.0, 3.0, 2.0, 1.0, 0.0]
+    assert exported(since=datetime.now(timezone.utc) - timedelta(days=150)) == [5.0, 4.0, 3.0]
+    assert exported(since=datetime.now(timezone.utc) - timedelta(days=10)) == [5.0, 4.0]
+
+    # Rebuilding from history (live + archive) finds nothing to fix
+    assert rebuild_all_stats(db, check_only=True, user_id=user.id) == []
+
+
+def test_retention_job_archives_in_the_background_and_stops(db):
+    user = _user(db)
+    _seed(db, user.id, [90, 60, 45, 1])
+    job = RetentionJob(SessionLocal, max_age=timedelta(days=30), interval=0.05, batch_rows=2, pause=0).start()
+    try:
+        deadline = time.monotonic() + 5
+        while _archived(db, user.id) < 3 and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert _archived(db, user.id) == 3
+    finally:
+        job.stop(timeout=5)
+    assert not job._thread.is_alive()
+    assert job.stats()["runs"] >= 1 and job.stats()["failures"] == 0
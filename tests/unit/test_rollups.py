@@ -0,0 +1,105 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.models.calc_rollup import CalcRollup
+from app.services.rollups import aggregate, align_range, band_labels, get_timeseries, rebuild_rollups
+
+
+def test_aggregate_buckets_by_hour_and_day():
+    at = datetime(2026, 3, 1, 10, 15, tzinfo=timezone.utc)
+    aggs = aggregate([("add", 5.0, at), ("add", -3.0, at + timedelta(minutes=50)), (None, 2000.0, at)])
+
+    hour = aggs[("hour", datetime(2026, 3, 1, 10), "add")]
+    assert (hour.count, hour.total, hour.low, hour.high) == (1, 5.0, 5.0, 5.0)
+    day = aggs[("day", datetime(2026, 3, 1), "add")]
+    assert (day.count, day.total, day.low, day.high) == (2, 2.0, -3.0, 5.0)
+    assert dict(zip(band_labels(), aggs[("day", datetime(2026, 3, 1), "expression")].bands))[">=1000"] == 1
+    assert len(aggs) == 5
+
+
+def test_align_range_widens_to_whole_buckets():
+    start, end = align_range(
+        "hour", datetime(2026, 3, 1, 10, 15), datetime(2026, 3, 1, 12, 0, 1, tzinfo=timezone.utc), 100
+    )
+    assert (start, end) == (datetime(2026, 3, 1, 10), datetime(2026, 3, 1, 13))
+    start, end = align_range("day", None, datetime(2026, 3, 31), 100)
+    assert (start, end) == (datetime(2026, 3, 1), datetime(2026, 3, 31))
+
+    with pytest.raises(ValueError):
+        align_range("day", datetime(2026, 3, 2), datetime(2026, 3, 1), 100)
+    with pytest.raises(ValueError):
+        align_range("hour", datetime(2026, 1, 1), datetime(2026, 3, 1), 100)
+
+
+def test_backfill_matches_incremental_rollups(client):
+    from app.db.session import SessionLocal
+    from app.services.calc_service import create_calculation, create_calculations_batch
+    from app.services.user_service import create_user
+
+    db = SessionLocal()
+    try:
+        uid = uuid.uuid4().hex
+        user = create_user(db, f"roll_{uid}", f"roll_{uid}@example.com", "Password123!")
+        create_calculation(db, user.id, op="add", a=1, b=2)
+        create_calculation(db, user.id, expression="2 ^ 10")
+        create_calculations_batch(db, user.id, [("mul", 3, 4), ("div", 1, 0), ("sub", 1, 5)])
+
+        def snapshot():
+            rows = db.execute(select(CalcRollup).where(CalcRollup.user_id == user.id)).scalars().all()
+            return sorted(
+                (r.grain, r.bucket_start, r.op, r.calc_count, r.result_sum, r.result_min, r.result_max, r.band_2)
+                for r in rows
+            )
+
+        incremental = snapshot()
+        assert len(incremental) == 8  # 4 ops x 2 grains
+        assert rebuild_rollups(db, user_id=user.id, chunk_rows=2) == 4
+        db.expire_all()
+        assert snapshot() == incremental
+
+        start, end = align_range("day", None, None, 100)
+        timeseries = get_timeseries(db, user.id, "day", start, end)
+        assert sum(point["count"] for point in timeseries["series"]) == 4
+        assert [entry["op"] for entry in timeseries["by_op"]] == ["add", "expression", "mul", "sub"]
+        assert sum(timeseries["distribution"].values()) == 4
+    finally:
+        db.close()
+
+
+def test_generic_upsert_matches_on_conflict(client, monkeypatch):
+    from app.db.session import SessionLocal
+    from app.services import rollups
+    from app.services.user_service import create_user
+
+    db = SessionLocal()
+    try:
+        uid = uuid.uuid4().hex
+        user = create_user(db, f"roll_{uid}", f"roll_{uid}@example.com", "Password123!")
+        now = datetime.now(timezone.utc)
+        first = [("add", 3.0, now), ("add", -5.0, now)]
+        second = [("add", 50.0, now), ("mul", 2.0, now)]
+
+        def snapshot():
+            rows = db.execute(select(CalcRollup).where(CalcRollup.user_id == user.id)).scalars().all()
+            return sorted((r.grain, r.op, r.calc_count, r.result_sum, r.result_min, r.result_max) for r in rows)
+
+        rollups.upsert_rollups(db, user.id, aggregate(first))
+        rollups.upsert_rollups(db, user.id, aggregate(second))
+        db.commit()
+        expected = snapshot()
+        db.execute(delete(CalcRollup).where(CalcRollup.user_id == user.id))
+        db.commit()
+
+        # Dialects without ON CONFLICT take the update-then-insert path
+        monkeypatch.setattr(rollups, "_dialect_insert", lambda db: None)
+        rollups.upsert_rollups(db, user.id, aggregate(first))
+        rollups.upsert_rollups(db, user.id, aggregate(second))
+        db.commit()
+        db.expire_all()
+        assert snapshot() == expected
+        assert ("day", "add", 3, 48.0, -5.0, 50.0) in expected
+    finally:
+        db.close()
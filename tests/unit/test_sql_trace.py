@@ -0,0 +1,29 @@
+import pytest
+
+from app.core.sql_trace import QueryRecord, RequestTrace, normalize_statement, query_budget
+
+
+def test_normalize_statement_folds_literals_and_lists():
+    assert normalize_statement("SELECT *\n  FROM t WHERE id = 42 AND name = 'o''k'") == (
+        "SELECT * FROM t WHERE id = ? AND name = ?"
+    )
+    assert normalize_statement("SELECT * FROM t WHERE id IN (?, ?, ?)") == "SELECT * FROM t WHERE id IN (?...)"
+    assert normalize_statement("INSERT INTO t (a, b) VALUES (?, ?), (?, ?), (?, ?)") == (
+        "INSERT INTO t (a, b) VALUES (?...)..."
+    )
+
+
+def test_repeated_statements_are_reported_once_per_shape():
+    trace = RequestTrace({"method": "GET", "path": "/x"})
+    trace.queries += [QueryRecord(f"SELECT * FROM calculations WHERE id = {i}", 0.001, None) for i in range(6)]
+    trace.queries.append(QueryRecord("SELECT * FROM users WHERE id = 1", 0.001, None))
+
+    assert trace.repeated(5) == [("SELECT * FROM calculations WHERE id = ?", 6)]
+    assert trace.repeated(7) == []
+    assert trace.describe().startswith("GET /x: 7 queries")
+
+
+def test_query_budget_requires_a_matching_request():
+    with pytest.raises(AssertionError, match="no request matched"):
+        with query_budget(1, route="/nowhere"):
+            pass
@@ -0,0 +1,24 @@
+from app.core.startup_report import check, measure, parse_importtime
+from app.db.init_db import init_db, schema_fingerprint, stored_fingerprint
+
+SAMPLE = """\
+import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   app.core.config
+import time:      1500 |       2500 | app.main
+"""
+
+def test_parse_importtime_and_budget():
+    rows = parse_importtime(SAMPLE)
+    assert rows[0] == {"module": "app.core.config", "self_us": 120, "cumulative_us": 120, "depth": 1}
+    report = {"import_ms": 2.5, "eager_deferred_modules": ["numpy"]}
+    assert len(check(report, budget_ms=1)) == 2
+    assert check({**report, "eager_deferred_modules": []}, budget_ms=10) == []
+
+def test_init_db_skips_when_fingerprint_is_current():
+    init_db()
+    assert stored_fingerprint() == schema_fingerprint()
+    assert init_db() is False
+    assert init_db(force=True) is True
+
+def test_heavy_modules_stay_out_of_startup():
+    assert measure()["eager_deferred_modules"] == []
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from app.services.calculator import evaluate_expression
+from app.services.expression_engine import DIVISION_BY_ZERO, INPUTS_TOO_LARGE, compile_expression
+from app.services.sweep import SWEEP_DTYPE, SweepPlan, iter_sweep_binary
+
+def test_expression_with_variables():
+    assert evaluate_expression("(x + 3) * y", {"x": 1, "y": 2}) == 8
+    assert compile_expression("(x + 3) * y").variables == ("x", "y")
+    with pytest.raises(ValueError):
+        evaluate_expression("x + 1")
+
+def test_evaluate_array_masks_errors():
+    values, errors = compile_expression("1 / x + y ^ 2").evaluate_array(
+        {"x": np.array([1.0, 0.0, 2.0]), "y": np.array([1.0, 1.0, 2e6])}
+    )
+    assert values[0] == 2
+    assert np.isnan(values[1:]).all()
+    assert errors.tolist() == [0, DIVISION_BY_ZERO, INPUTS_TOO_LARGE]
+
+def test_grid_sweep_in_chunks():
+    plan = SweepPlan("x * 10 + y", {"x": {"start": 0, "stop": 3, "step": 1}, "y": [1, 2]}, mode="grid")
+    assert plan.rows == 6
+    chunks = list(plan.chunks(chunk_rows=4))
+    assert [offset for offset, _, _ in chunks] == [0, 4]
+    values = np.concatenate([v for _, v, _ in chunks])
+    assert values.tolist() == [1, 2, 11, 12, 21, 22]
+
+def test_zip_sweep_binary_output():
+    plan = SweepPlan("x / y", {"x": [1, 2, 3], "y": [1]}, mode="zip")
+    records = np.frombuffer(b"".join(iter_sweep_binary(plan)), dtype=SWEEP_DTYPE)
+    assert records["result"].tolist() == [1, 2, 3]
+    assert records["error"].tolist() == [0, 0, 0]
+
+def test_sweep_validation():
+    with pytest.raises(ValueError):
+        SweepPlan("x + y", {"x": [1, 2], "y": [1, 2, 3]})
+    with pytest.raises(ValueError):
+        SweepPlan("x", {"x": [1], "z": [2]})
@@ -0,0 +1,84 @@
+import uuid
+
+import pytest
+
+from app.db.init_db import init_db
+from app.db.session import SessionLocal
+from app.services.undo_store import DatabaseUndoStore, MemoryUndoStore
+
+
+@pytest.fixture(params=["memory", "database"])
+def store(request):
+    if request.param == "memory":
+        return MemoryUndoStore(depth=3, max_sessions=2)
+    init_db()
+    return DatabaseUndoStore(SessionLocal, depth=3)
+
+
+def test_undo_redo_round_trip(store):
+    key = uuid.uuid4().hex
+    store.push(key, {"n": 1})
+    store.push(key, {"n": 2})
+    assert store.undo(key) == {"n": 2}
+    assert store.redo(key) == {"n": 2}
+    assert store.undo(key) == {"n": 2}
+    assert store.undo(key) == {"n": 1}
+    assert store.undo(key) is None
+
+    # A new push discards the redo history
+    store.push(key, {"n": 3})
+    assert store.redo(key) is None
+
+
+def test_depth_is_bounded(store):
+    key = uuid.uuid4().hex
+    for n in range(10):
+        store.push(key, {"n": n})
+    assert [store.undo(key) for _ in range(4)] == [{"n": 9}, {"n": 8}, {"n": 7}, None]
+
+
+def test_memory_store_evicts_least_recent_session():
+    store = MemoryUndoStore(depth=3, max_sessions=2)
+    store.push("a", {"n": 1})
+    store.push("b", {"n": 2})
+    store.push("c", {"n": 3})
+    assert store.undo("a") is None
+    assert store.undo("c") == {"n": 3}
+    assert store.stats()["sessions"] == 2
+
+
+def test_concurrent_database_pushes_keep_distinct_seqs():
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import select
+    from app.models.undo_entry import UndoEntry
+
+    init_db()
+    store = DatabaseUndoStore(SessionLocal, depth=50)
+    key = uuid.uuid4().hex
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(lambda n: store.push(key, {"n": n}), range(20)))
+
+    with SessionLocal() as db:
+        seqs = db.execute(select(UndoEntry.seq).where(UndoEntry.owner == key)).scalars().all()
+    assert sorted(seqs) == list(range(1, 21))
+    assert len({store.undo(key)["n"] for _ in range(20)}) == 20
+
+
+def test_database_store_expires_idle_sessions():
+    from sqlalchemy import update
+    from app.models.undo_entry import UndoEntry
+
+    init_db()
+    store = DatabaseUndoStore(SessionLocal, depth=3, ttl=60)
+    idle, active = uuid.uuid4().hex, uuid.uuid4().hex
+    store.push(idle, {"n": 1})
+    store.push(idle, {"n": 2})
+    store.undo(idle)
+    store.push(active, {"n": 3})
+    with SessionLocal() as db:
+        db.execute(update(UndoEntry).where(UndoEntry.owner == idle).values(written_at=UndoEntry.written_at - 120))
+        db.commit()
+
+    assert store.expire() == 2
+    assert store.undo(idle) is None and store.redo(idle) is None
+    assert store.undo(active) == {"n": 3}
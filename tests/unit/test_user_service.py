@@ -29,3 +29,88 @@ def test_password_change_logic(client):
 
     finally:
         db.close()
+
+def test_login_rehashes_outdated_cost(client):
+    from passlib.context import CryptContext
+    from app.db.session import SessionLocal
+
+    db = SessionLocal()
+    uid = uuid.uuid4().hex
+    try:
+        user = create_user(db, f"user_{uid}", f"user_{uid}@example.com", "Password123!")
+        user.hashed_password = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=4).hash("Password123!")
+        db.commit()
+
+        assert authenticate(db, f"user_{uid}", "Password123!").id == user.id
+        db.refresh(user)
+        assert not user.hashed_password.startswith("$2b$04$")
+        assert verify_password("Password123!", user.hashed_password)
+    finally:
+        db.close()
+
+def test_hashing_overload_is_rejected(monkeypatch):
+    from app.core import security
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "password_hash_max_pending", 0)
+    with pytest.raises(security.HashingOverloaded):
+        security.hash_password("Password123!")
+
+def test_hashing_recovers_from_a_killed_worker(monkeypatch):
+    import os
+    import signal
+    from app.core import security
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "password_hash_workers", 1)
+    monkeypatch.setattr(settings, "bcrypt_rounds", 4)
+    security.shutdown_password_pool()
+    try:
+        hashed = security.hash_password("Password123!")
+        broken = security._pool
+        for process in list(broken._processes.values()):
+            os.kill(process.pid, signal.SIGKILL)
+
+        assert security.verify_password("Password123!", hashed)
+        assert security._pool is not broken
+        assert security.password_pool_stats()["pending"] == 0
+    finally:
+        security.shutdown_password_pool()
+
+def test_concurrent_first_writes_seed_stats_once(client):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from sqlalchemy import delete
+    from app.db.session import SessionLocal
+    from app.models.user_stats import UserStats
+    from app.services.calc_service import create_calculation, get_stats, rebuild_all_stats
+
+    db = SessionLocal()
+    uid = uuid.uuid4().hex
+    try:
+        user = create_user(db, f"user_{uid}", f"user_{uid}@example.com", "Password123!")
+        assert db.get(UserStats, user.id).calc_count == 0
+        # As for users registered before the stats table existed
+        db.execute(delete(UserStats).where(UserStats.user_id == user.id))
+        db.commit()
+
+        start = threading.Barrier(4)
+
+        def first_use(i):
+            session = SessionLocal()
+            try:
+                start.wait()
+                get_stats(session, user.id)
+                for n in range(5):
+                    create_calculation(session, user.id, op="add", a=float(n), b=0.0)
+            finally:
+                session.close()
+
+        with ThreadPoolExecutor(4) as pool:
+            list(pool.map(first_use, range(4)))
+
+        db.expire_all()
+        assert get_stats(db, user.id)["total_calculations"] == 20
+        assert rebuild_all_stats(db, check_only=True, user_id=user.id) == []
+    finally:
+        db.close()